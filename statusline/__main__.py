@@ -1,9 +1,69 @@
 #!/usr/bin/python3
-from statusline.status import DirectoryMinify
+import os
+import sys
+
+from statusline import client
+
+
+def command(argv: list):
+    """Handle the options other than plain rendering.
+    argparse is only imported here so the plain prompt doesn't pay for it.
+    :param argv: the command line arguments
+    """
+    # pylint: disable=import-outside-toplevel
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='statusline',
+        description='Display directory and repository stats for statusline.',
+    )
+    options = parser.add_mutually_exclusive_group(required=True)
+    options.add_argument('--daemon', action='store_true',
+                         help='serve statuslines over a unix socket')
+    options.add_argument('--coproc', action='store_true',
+                         help='answer a directory per line on stdin for a shell coprocess')
+    options.add_argument('--batch', nargs='*', metavar='PATH',
+                         help='print json lines for many directories (read from stdin if none)')
+    options.add_argument('--stats', action='store_true',
+                         help='print counters from the running daemon')
+    options.add_argument('--profile', nargs='?', const='', metavar='TRACE',
+                         help='summarise a trace file (defaults to $STATUSLINE_TRACE)')
+    options.add_argument('--select-backend', action='store_true',
+                         help='measure the backends on this repository and keep the fastest')
+    args = parser.parse_args(argv)
+    if args.daemon:
+        from statusline.daemon import serve
+        serve()
+    elif args.coproc:
+        from statusline import coproc
+        coproc.serve()
+    elif args.batch is not None:
+        from statusline import batch
+        batch.main(args.batch)
+    elif args.stats:
+        if (stats := client.request('stats')) is None:
+            raise SystemExit('no statusline daemon is running')
+        print(stats)
+    elif args.profile is not None:
+        from statusline.trace import profile
+        profile(args.profile)
+    elif args.select_backend:
+        import json
+        from statusline.backends import select
+        print(json.dumps(select(os.getcwd())))
+
 
 def main():
-    """Run statusline."""
-    print(DirectoryMinify().get_statusline())
+    """Run statusline.
+    The daemon is asked first so the in-process render (and its imports)
+    is only paid for when no daemon is running.
+    """
+    if sys.argv[1:]:
+        command(sys.argv[1:])
+    elif response := client.request(os.getcwd()):
+        print(response)
+    else:
+        from statusline.status import DirectoryMinify  # pylint: disable=import-outside-toplevel
+        print(DirectoryMinify().get_statusline())
 
 if __name__ == '__main__':
     main()
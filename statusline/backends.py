@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+import importlib
+import os
+import time
+from typing import Optional
+
+from statusline.cache import Memo, cache_dir
+from statusline.git import Backend, Git, Repository
+
+
+# Each backend's module is only imported when it is used or measured
+BACKENDS = {
+    'git': ('statusline.git', 'Git'),
+    'pygit2': ('statusline.libgit', 'LibGit'),
+    'index': ('statusline.index', 'IndexGit'),
+}
+
+
+def load(name: str) -> type[Backend]:
+    """Import a backend class by name.
+    :param name: a key of BACKENDS
+    :return: the backend class
+    :raises KeyError: if there is no backend of that name
+    :raises ImportError: if the backend's optional dependency isn't installed
+    """
+    module, attribute = BACKENDS[name]
+    backend: type[Backend] = getattr(importlib.import_module(module), attribute)
+    return backend
+
+
+def available() -> dict[str, type[Backend]]:
+    """Find the backends which can be used here.
+    :return: the name of each importable backend mapped to its class
+    """
+    result = {}
+    for name in BACKENDS:
+        try:
+            result[name] = load(name)
+        except ImportError:
+            pass
+    return result
+
+
+def _choices() -> Memo:
+    """Open the backends chosen by select for each repository.
+    :return: the Memo mapping repository roots to backend names
+    """
+    return Memo(os.path.join(cache_dir(), 'backends.json'))
+
+
+def selected_backend(root: Optional[str] = None) -> type[Backend]:
+    """Choose the backend to render a repository with.
+    STATUSLINE_BACKEND overrides the choice select persisted for the repository,
+    git is used when neither names a backend that can be imported.
+    :param root: the repository root, None if it isn't known
+    :return: the backend class
+    """
+    if not (name := os.environ.get('STATUSLINE_BACKEND')):
+        if not root or not (name := _choices().get(root)):
+            return Git
+    try:
+        return load(name)
+    except (KeyError, ImportError):
+        return Git
+
+
+def discover(start: str) -> Optional[Backend]:
+    """Create the selected backend for the repository containing a directory.
+    :param start: the directory to look from
+    :return: the backend rooted at the repository, None if start isn't in one
+    """
+    if not (repository := Repository.discover(start)):
+        return None
+    return selected_backend(repository.worktree).discover(start)
+
+
+def _sample(backend: type[Backend], root: str) -> tuple[float, tuple]:
+    """Answer every query once from a cold backend.
+    Memoized counts, learned costs and parsed indexes are dropped so the work is measured.
+    :param backend: the backend class
+    :param root: the repository root
+    :return: the elapsed milliseconds and the answers given
+    """
+    # Only select samples so prompts don't pay for the import
+    from statusline.index import INDEXES  # pylint: disable=import-outside-toplevel
+    INDEXES.clear()
+    start = time.perf_counter()
+    vcs = backend(root)
+    if isinstance(vcs, Git):
+        vcs.memo = vcs.costs = None
+    answers = (vcs.branch, vcs.ahead_behind(), vcs.status(), vcs.stashes())
+    return 1000 * (time.perf_counter() - start), answers
+
+
+def select(start: str, runs: int = 5) -> dict:
+    """Measure the available backends on a repository and persist the fastest for it.
+    Backends whose answers differ from git's aren't eligible.
+    :param start: a directory in the repository to measure
+    :param runs: the number of samples per backend
+    :return: the chosen backend, the median milliseconds of each and any that disagreed,
+        no backend is chosen (nor the previous choice replaced) if none was eligible
+    :raises ValueError: if start isn't in a repository
+    """
+    # Only needed when selecting so it isn't paid for on every prompt
+    from statusline.bench import percentile  # pylint: disable=import-outside-toplevel,cyclic-import
+    if not (repository := Repository.discover(start)):
+        raise ValueError(f'{start} is not in a git repository')
+    root = repository.worktree
+    reference = _sample(Git, root)[1]
+    timings = {}
+    mismatched = []
+    for name, backend in available().items():
+        samples = [_sample(backend, root) for _ in range(runs)]
+        if any(answers != reference for _, answers in samples):
+            mismatched.append(name)
+            continue
+        timings[name] = percentile([elapsed for elapsed, _ in samples], 0.5)
+    if not timings:
+        # The repository changed while it was measured so even git disagreed
+        return {'backend': None, 'median_ms': timings, 'mismatched': mismatched}
+    choice = min(timings, key=timings.__getitem__)
+    _choices().put(root, choice)
+    return {'backend': choice, 'median_ms': timings, 'mismatched': mismatched}
@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+import json
+import os
+import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from subprocess import CalledProcessError
+from typing import Iterable, Iterator, Optional
+
+from statusline.backends import selected_backend
+from statusline.git import Repository
+from statusline.status import DirectoryMinify
+
+
+def _render_repository(root: str, paths: list) -> list:
+    """Render every path within one repository from a single snapshot.
+    :param root: the repository root
+    :param paths: the requested paths and their absolute forms
+    :return: a result for each path
+    """
+    git = selected_backend(root)(root)
+    minify = DirectoryMinify(git)
+    results = []
+    for requested, absolute in paths:
+        try:
+            results.append({'path': requested, 'statusline': minify.get_statusline(absolute)})
+        except (OSError, CalledProcessError) as error:
+            results.append({'path': requested, 'error': str(error)})
+    return results
+
+
+def render(paths: Iterable[str], workers: Optional[int] = None) -> Iterator[dict]:
+    """Render statuslines for many directories yielding each as it completes.
+    Paths are grouped by repository so each repository runs git once,
+    different repositories are rendered concurrently.
+    :param paths: the directories to describe
+    :param workers: the most repositories processed at once (defaults to the cpu count)
+    :return: dicts holding the requested path and its statusline (or an error)
+    """
+    groups: dict = defaultdict(list)
+    minify = DirectoryMinify()
+    for requested in paths:
+        absolute = os.path.abspath(requested)
+        if repository := Repository.discover(absolute):
+            groups[repository.worktree].append((requested, absolute))
+        else:
+            # Nothing to wait for so these are answered straight away
+            yield {'path': requested, 'statusline': minify.minify_path(absolute)}
+    if not groups:
+        return
+    with ThreadPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(groups))) as pool:
+        futures = [
+            pool.submit(_render_repository, root, members) for root, members in groups.items()
+        ]
+        for future in as_completed(futures):
+            yield from future.result()
+
+
+def main(paths: list, workers: Optional[int] = None):
+    """Print a json object per line for each path as soon as it is rendered.
+    :param paths: the directories to describe, read a line at a time from stdin when empty
+    :param workers: the most repositories processed at once
+    """
+    source = paths or (line.rstrip('\n') for line in sys.stdin if line.strip())
+    for result in render(source, workers):
+        print(json.dumps(result), flush=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
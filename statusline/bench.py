@@ -0,0 +1,214 @@
+#!/usr/bin/python3
+import argparse
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, asdict
+
+
+# Keep synthetic repositories independent of the user's git configuration
+GIT_ENV = {
+    'GIT_CONFIG_GLOBAL': os.devnull,
+    'GIT_CONFIG_NOSYSTEM': '1',
+    'GIT_AUTHOR_NAME': 'bench',
+    'GIT_AUTHOR_EMAIL': 'bench@localhost',
+    'GIT_COMMITTER_NAME': 'bench',
+    'GIT_COMMITTER_EMAIL': 'bench@localhost',
+}
+
+
+@dataclass
+class Scenario:  # pylint: disable=too-many-instance-attributes
+    """Parameters for a synthetic repository."""
+
+    tracked: int = 10
+    modified: int = 0
+    untracked: int = 0
+    ahead: int = 0
+    behind: int = 0
+    stashes: int = 0
+    worktrees: int = 0
+    depth: int = 0
+
+
+def _git(cwd: str, *args: str):
+    """Run git quietly for repository setup.
+    :param cwd: the directory to run in
+    :param args: the git subcommand and options
+    """
+    subprocess.run(
+        ['git', *args], cwd=cwd, check=True, capture_output=True,
+        env={**os.environ, **GIT_ENV},
+    )
+
+
+def _write(name: str, content: str):
+    """Write a file creating parent directories as needed.
+    :param name: the file path
+    :param content: the text to write
+    """
+    os.makedirs(os.path.dirname(name), exist_ok=True)
+    with open(name, 'w', encoding='utf-8') as file:
+        file.write(content)
+
+
+def _tracked_file(repo: str, index: int) -> str:
+    """Name a tracked file spreading them over directories of 100.
+    :param repo: the repository root
+    :param index: the file number
+    :return: the path of the file
+    """
+    return os.path.join(repo, 'src', f'd{index // 100}', f'f{index}.txt')
+
+
+def build(scenario: Scenario, base: str) -> str:
+    """Create a repository and local bare remote matching a scenario.
+    :param scenario: the shape of the repository
+    :param base: an empty directory to build in
+    :return: the directory renders should be run from
+    """
+    remote = os.path.join(base, 'remote.git')
+    repo = os.path.join(base, 'repo')
+    os.makedirs(repo)
+    _git(base, 'init', '-q', '--bare', remote)
+    _git(repo, 'init', '-q', '-b', 'master')
+    for index in range(max(scenario.tracked, scenario.modified, scenario.stashes, 1)):
+        _write(_tracked_file(repo, index), f'{index}\n')
+    _git(repo, 'add', '-A')
+    _git(repo, 'commit', '-q', '-m', 'initial')
+    for index in range(scenario.behind):
+        _git(repo, 'commit', '-q', '--allow-empty', '-m', f'remote {index}')
+    _git(repo, 'remote', 'add', 'origin', remote)
+    _git(repo, 'push', '-q', '-u', 'origin', 'master')
+    if scenario.behind:
+        _git(repo, 'reset', '-q', '--hard', f'HEAD~{scenario.behind}')
+    for index in range(scenario.ahead):
+        _git(repo, 'commit', '-q', '--allow-empty', '-m', f'local {index}')
+    for index in range(scenario.stashes):
+        _write(_tracked_file(repo, index), 'stashed\n')
+        _git(repo, 'stash', '-q')
+    for index in range(scenario.worktrees):
+        _git(repo, 'worktree', 'add', '-q', '-b', f'wt{index}', os.path.join(base, f'wt{index}'))
+    for index in range(scenario.modified):
+        _write(_tracked_file(repo, index), 'modified\n')
+    for index in range(scenario.untracked):
+        _write(os.path.join(repo, 'build', f'u{index // 100}', f'u{index}.o'), '')
+    cwd = os.path.join(repo, *(f'n{level}' for level in range(scenario.depth)))
+    os.makedirs(cwd, exist_ok=True)
+    return cwd
+
+
+def render_once() -> dict:
+    """Render in this interpreter counting the git processes it spawns.
+    This is run in a fresh interpreter per sample so peak RSS is per render.
+    :return: timings, git process count, peak RSS and the rendered line
+    """
+    start = time.perf_counter()
+    # pylint: disable-next=import-outside-toplevel
+    from statusline import git, status
+    imported = time.perf_counter()
+    spawned = []
+    original_run, original_popen = git.run, git.Popen
+
+    def counting_run(*args, **kwargs):
+        spawned.append(args[0])
+        return original_run(*args, **kwargs)  # pylint: disable=subprocess-run-check
+
+    def counting_popen(*args, **kwargs):
+        spawned.append(args[0])
+        return original_popen(*args, **kwargs)  # pylint: disable=consider-using-with
+
+    git.run, git.Popen = counting_run, counting_popen  # type: ignore[misc,assignment]
+    try:
+        line = status.DirectoryMinify().get_statusline()
+    finally:
+        git.run, git.Popen = original_run, original_popen  # type: ignore[misc]
+    end = time.perf_counter()
+    return {
+        'import_ms': 1000 * (imported - start),
+        'render_ms': 1000 * (end - imported),
+        'git_processes': len(spawned),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'output': line,
+    }
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Nearest-rank percentile.
+    :param values: the samples
+    :param fraction: the percentile as a fraction eg. 0.95
+    :return: the smallest sample with at least fraction of samples at or below it
+    """
+    ordered = sorted(values)
+    return float(ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)])
+
+
+def measure(cwd: str, runs: int = 10) -> dict:
+    """Render repeatedly from a directory each in a fresh interpreter.
+    The daemon is bypassed so the in-process backends are what get measured.
+    :param cwd: the directory to render from
+    :param runs: the number of samples
+    :return: p50/p95 latencies with the git process count and peak RSS
+    """
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, '-m', 'statusline.bench', '--render'],
+            cwd=cwd, check=True, capture_output=True, text=True,
+        ).stdout
+        sample = json.loads(output)
+        sample['wall_ms'] = 1000 * (time.perf_counter() - start)
+        samples.append(sample)
+    result: dict = {'runs': runs, 'output': samples[-1]['output']}
+    for key in ('wall_ms', 'import_ms', 'render_ms'):
+        values = [sample[key] for sample in samples]
+        result[key.replace('_ms', '_p50_ms')] = percentile(values, 0.5)
+        result[key.replace('_ms', '_p95_ms')] = percentile(values, 0.95)
+    result['git_processes'] = max(sample['git_processes'] for sample in samples)
+    result['peak_rss_kb'] = max(sample['peak_rss_kb'] for sample in samples)
+    return result
+
+
+def run(scenario: Scenario, runs: int = 10) -> dict:
+    """Build a scenario in a throwaway directory and measure it.
+    :param scenario: the shape of the repository
+    :param runs: the number of samples
+    :return: the scenario parameters merged with its measurements
+    """
+    with tempfile.TemporaryDirectory(prefix='statusline-bench-') as base:
+        cwd = build(scenario, base)
+        return {**asdict(scenario), **measure(cwd, runs)}
+
+
+def main():
+    """Run a benchmark scenario printing one json object per line."""
+    parser = argparse.ArgumentParser(
+        prog='statusline.bench',
+        description='Measure statusline against a synthetic repository.',
+    )
+    parser.add_argument('--render', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--runs', type=int, default=10, help='samples per scenario')
+    for name, default in asdict(Scenario()).items():
+        parser.add_argument(f'--{name}', type=int, nargs='+', default=[default])
+    args = parser.parse_args()
+    if args.render:
+        print(json.dumps(render_once()))
+        return
+    # Every combination of the given values is measured
+    scenarios = [{}]
+    for name in asdict(Scenario()):
+        scenarios = [
+            {**params, name: value} for params in scenarios for value in getattr(args, name)
+        ]
+    for params in scenarios:
+        print(json.dumps(run(Scenario(**params), args.runs)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+#!/usr/bin/python3
+import json
+import os
+import sys
+import threading
+import time
+from typing import Optional
+
+
+def cache_dir() -> str:
+    """Find the directory persistent statusline data is kept in.
+    :return: statusline directory within $XDG_CACHE_HOME (or ~/.cache)
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'statusline')
+
+
+def write_json(name: str, value):
+    """Write a json file atomically.
+    The temporary file is named for the process and thread writing it so
+    concurrent writers (eg. daemon threads) never share one.
+    :param name: the file to replace
+    :param value: any json serialisable value
+    """
+    os.makedirs(os.path.dirname(name), exist_ok=True)
+    temp = f'{name}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp, 'w', encoding='utf-8') as file:
+        json.dump(value, file)
+    os.replace(temp, name)
+
+
+def signature(files: list) -> list:
+    """Stat each file to detect changes without reading them.
+    :param files: the paths whose changes invalidate a result
+    :return: the (mtime, size) of each path, None for missing paths
+    """
+    result: list = []
+    for name in files:
+        try:
+            stat = os.stat(name)
+            result.append([stat.st_mtime_ns, stat.st_size])
+        except OSError:
+            result.append(None)
+    return result
+
+
+class ResultCache:
+    """Persist rendered results keyed by the stat signature of the files they depend on.
+
+    Working copy edits don't touch .git so entries also expire after ttl seconds.
+    When stale is set an expired entry is returned immediately
+    while a detached process renders the replacement.
+    """
+
+    LOCK_TIMEOUT = 30
+
+    def __init__(self, directory: str, size: int = 256, ttl: float = 5.0, stale: bool = False):
+        """Create a cache over a directory of entries.
+        :param directory: where entry files are kept
+        :param size: the most entries to keep before evicting the oldest
+        :param ttl: seconds an entry with a matching signature stays fresh
+        :param stale: whether to serve expired entries while refreshing in background
+        """
+        self.directory = directory
+        self.size = size
+        self.ttl = ttl
+        self.stale = stale
+
+    @classmethod
+    def from_environ(cls) -> Optional['ResultCache']:
+        """Build the cache configured by the environment.
+        STATUSLINE_CACHE enables the cache ('stale' also allows stale-while-revalidate)
+        with STATUSLINE_CACHE_TTL and STATUSLINE_CACHE_SIZE tuning it.
+        :return: the configured cache, None if it is disabled
+        """
+        mode = os.environ.get('STATUSLINE_CACHE', '')
+        if mode in ('', '0', 'off'):
+            return None
+        return cls(
+            # Apart from the memos so eviction only ever removes entries
+            os.path.join(cache_dir(), 'results'),
+            size=int(os.environ.get('STATUSLINE_CACHE_SIZE', 256)),
+            ttl=float(os.environ.get('STATUSLINE_CACHE_TTL', 5.0)),
+            stale=mode == 'stale',
+        )
+
+    def _entry(self, root: str) -> str:
+        """Name the entry file for a repository.
+        :param root: the repository root
+        :return: the path of the entry file
+        """
+        # Escaped like vim's undodir names which avoids importing hashlib
+        name = root.replace('%', '%%').replace(os.sep, '%')
+        return os.path.join(self.directory, f'{name}.json')
+
+    def load(self, root: str) -> Optional[dict]:
+        """Read the entry for a repository.
+        :param root: the repository root
+        :return: the stored entry if there is one
+        """
+        try:
+            with open(self._entry(root), encoding='utf-8') as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get('root') == root else None
+
+    def store(self, root: str, key: list, value: str):
+        """Write the entry for a repository, evicting old entries if needed.
+        The signature is taken before rendering by callers so a change made
+        during the render leaves the entry invalid rather than wrongly fresh.
+        :param root: the repository root
+        :param key: the signature of the paths the value depends on
+        :param value: the rendered result
+        """
+        name = self._entry(root)
+        new = not os.path.exists(name)
+        write_json(name, {'root': root, 'key': key, 'value': value, 'time': time.time()})
+        if new:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently written entries beyond the size limit."""
+        entries = [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith('.json')
+        ]
+        if len(entries) > self.size:
+            entries.sort(key=os.path.getmtime)
+            for name in entries[:len(entries) - self.size]:
+                os.unlink(name)
+
+    def lookup(self, root: str, key: list, columns: Optional[int] = None) -> Optional[str]:
+        """Get the usable result for a repository.
+        :param root: the repository root
+        :param key: the current signature of the paths the result depends on
+        :param columns: the width the result is rendered for, passed on to refresh it
+        :return: the cached result if it is fresh (or stale is allowed), else None
+        """
+        entry = self.load(root)
+        if entry and entry['key'] == key and time.time() - entry['time'] < self.ttl:
+            return str(entry['value'])
+        if entry and self.stale:
+            self.revalidate(root, columns)
+            return str(entry['value'])
+        return None
+
+    def revalidate(self, root: str, columns: Optional[int] = None):
+        """Start a detached process to refresh an entry.
+        A lock file prevents piling up refreshes of the same repository.
+        :param root: the repository root
+        :param columns: the width to render for, None if it is unlimited
+        """
+        lock = f'{self._entry(root)}.lock'
+        try:
+            if time.time() - os.path.getmtime(lock) < self.LOCK_TIMEOUT:
+                return
+            os.unlink(lock)
+        except OSError:
+            pass
+        try:
+            os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return
+        # Only needed when refreshing so it isn't paid for on a cache hit
+        from subprocess import Popen, DEVNULL  # pylint: disable=import-outside-toplevel
+        Popen(  # pylint: disable=consider-using-with
+            [sys.executable, '-m', 'statusline.cache', root, lock]
+            + ([str(columns)] if columns is not None else []),
+            stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL,
+            start_new_session=True,
+        )
+
+
+class Memo:
+    """Small persistent mapping of string keys to json values.
+    Only the most recently added size entries are kept.
+    """
+
+    def __init__(self, path: str, size: int = 256):
+        """Create a memo backed by a json file.
+        :param path: the file entries are kept in
+        :param size: the most entries to keep
+        """
+        self.path = path
+        self.size = size
+        self._entries: Optional[dict] = None
+        self._lock = threading.Lock()
+
+    @property
+    def entries(self) -> dict:
+        """Property for the stored entries, loaded on first use.
+        :return: the mapping of keys to values
+        """
+        if self._entries is None:
+            try:
+                with open(self.path, encoding='utf-8') as file:
+                    self._entries = json.load(file)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def get(self, key: str):
+        """Look up a stored value.
+        :param key: the key the value was stored under
+        :return: the value, None if it isn't stored
+        """
+        return self.entries.get(key)
+
+    def put(self, key: str, value):
+        """Store a value writing the file atomically.
+        :param key: the key to store the value under
+        :param value: any json serialisable value
+        """
+        with self._lock:
+            entries = self.entries
+            entries.pop(key, None)
+            entries[key] = value
+            for old in list(entries)[:-self.size]:
+                del entries[old]
+            write_json(self.path, entries)
+
+
+class SubmoduleCache:
+    """Remember which submodules have changes so only those that moved are scanned again.
+
+    Each answer is keyed by the submodule's own index and HEAD signature
+    and commit. Edits to a submodule's working copy touch neither so answers
+    also expire after ttl seconds, like ResultCache entries.
+    """
+
+    def __init__(self, memo: Memo, ttl: float = 60.0):
+        """Create a cache over a memo.
+        :param memo: where answers are persisted
+        :param ttl: seconds an answer with a matching key stays fresh
+        """
+        self.memo = memo
+        self.ttl = ttl
+
+    @classmethod
+    def from_environ(cls) -> Optional['SubmoduleCache']:
+        """Build the cache configured by the environment.
+        STATUSLINE_SUBMODULES=cached enables it and STATUSLINE_SUBMODULE_TTL tunes it.
+        :return: the configured cache, None if submodules are left to git status
+        """
+        if os.environ.get('STATUSLINE_SUBMODULES') != 'cached':
+            return None
+        return cls(
+            Memo(os.path.join(cache_dir(), 'submodules.json'), size=1024),
+            ttl=float(os.environ.get('STATUSLINE_SUBMODULE_TTL', 60.0)),
+        )
+
+    def get(self, name: str, key: list, expires: bool = True):
+        """Look up an answer.
+        :param name: what the answer is about eg. the submodule's git dir
+        :param key: the current signature the answer depends on
+        :param expires: whether the answer is only trusted for ttl seconds
+        :return: the answer if it is fresh, else None
+        """
+        entry = self.memo.get(name)
+        if not entry or entry['key'] != key:
+            return None
+        if expires and time.time() - entry['time'] >= self.ttl:
+            return None
+        return entry['value']
+
+    def put(self, name: str, key: list, value):
+        """Store an answer.
+        :param name: what the answer is about
+        :param key: the signature taken before the answer was found
+        :param value: any json serialisable answer
+        """
+        self.memo.put(name, {'key': key, 'value': value, 'time': time.time()})
+
+
+def refresh(root: str, lock: str, columns: Optional[int] = None):
+    """Render and store the result for a repository then release its lock.
+    :param root: the repository root
+    :param lock: the lock file taken by revalidate
+    :param columns: the width to render for, None if it is unlimited
+    """
+    from statusline.git import Git  # pylint: disable=import-outside-toplevel,cyclic-import
+    try:
+        git = Git(root)
+        cache = ResultCache.from_environ()
+        if cache and git.repository:
+            key = git.cache_key(columns)
+            value = git.render_stats(columns)
+            if not git.partial:
+                cache.store(root, key, value)
+    finally:
+        os.unlink(lock)
+
+
+if __name__ == '__main__':
+    refresh(sys.argv[1], sys.argv[2], *map(int, sys.argv[3:4]))
@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+import os
+import stat
+
+
+def socket_path() -> str:
+    """Find the unix socket the statusline daemon listens on.
+    STATUSLINE_SOCKET takes priority, otherwise the socket is kept
+    per-user in the runtime dir (or a private directory in the temp dir
+    if there isn't one).
+    :return: the path to the daemon socket
+    """
+    if override := os.environ.get('STATUSLINE_SOCKET'):
+        return override
+    if runtime := os.environ.get('XDG_RUNTIME_DIR'):
+        return os.path.join(runtime, f'statusline-{os.getuid()}.sock')
+    # tempfile.gettempdir would cost more to import than the whole request
+    temp = os.environ.get('TMPDIR') or '/tmp'
+    return os.path.join(temp, f'statusline-{os.getuid()}', 'daemon.sock')
+
+
+def request(line: str, timeout: float = 1.0) -> str | None:
+    """Send a single request line to the daemon.
+    This imports nothing beyond the standard library (not even typing) so asking
+    the daemon is cheaper than rendering in-process, socket is only imported
+    once there is a socket file to connect to. Sockets another user owns
+    aren't trusted with the working directory or to answer it.
+    :param line: the request, either a directory or a command such as stats
+    :param timeout: seconds to wait for the daemon before giving up
+    :return: the response line, None if the daemon is unavailable
+    """
+    address = socket_path()
+    try:
+        info = os.stat(address)
+    except OSError:
+        return None
+    if not stat.S_ISSOCK(info.st_mode) or info.st_uid != os.getuid():
+        return None
+    import socket  # pylint: disable=import-outside-toplevel
+    try:
+        with socket.socket(socket.AF_UNIX) as conn:
+            conn.settimeout(timeout)
+            conn.connect(address)
+            conn.sendall(f'{line}\n'.encode('utf-8'))
+            conn.shutdown(socket.SHUT_WR)
+            chunks = []
+            while chunk := conn.recv(4096):
+                chunks.append(chunk)
+    except OSError:
+        return None
+    return b''.join(chunks).decode('utf-8').rstrip('\n') or None
+
+
+if __name__ == '__main__':
+    print(request(os.getcwd()))
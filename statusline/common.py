@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+import os
+import threading
+from collections import OrderedDict
+from os import path
+from typing import Any, Callable, Optional, TypeVar, cast
+
+T = TypeVar('T')
+
+
+class CommonCache:
+    """Share what is parsed from a repository's common git dir between its worktrees.
+
+    Linked worktrees keep packed-refs, config, remote refs and the stash in the
+    main git dir so entries are grouped by that directory rather than by
+    worktree. Each file's parse is reused while its mtime, size and inode
+    match, git replaces these files by renaming a lock file over them.
+    Callers must treat the returned values as read-only.
+    """
+
+    def __init__(self, size: int = 64):
+        """Create an empty cache.
+        :param size: the most common dirs to remember before forgetting the idlest
+        """
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._dirs: OrderedDict[str, dict[str, tuple[tuple, Any]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Count the common dirs currently remembered."""
+        return len(self._dirs)
+
+    def load(self, common_dir: str, name: str, parse: Callable[[str], T]) -> Optional[T]:
+        """Read and parse a file from a common git dir reusing the previous parse if unchanged.
+        :param common_dir: the repository's common git dir
+        :param name: the file path relative to common_dir
+        :param parse: turns the file contents into the cached value
+        :return: the parsed contents, None if the file doesn't exist
+        """
+        filename = path.join(common_dir, name)
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        with self._lock:
+            entries = self._dirs.get(common_dir)
+            if entries and (entry := entries.get(name)) and entry[0] == key:
+                self.hits += 1
+                self._dirs.move_to_end(common_dir)
+                return cast(T, entry[1])
+            self.misses += 1
+        try:
+            with open(filename, encoding='utf-8') as file:
+                value = parse(file.read())
+        except OSError:
+            return None
+        with self._lock:
+            self._dirs.setdefault(common_dir, {})[name] = (key, value)
+            self._dirs.move_to_end(common_dir)
+            if len(self._dirs) > self.size:
+                self._dirs.popitem(last=False)
+        return value
+
+
+# Shared so every worktree of a repository reuses the same parses in long-lived modes
+COMMON = CommonCache()
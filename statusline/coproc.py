@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+import os
+import sys
+from subprocess import CalledProcessError
+from typing import Optional, TextIO
+
+from statusline.backends import selected_backend
+from statusline.git import Backend, Repository
+from statusline.status import DirectoryMinify
+from statusline.watch import Watcher
+
+
+class Coprocess:
+    """Render statuslines for one shell keeping git state between prompts.
+    The backend instance is reused while the shell stays in the same repository
+    and only refreshed when the watcher reports relevant changes.
+    """
+
+    def __init__(self):
+        self.root: Optional[str] = None
+        self.git: Optional[Backend] = None
+        self.watcher = Watcher.from_environ()
+
+    def render(self, path: str) -> str:
+        """Generate the statusline for a directory.
+        :param path: the absolute directory to describe
+        :return: the minified path with VCS status if available
+        """
+        if not (repository := Repository.discover(path)):
+            return DirectoryMinify().minify_path(path)
+        changed = not self.watcher or self.watcher.dirty(repository)
+        if self.git is None or repository.worktree != self.root:
+            self.root = repository.worktree
+            self.git = selected_backend(self.root)(self.root)
+        elif changed or self.git.partial:
+            self.git.refresh()
+        else:
+            self.git.restart_budget()
+        return DirectoryMinify(self.git).get_statusline(path)
+
+    def handle(self, line: str) -> str:
+        """Answer one request line.
+        Requests are the working directory optionally followed by the exit
+        status of the last command and the terminal width, separated by tabs.
+        The exit status is accepted so shells can always send $? but isn't shown.
+        :param line: the request without its newline
+        :return: the response, empty if the request couldn't be rendered
+        """
+        path, _, rest = line.partition('\t')
+        columns = rest.partition('\t')[2]
+        if columns.isdigit():
+            os.environ['COLUMNS'] = columns
+        if not path.startswith(os.sep):
+            return ''
+        try:
+            return self.render(path)
+        except (OSError, CalledProcessError):
+            return ''
+
+
+def serve(stdin: TextIO = sys.stdin, stdout: TextIO = sys.stdout):
+    """Answer requests until stdin is closed writing one line per request.
+    :param stdin: where request lines are read from
+    :param stdout: where rendered statuslines are written to
+    """
+    coprocess = Coprocess()
+    for line in stdin:
+        response = coprocess.handle(line.rstrip('\n'))
+        stdout.write(f'{response}\n')
+        stdout.flush()
+
+
+if __name__ == '__main__':
+    serve()
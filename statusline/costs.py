@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+import json
+import os
+import time
+from typing import Optional
+
+from statusline.cache import cache_dir, write_json
+
+
+# Progressively cheaper ways to run git status as (config, status options).
+# Levels from REDUCED onwards no longer report everything.
+LEVELS: tuple[tuple[list, list], ...] = (
+    ([], []),
+    (['-c', 'core.untrackedCache=true'], []),
+    (['-c', 'core.untrackedCache=true'], ['--ignore-submodules=all']),
+    (['-c', 'core.untrackedCache=true'], ['--ignore-submodules=all', '--untracked-files=no']),
+)
+REDUCED = 2
+
+
+class CostModel:
+    """Learn how long git status takes per repository and degrade slow ones.
+
+    After strikes consecutive slow runs a repository moves one level cheaper.
+    Once probe seconds pass a degraded repository is tried one level richer,
+    staying there if that run is fast enough.
+    """
+
+    def __init__(self, path: str, threshold: float = 300, strikes: int = 3, probe: float = 3600):
+        """Create a model persisted to a json file.
+        :param path: the file the learned levels are kept in
+        :param threshold: milliseconds above which a run counts as slow
+        :param strikes: consecutive slow runs before degrading
+        :param probe: seconds between attempts at a richer level
+        """
+        self.path = path
+        self.threshold = threshold
+        self.strikes = strikes
+        self.probe = probe
+        self._repos: Optional[dict] = None
+
+    @classmethod
+    def from_environ(cls) -> Optional['CostModel']:
+        """Build the model configured by the environment.
+        STATUSLINE_ADAPTIVE=off disables it, STATUSLINE_SLOW_MS and
+        STATUSLINE_PROBE_S tune the threshold and probe interval.
+        :return: the configured model, None if it is disabled
+        """
+        if os.environ.get('STATUSLINE_ADAPTIVE') in ('0', 'off'):
+            return None
+        return cls(
+            os.path.join(cache_dir(), 'costs.json'),
+            threshold=float(os.environ.get('STATUSLINE_SLOW_MS', 300)),
+            probe=float(os.environ.get('STATUSLINE_PROBE_S', 3600)),
+        )
+
+    @property
+    def repos(self) -> dict:
+        """Property for the learned state of each repository, loaded on first use.
+        :return: mapping of repository root to its level, strike count and last probe
+        """
+        if self._repos is None:
+            try:
+                with open(self.path, encoding='utf-8') as file:
+                    self._repos = json.load(file)
+            except (OSError, ValueError):
+                self._repos = {}
+        return self._repos
+
+    def _save(self):
+        """Write the learned state atomically so other shells see it."""
+        write_json(self.path, self.repos)
+
+    def level(self, root: str) -> int:
+        """Choose how cheaply to run git status for a repository.
+        :param root: the repository root
+        :return: an index into LEVELS, one below the learned level when probing
+        """
+        entry = self.repos.get(root)
+        if not entry or not entry['level']:
+            return 0
+        if time.time() - entry['probe'] >= self.probe:
+            return int(entry['level']) - 1
+        return int(entry['level'])
+
+    def record(self, root: str, level: int, elapsed: float):
+        """Learn from a git status run, only writing when something changed.
+        :param root: the repository root
+        :param level: the level the run used
+        :param elapsed: how long it took in milliseconds (including timeouts)
+        """
+        entry = self.repos.get(root) or {'level': 0, 'strikes': 0, 'probe': 0.0}
+        before = dict(entry)
+        if elapsed <= self.threshold:
+            entry['strikes'] = 0
+            if level < entry['level']:
+                # A successful probe steps back up to the richer level
+                entry.update(level=level, probe=time.time())
+        elif level < entry['level']:
+            # A failed probe waits for the next interval
+            entry['probe'] = time.time()
+        elif level + 1 < len(LEVELS):
+            entry['strikes'] += 1
+            if entry['strikes'] >= self.strikes:
+                entry.update(level=level + 1, strikes=0, probe=time.time())
+        if entry != before:
+            self.repos[root] = entry
+            self._save()
@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+from subprocess import CalledProcessError
+from typing import Optional
+
+from statusline.client import socket_path
+from statusline.common import COMMON
+from statusline.index import INDEXES
+from statusline.backends import selected_backend
+from statusline.git import Backend, Repository
+from statusline.status import DirectoryMinify, PATHS
+from statusline.watch import Watcher
+
+
+class RepoCache:
+    """Least recently used mapping of repository root to a warm backend instance."""
+
+    def __init__(self, size: int = 32):
+        """Create an empty cache.
+        :param size: the most repositories to keep before evicting the idlest
+        """
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._repos: OrderedDict[str, tuple[Backend, threading.Lock]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Count the repositories currently held."""
+        return len(self._repos)
+
+    def get(self, root: str) -> tuple[Backend, threading.Lock]:
+        """Fetch the backend for a repository root, creating it on a miss.
+        :param root: the repository root directory
+        :return: the backend instance and a lock guarding its use between requests
+        """
+        with self._lock:
+            if root in self._repos:
+                self.hits += 1
+                self._repos.move_to_end(root)
+                return self._repos[root]
+            self.misses += 1
+            entry = self._repos[root] = (selected_backend(root)(root), threading.Lock())
+            if len(self._repos) > self.size:
+                self._repos.popitem(last=False)
+                self.evictions += 1
+            return entry
+
+
+class StatuslineServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server rendering a statusline for each directory it is sent."""
+
+    daemon_threads = True
+
+    def __init__(self, address: str, size: int = 32):
+        """Bind the server to its socket.
+        :param address: the unix socket path to listen on
+        :param size: the most repositories to keep warm
+        """
+        self.repos = RepoCache(size)
+        self.watcher = Watcher.from_environ()
+        self.requests = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        super().__init__(address, StatuslineHandler)
+
+    def render(self, path: str) -> str:
+        """Generate the statusline for a directory reusing warm repository state.
+        :param path: the absolute directory to describe
+        :return: the minified path with VCS status if available
+        """
+        start = time.perf_counter()
+        if repository := Repository.discover(path):
+            git, lock = self.repos.get(repository.worktree)
+            with lock:
+                # Without relevant changes the previous snapshot is still accurate
+                if git.partial or not self.watcher or self.watcher.dirty(repository):
+                    git.refresh()
+                else:
+                    git.restart_budget()
+                result = DirectoryMinify(git).get_statusline(path)
+        else:
+            result = DirectoryMinify().minify_path(path)
+        elapsed = time.perf_counter() - start
+        self.requests += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        return result
+
+    def stats(self) -> dict:
+        """Summarise cache effectiveness and render latency.
+        :return: counters suitable for dumping as json
+        """
+        lookups = self.repos.hits + self.repos.misses
+        return {
+            'requests': self.requests,
+            'repos': len(self.repos),
+            'hits': self.repos.hits,
+            'misses': self.repos.misses,
+            'evictions': self.repos.evictions,
+            'hit_rate': self.repos.hits / lookups if lookups else 0.0,
+            'path_hits': PATHS.hits,
+            'path_misses': PATHS.misses,
+            'common_hits': COMMON.hits,
+            'common_misses': COMMON.misses,
+            'index_hits': INDEXES.hits,
+            'index_misses': INDEXES.misses,
+            'mean_ms': 1000 * self.total_time / self.requests if self.requests else 0.0,
+            'max_ms': 1000 * self.max_time,
+        }
+
+
+class StatuslineHandler(socketserver.StreamRequestHandler):
+    """Answer one request line per connection.
+    A line holding an absolute path is rendered, 'stats' returns json counters.
+    """
+
+    server: StatuslineServer
+
+    def handle(self):
+        """Read the request and write the response line."""
+        line = self.rfile.readline().decode('utf-8').rstrip('\n')
+        response = ''
+        if line == 'stats':
+            response = json.dumps(self.server.stats())
+        elif line.startswith(os.sep):
+            try:
+                response = self.server.render(line)
+            except (OSError, CalledProcessError):
+                # An empty response sends the client back to rendering in-process
+                pass
+        self.wfile.write(f'{response}\n'.encode('utf-8'))
+
+
+def _listening(address: str) -> bool:
+    """Check whether something still answers on a socket.
+    An empty request is sent so a daemon has nothing to render.
+    :param address: the unix socket path
+    :return: True if a connection was accepted, False for a stale socket
+    """
+    try:
+        with socket.socket(socket.AF_UNIX) as conn:
+            conn.settimeout(1.0)
+            conn.connect(address)
+            conn.shutdown(socket.SHUT_WR)
+            conn.recv(1)
+    except OSError:
+        return False
+    return True
+
+
+def serve(address: Optional[str] = None, size: int = 32):
+    """Run the daemon until interrupted.
+    :param address: the unix socket path (defaults to client.socket_path)
+    :param size: the most repositories to keep warm
+    :raises SystemExit: if another daemon is already listening on the socket
+    """
+    address = address or socket_path()
+    if directory := os.path.dirname(address):
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    if os.path.exists(address):
+        # Only a socket left behind by a daemon that died is replaced
+        if _listening(address):
+            raise SystemExit(f'a statusline daemon is already listening on {address}')
+        os.unlink(address)
+    # Bound owner only from the start so there's no moment other users can connect
+    umask = os.umask(0o077)
+    try:
+        server = StatuslineServer(address, size)
+    finally:
+        os.umask(umask)
+    with server:
+        os.chmod(address, 0o600)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(address)
+
+
+if __name__ == '__main__':
+    serve()
@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+import os
+import stat
+import threading
+from collections import OrderedDict
+from os import path
+from typing import Optional
+
+
+class Discovery:
+    """Map directories to the repository containing them with one upward stat walk.
+
+    What each directory holds (a .git directory, a gitdir pointer or nothing)
+    is cached against that directory's mtime, which changes whenever a .git
+    entry is created or removed in it. Lookups under a known tree therefore
+    only stat the directories on the way up and share entries between siblings.
+    """
+
+    def __init__(self, size: int = 1024):
+        """Create an empty cache.
+        :param size: the most directories to remember before forgetting the idlest
+        """
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._dirs: OrderedDict[str, tuple[int, Optional[str]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Count the directories currently remembered."""
+        return len(self._dirs)
+
+    @staticmethod
+    def _probe(directory: str) -> Optional[str]:
+        """Look for the .git entry in a single directory.
+        :param directory: the directory to check
+        :return: the git dir it points to, '' if it is unusable, None if there isn't one
+        """
+        candidate = path.join(directory, '.git')
+        try:
+            mode = os.stat(candidate).st_mode
+        except OSError:
+            return None
+        if stat.S_ISDIR(mode):
+            return candidate
+        try:
+            with open(candidate, encoding='utf-8') as pointer:
+                content = pointer.read()
+        except OSError:
+            return ''
+        if content.startswith('gitdir: '):
+            # Linked worktrees and submodules point at their git dir
+            return path.normpath(path.join(directory, content[8:].strip()))
+        return ''
+
+    def _local(self, directory: str) -> Optional[str]:
+        """Find what a directory holds reusing the cached answer while its mtime matches.
+        :param directory: the directory to check
+        :return: as for _probe
+        """
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._dirs.get(directory)
+            if entry and entry[0] == mtime:
+                self.hits += 1
+                self._dirs.move_to_end(directory)
+                return entry[1]
+            self.misses += 1
+        found = self._probe(directory)
+        with self._lock:
+            self._dirs[directory] = (mtime, found)
+            self._dirs.move_to_end(directory)
+            if len(self._dirs) > self.size:
+                self._dirs.popitem(last=False)
+        return found
+
+    def find(self, start: str) -> Optional[tuple[str, str]]:
+        """Find the repository containing a directory the way git does.
+        GIT_DIR (with GIT_WORK_TREE) overrides the search, otherwise the walk
+        stops before entering any of GIT_CEILING_DIRECTORIES.
+        :param start: the directory to begin searching from
+        :return: the worktree root and git dir, None if start isn't in a repository
+        """
+        start = path.abspath(start)
+        if git_dir := os.environ.get('GIT_DIR'):
+            return path.abspath(os.environ.get('GIT_WORK_TREE') or start), path.abspath(git_dir)
+        ceilings = {
+            path.abspath(ceiling)
+            for ceiling in os.environ.get('GIT_CEILING_DIRECTORIES', '').split(os.pathsep)
+            if ceiling
+        }
+        directory = start
+        while (found := self._local(directory)) is None:
+            parent = path.dirname(directory)
+            if parent == directory or parent in ceilings:
+                return None
+            directory = parent
+        return (directory, found) if found else None
+
+
+# Shared so long-lived modes reuse what earlier lookups learned
+DISCOVERY = Discovery()
@@ -0,0 +1,28 @@
+#!/usr/bin/python3
+"""Precomputed terminal colour escapes.
+
+Each escape is wrapped in \\001 and \\002 so readline knows it is non-printing,
+matching the output of ansi.colour with ansi_patch applied without importing
+either at runtime.
+"""
+
+
+def sgr(*codes: int) -> str:
+    """Build a wrapped select graphic rendition escape.
+    :param codes: the SGR parameters eg. 38, 5, 202 for 256 colour orange
+    :return: the escape sequence wrapped in non-printing markers
+    """
+    return f'\001\033[{";".join(map(str, codes))}m\002'
+
+
+RESET = sgr(0)
+GREEN = sgr(32)
+RED = sgr(31)
+YELLOW = sgr(33)
+CYAN = sgr(36)
+BRIGHTBLACK = sgr(90)
+BRIGHTRED = sgr(91)
+BRIGHTBLUE = sgr(94)
+BLACK_ON_BRIGHTRED = sgr(30, 101)
+# git color #f14e32 (colour 202 is ideal)
+GIT_ORANGE = sgr(38, 5, 202)
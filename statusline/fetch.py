@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+import os
+import sys
+import time
+from typing import Optional
+
+from statusline import escapes
+from statusline.cache import cache_dir
+
+
+class FetchScheduler:
+    """Keep remote tracking refs fresh by fetching in the background.
+
+    When FETCH_HEAD is older than age a detached, low priority process runs
+    git fetch. A stamp file per repository shared by every shell means at
+    most one fetch is attempted per interval whether it succeeds or not.
+    """
+
+    def __init__(self, directory: str, age: float = 3600, interval: float = 300):
+        """Create a scheduler.
+        :param directory: where the per-repository stamp files are kept
+        :param age: seconds after which the last fetch is considered stale
+        :param interval: the fewest seconds between fetch attempts for a repository
+        """
+        self.directory = directory
+        self.age = age
+        self.interval = interval
+
+    @classmethod
+    def from_environ(cls) -> Optional['FetchScheduler']:
+        """Build the scheduler configured by the environment.
+        Fetching is opt-in by setting STATUSLINE_FETCH_AGE (seconds),
+        STATUSLINE_FETCH_INTERVAL tunes the rate limit.
+        :return: the configured scheduler, None if background fetches are disabled
+        """
+        if not (age := float(os.environ.get('STATUSLINE_FETCH_AGE', 0))):
+            return None
+        return cls(
+            os.path.join(cache_dir(), 'fetch'),
+            age=age,
+            interval=float(os.environ.get('STATUSLINE_FETCH_INTERVAL', 300)),
+        )
+
+    def _stamp(self, root: str) -> str:
+        """Name the stamp file for a repository.
+        :param root: the repository root
+        :return: the path of the stamp file
+        """
+        name = root.replace('%', '%%').replace(os.sep, '%')
+        return os.path.join(self.directory, f'{name}.stamp')
+
+    def colour(self, age: float) -> str:
+        """Choose the branch colour for how long ago the last fetch was.
+        :param age: seconds since the last fetch
+        :return: no escape while fresh, yellow once stale, red when 4 times stale
+        """
+        if age < self.age:
+            return ''
+        if age < 4 * self.age:
+            return escapes.YELLOW
+        return escapes.RED
+
+    def schedule(self, root: str, age: float) -> bool:
+        """Start a background fetch if the last one is stale and none was tried recently.
+        This only creates a file and spawns a process so it never waits on the network.
+        :param root: the repository root
+        :param age: seconds since the last fetch
+        :return: whether a fetch was started
+        """
+        if age < self.age:
+            return False
+        stamp = self._stamp(root)
+        try:
+            if time.time() - os.path.getmtime(stamp) < self.interval:
+                return False
+            os.unlink(stamp)
+        except OSError:
+            pass
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            os.close(os.open(stamp, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            # Another shell got there first
+            return False
+        # Only needed when fetching so it isn't paid for on every prompt
+        from subprocess import Popen, DEVNULL  # pylint: disable=import-outside-toplevel
+        Popen(  # pylint: disable=consider-using-with
+            [sys.executable, '-m', 'statusline.fetch', root],
+            stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL,
+            start_new_session=True,
+        )
+        return True
+
+
+def fetch(root: str, timeout: float = 300):
+    """Fetch a repository at the lowest priority without ever prompting.
+    :param root: the repository root
+    :param timeout: seconds after which the fetch is abandoned
+    """
+    from subprocess import run, DEVNULL, SubprocessError  # pylint: disable=import-outside-toplevel
+    os.nice(19)
+    environ = {**os.environ, 'GIT_TERMINAL_PROMPT': '0'}
+    environ.setdefault('GIT_SSH_COMMAND', 'ssh -o BatchMode=yes')
+    try:
+        run(
+            ['git', 'fetch', '--quiet', '--no-auto-gc'],
+            cwd=root, env=environ, stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL,
+            timeout=timeout, check=False,
+        )
+    except (OSError, SubprocessError):
+        pass
+
+
+if __name__ == '__main__':
+    fetch(sys.argv[1])
@@ -1,13 +1,21 @@
 #!/usr/bin/python3
+import os
+import time
 from os import path
-from subprocess import run, CalledProcessError
-from dataclasses import dataclass
-from collections import defaultdict
-from typing import Optional
+from subprocess import run, Popen, PIPE, DEVNULL, CalledProcessError, TimeoutExpired
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import TYPE_CHECKING, Callable, Generator, Iterable, Optional, Protocol, cast
 
-from ansi.colour import fg, bg, fx  # type: ignore
+from statusline import escapes, trace
+from statusline.cache import Memo, ResultCache, SubmoduleCache, cache_dir, signature
+from statusline.common import COMMON
+from statusline.discovery import DISCOVERY
+from statusline.segments import SEGMENTS, configured, evaluate, plausible
 
-from statusline import ansi_patch
+if TYPE_CHECKING:
+    from statusline.costs import CostModel
+    from statusline.fetch import FetchScheduler
 
 
 @dataclass
@@ -20,7 +28,7 @@ class AheadBehind:
     def __str__(self):
         """Generate a short text summary of how far ahead/behind the remote."""
         if self.ahead and self.behind:
-            return f'{fg.black+bg.brightred}↕{self.ahead+self.behind}{fx.reset}'
+            return f'{escapes.BLACK_ON_BRIGHTRED}↕{self.ahead+self.behind}{escapes.RESET}'
         if self.ahead:
             return f'↑{self.ahead}'
         if self.behind:
@@ -35,67 +43,562 @@ class Status:
     staged: int = 0
     unstaged: int = 0
     untracked: int = 0
+    # Set when git was asked to skip checks (eg. untracked files) to save time
+    approximate: bool = False
+    # Counts above this are shown as eg. 999+ since they may have stopped early
+    cap: Optional[int] = None
+    # Submodules with changes when they are counted separately (see Git.submodules)
+    submodules: int = 0
+
+    def __post_init__(self):
+        """Saturate counts one past the cap.
+        Counting may stop anywhere beyond it so this keeps equal states equal.
+        """
+        if self.cap is not None:
+            self.staged = min(self.staged, self.cap + 1)
+            self.unstaged = min(self.unstaged, self.cap + 1)
+            self.untracked = min(self.untracked, self.cap + 1)
 
     def __bool__(self):
         """Test if there is status information in this object to display."""
         # Tested in order of likelyhood for performance
-        return bool(self.unstaged or self.untracked or self.staged)
+        return bool(
+            self.unstaged or self.untracked or self.staged or self.submodules or self.approximate
+        )
 
     def __str__(self):
         """Generate a short text summary of changes in working copy."""
         result = []
         if self.staged:
-            result.extend([fg.green, self.staged])
+            result.extend([escapes.GREEN, self._count(self.staged)])
         if self.unstaged:
-            result.extend([fg.red, self.unstaged])
+            result.extend([escapes.RED, self._count(self.unstaged)])
         if self.untracked:
-            result.extend([fg.brightblack, self.untracked])
+            result.extend([escapes.BRIGHTBLACK, self._count(self.untracked)])
+        if self.submodules:
+            result.extend([escapes.CYAN, self.submodules])
+        if self.approximate:
+            result.extend([escapes.BRIGHTBLACK, '~'])
         if result:
-            result.append(fx.reset)
+            result.append(escapes.RESET)
         return ''.join(map(str, result))
 
+    def _count(self, value: int) -> str:
+        """Format a count respecting the cap.
+        :param value: the number of files
+        :return: the number or the cap followed by + if it is exceeded
+        """
+        return f'{self.cap}+' if self.cap is not None and value > self.cap else str(value)
+
+
+# Byte value of the column marking an unmodified side of an entry
+UNMODIFIED = ord('.')
+
+
+@dataclass
+class Snapshot:
+    """Model for everything a single porcelain v2 status reports about the repository."""
+
+    branch: str = 'HEAD'
+    upstream: Optional[str] = None
+    ahead_behind: Optional[AheadBehind] = None
+    status: Status = field(default_factory=Status)
+    stashes: int = 0
+
+    @classmethod
+    def parse(cls, chunks: Iterable[bytes], cap: Optional[int] = None) -> 'Snapshot':
+        """Build a snapshot from `git status --porcelain=v2 -z --branch --show-stash`.
+        Header records start with '#', every other record is an entry whose
+        XY columns use '.' for unmodified (see git-status PORCELAIN FORMAT VERSION 2).
+
+        Output is consumed a chunk at a time and entries are counted as bytes
+        so neither memory nor non UTF-8 paths depend on the size of the working copy.
+        Untracked entries come last so reading stops once they exceed cap.
+        :param chunks: the stdout of the status command as it arrives
+        :param cap: the largest count worth displaying, None to count everything
+        :return: the Snapshot described by the output
+        """
+        result = cls()
+        staged = unstaged = untracked = 0
+        pending = b''
+        renamed = False
+        for chunk in chunks:
+            records = (pending + chunk).split(b'\0')
+            pending = records.pop()
+            for record in records:
+                if renamed:
+                    # Renames and copies are followed by a record holding the original path
+                    renamed = False
+                elif record[:1] == b'?':
+                    untracked += 1
+                elif record[:1] in (b'1', b'2', b'u'):
+                    staged += record[2] != UNMODIFIED
+                    unstaged += record[3] != UNMODIFIED
+                    renamed = record[:1] == b'2'
+                elif record[:2] == b'# ':
+                    result._header(record[2:].decode('utf-8', 'surrogateescape'))
+            if cap is not None and untracked > cap:
+                break
+        result.status = Status(staged, unstaged, untracked, cap=cap)
+        return result
+
+    def _header(self, line: str):
+        """Apply a header record to the snapshot.
+        :param line: the header without its leading '# '
+        """
+        key, _, value = line.partition(' ')
+        if key == 'branch.head' and value != '(detached)':
+            self.branch = value
+        elif key == 'branch.upstream':
+            self.upstream = value
+        elif key == 'branch.ab' and '?' not in value:
+            # With --no-ahead-behind git reports +? -? instead
+            ahead, behind = value.split(' ')
+            self.ahead_behind = AheadBehind(int(ahead[1:]), int(behind[1:]))
+        elif key == 'stash':
+            self.stashes = int(value)
+
+
+def _parse_packed_refs(content: str) -> dict[str, str]:
+    """Parse packed-refs into a mapping of ref name to hash.
+    Peeled tag lines (starting '^') and the header comment are skipped.
+    :param content: the packed-refs file contents
+    :return: the refs stored in packed-refs
+    """
+    refs = {}
+    for line in content.split('\n'):
+        if line and line[0] not in '#^':
+            sha, _, name = line.partition(' ')
+            refs[name] = sha
+    return refs
+
+
+def _parse_config(content: str) -> dict[str, dict[str, str]]:
+    """Parse a git config file into its sections.
+    :param content: the config file contents
+    :return: section headers without brackets (eg. branch "master") mapped to
+        their lowercased keys and values
+    """
+    result: dict[str, dict[str, str]] = {}
+    current = None
+    for line in content.split('\n'):
+        line = line.strip()
+        if line.startswith('['):
+            current = line[1:line.find(']')]
+        elif current is not None and '=' in line:
+            key, _, value = line.partition('=')
+            result.setdefault(current, {})[key.strip().lower()] = value.strip()
+    return result
+
+
+class Repository:
+    """Read repository facts straight from the .git directory without spawning git.
+
+    Files in the common git dir are parsed through COMMON so sibling worktrees
+    share the work, only HEAD, the index and per-worktree refs are read for each.
+    """
+
+    def __init__(self, worktree: str, git_dir: str):
+        self.worktree = worktree
+        self.git_dir = git_dir
+        # Linked worktrees keep refs, packed-refs and the stash in the main git dir
+        common = self._read('commondir')
+        self.common_dir = path.normpath(path.join(git_dir, common.strip())) if common else git_dir
+
+    @classmethod
+    def discover(cls, start: str) -> Optional['Repository']:
+        """Find the repository containing start (see Discovery.find).
+        :param start: the directory to begin searching from
+        :return: the Repository containing start if one is found
+        """
+        if found := DISCOVERY.find(start):
+            return cls(*found)
+        return None
+
+    def _read(self, name: str, base: Optional[str] = None) -> Optional[str]:
+        """Read a file from the git dir quietly.
+        :param name: the file path relative to the git dir
+        :param base: the directory to read from (defaults to git_dir)
+        :return: the file contents if it exists
+        """
+        try:
+            with open(path.join(base or self.git_dir, name), encoding='utf-8') as file:
+                return file.read()
+        except OSError:
+            return None
+
+    @property
+    def head(self) -> str:
+        """Property for the raw HEAD reference.
+        :return: either 'ref: refs/heads/<name>' or a detached commit hash
+        """
+        return (self._read('HEAD') or '').strip()
+
+    @property
+    def branch(self) -> Optional[str]:
+        """Property for the current branch name.
+        :return: the local branch HEAD points to, None if detached
+        """
+        head = self.head
+        if not head.startswith('ref: '):
+            return None
+        return head[5:].removeprefix('refs/heads/')
+
+    def _packed_refs(self) -> dict:
+        """Look up the refs stored in packed-refs.
+        :return: a mapping of ref name to hash
+        """
+        return COMMON.load(self.common_dir, 'packed-refs', _parse_packed_refs) or {}
+
+    def resolve(self, ref: str, depth: int = 5) -> Optional[str]:
+        """Resolve a ref to a commit hash following symbolic refs.
+        Loose refs are checked per-worktree first then in the common dir
+        before falling back to packed-refs.
+        :param ref: the full ref name eg. HEAD or refs/heads/master
+        :param depth: the number of symbolic refs still allowed to be followed
+        :return: the hash the ref points to, None if it does not exist
+        """
+        content = self._read(ref) if self.git_dir != self.common_dir else None
+        if content is None:
+            content = COMMON.load(self.common_dir, ref, str.strip)
+        if content is None:
+            return self._packed_refs().get(ref)
+        content = content.strip()
+        if content.startswith('ref: '):
+            return self.resolve(content[5:], depth - 1) if depth else None
+        return content
+
+    def _config(self, section: str) -> dict[str, str]:
+        """Read the keys of a single section from the repository config.
+        :param section: the section header without brackets eg. branch "master"
+        :return: the lowercased keys mapped to their values
+        """
+        return (COMMON.load(self.common_dir, 'config', _parse_config) or {}).get(section, {})
+
+    @property
+    def object_format(self) -> str:
+        """Property for the hash function naming objects.
+        :return: sha1 unless the repository was created with another eg. sha256
+        """
+        return self._config('extensions').get('objectformat', 'sha1')
+
+    @property
+    def show_untracked(self) -> str:
+        """Property for how git status lists untracked files (status.showUntrackedFiles).
+        :return: no, normal or all as the repository config sets it, normal by default
+        """
+        value = self._config('status').get('showuntrackedfiles', 'normal').lower()
+        if value in ('false', 'off', '0'):
+            return 'no'
+        return value if value in ('no', 'all') else 'normal'
+
+    @property
+    def upstream(self) -> Optional[str]:
+        """Property for the ref the current branch tracks.
+        :return: the full upstream ref name, None if there isn't one
+        """
+        if not (branch := self.branch):
+            return None
+        config = self._config(f'branch "{branch}"')
+        remote, merge = config.get('remote'), config.get('merge')
+        if not (remote and merge):
+            return None
+        if remote == '.':
+            return merge
+        return f'refs/remotes/{remote}/{merge.removeprefix("refs/heads/")}'
+
+    @property
+    def push(self) -> Optional[str]:
+        """Property for the ref @{push} resolves to.
+        This follows branch.pushRemote, remote.pushDefault and push.default
+        the same way git does for the common modes.
+        :return: the full ref pushes go to, None if there isn't one
+        """
+        if not (branch := self.branch):
+            return None
+        config = self._config(f'branch "{branch}"')
+        remote = config.get('pushremote') \
+            or self._config('remote').get('pushdefault') \
+            or config.get('remote')
+        mode = self._config('push').get('default', 'simple')
+        if not remote or mode == 'nothing':
+            return None
+        if mode in ('simple', 'upstream') and remote == config.get('remote'):
+            # Simple only pushes to an upstream of the same name
+            if mode == 'simple' and config.get('merge', f'refs/heads/{branch}') \
+                    != f'refs/heads/{branch}':
+                return None
+            return self.upstream
+        if remote == '.':
+            return f'refs/heads/{branch}'
+        return f'refs/remotes/{remote}/{branch}'
+
+    def state_files(self) -> list:
+        """List the files whose stat changes whenever the short stats could.
+        :return: paths to the index, HEAD, current and upstream refs and stash log
+        """
+        files = [
+            path.join(self.git_dir, 'index'),
+            path.join(self.git_dir, 'HEAD'),
+            path.join(self.common_dir, 'packed-refs'),
+            path.join(self.common_dir, 'logs/refs/stash'),
+        ]
+        if self.head.startswith('ref: '):
+            files.append(path.join(self.common_dir, self.head[5:]))
+        for ref in dict.fromkeys((self.upstream, self.push)):
+            if ref:
+                files.append(path.join(self.common_dir, ref))
+        return files
+
+    def submodules(self) -> list[str]:
+        """List the submodules declared in .gitmodules.
+        :return: each submodule's path relative to the worktree
+        """
+        config = _parse_config(self._read('.gitmodules', self.worktree) or '')
+        return [
+            section['path'] for name, section in config.items()
+            if name.startswith('submodule ') and 'path' in section
+        ]
+
+    def tree(self, commit: str) -> Optional[str]:
+        """Read the tree of a commit stored as a loose object.
+        Freshly made commits are loose until git packs them.
+        :param commit: the commit hash
+        :return: the tree hash, None if the commit isn't a loose object
+        """
+        # pylint: disable-next=import-outside-toplevel
+        import zlib
+        try:
+            with open(path.join(self.common_dir, 'objects', commit[:2], commit[2:]), 'rb') as file:
+                header, _, body = zlib.decompress(file.read()).partition(b'\0')
+        except (OSError, zlib.error):
+            return None
+        if not header.startswith(b'commit ') or not body.startswith(b'tree '):
+            return None
+        return body[5:body.index(b'\n')].decode()
+
+    def stashes(self) -> int:
+        """Count the entries in the stash reflog.
+        :return: current count of stash records
+        """
+        return COMMON.load(self.common_dir, 'logs/refs/stash', lambda log: log.count('\n')) or 0
+
+
+def _costs() -> Optional['CostModel']:
+    """Build the cost model, only importing it when it is enabled.
+    :return: the CostModel configured by the environment, None if it is disabled
+    """
+    if os.environ.get('STATUSLINE_ADAPTIVE') in ('0', 'off'):
+        return None
+    # pylint: disable-next=import-outside-toplevel
+    from statusline.costs import CostModel
+    return CostModel.from_environ()
+
+
+def _fetcher() -> Optional['FetchScheduler']:
+    """Build the background fetch scheduler, only importing it when fetches are enabled.
+    :return: the FetchScheduler configured by the environment, None if fetching is off
+    """
+    if not os.environ.get('STATUSLINE_FETCH_AGE'):
+        return None
+    # pylint: disable-next=import-outside-toplevel
+    from statusline.fetch import FetchScheduler
+    return FetchScheduler.from_environ()
+
+
+class Backend(Protocol):
+    """What a statusline needs from a version control backend.
+
+    Git spawns git itself, others (see statusline.backends) answer the same
+    queries another way but must report identical AheadBehind and Status.
+    """
+
+    # Set when the last render ran out of time and should be refreshed
+    partial: bool
+
+    def __init__(self, cwd: Optional[str] = None):
+        """Create a backend for the repository containing cwd (defaults to the working dir)."""
+
+    @classmethod
+    def discover(cls, start: str) -> Optional['Backend']:
+        """Create a backend for the repository containing a directory."""
+
+    def __bool__(self) -> bool:
+        """Check for being in a repository."""
+
+    @property
+    def root_dir(self) -> str:
+        """Property for the absolute path to the repository root."""
 
-class Git:
+    @property
+    def branch(self) -> str:
+        """Property for the current branch name (HEAD when detached)."""
+
+    def ahead_behind(self) -> Optional[AheadBehind]:
+        """Count unsynched commits, None if there's no remote branch."""
+
+    def status(self) -> Status:
+        """Count the changed files in the working copy."""
+
+    def stashes(self) -> int:
+        """Count the records in the stash."""
+
+    def prefetch(self, columns: Optional[int] = None):
+        """Start the queries a render within columns will need together."""
+
+    def refresh(self):
+        """Forget answers so the next query sees current repository state."""
+
+    def restart_budget(self):
+        """Give the next render its full time budget."""
+
+    def short_stats(self, columns: Optional[int] = None) -> str:
+        """Render the short summary of the repository status within columns."""
+
+
+class Git:  # pylint: disable=too-many-instance-attributes
     """Get information about the status of the current git repository."""
 
-    # branch logo in git color #f14e32 (colour 202 is ideal)
-    # rgb.rgb256(241, 78, 50)
-    ICON = f'{ansi_patch.colour256(202)}\uE0A0{fx.reset}'
+    # branch logo in git color
+    ICON = f'{escapes.GIT_ORANGE}\uE0A0{escapes.RESET}'
+    # Shown in place of segments still waiting on git when the time budget runs out
+    PENDING = f'{escapes.BRIGHTBLACK}…{escapes.RESET}'
 
-    def __init__(self):
+    def __init__(self, cwd: Optional[str] = None):
+        """Create a git accessor.
+        :param cwd: the directory to query (defaults to the process working dir)
+        """
+        self.cwd = cwd
         self._root: Optional[str] = None
+        self._snapshot: Optional[Snapshot] = None
+        self.deadline: Optional[float] = None
+        self.partial = False
+        self.costs = _costs()
+        self.memo: Optional[Memo] = Memo(path.join(cache_dir(), 'ahead_behind.json'))
+        self._counted = False
+        self._ahead_behind: Optional[AheadBehind] = None
+        self.segments = configured()
+        self.refresh()
+
+    @classmethod
+    def discover(cls, start: str) -> Optional['Git']:
+        """Create a Git for the repository containing a directory.
+        :param start: the directory to look from
+        :return: a Git rooted at the repository, None if start isn't in one
+        """
+        if not (repository := Repository.discover(start)):
+            return None
+        result = cls(repository.worktree)
+        result.repository = repository
+        return result
 
     def __bool__(self):
         """Simple check for being in a git repo.
-        Testing for .git is faster but only works in project root
-        alernatively we'll use the git tool.
+        This uses repository discovery so never needs to run git.
         """
-        try:
-            return path.exists('.git') \
-                or bool(self.root_dir)
-        except CalledProcessError:
-            return False
+        return self.repository is not None
 
-    @staticmethod
-    def _run_command(command: list) -> str:
+    @cached_property
+    def repository(self) -> Optional[Repository]:
+        """Property for the on-disk repository reader.
+        :return: the Repository around the working dir if it could be found
+        """
+        return Repository.discover(self.cwd or os.getcwd())
+
+    def _run_command(self, command: list) -> str:
         """Run command and handle failures quietly.
+        When there is a deadline git is killed if it hasn't finished in time.
         :param command: subcommand and options used to call git
         :return: the stdout resulting from the git command
+        :raises TimeoutExpired: if the deadline passes before git completes
+        """
+        timeout = self._remaining(command)
+        with trace.command(['git'] + command) as event:
+            output = run(
+                ['git'] + command,
+                check=True,
+                capture_output=True,
+                cwd=self.cwd,
+                timeout=timeout,
+            ).stdout
+            event['bytes'] = len(output)
+        return output.decode('utf-8')
+
+    def _remaining(self, command: list) -> Optional[float]:
+        """Work out how long git may take before the deadline.
+        :param command: subcommand and options git is being called with
+        :return: seconds left, None when there is no deadline
+        :raises TimeoutExpired: if the deadline has already passed
         """
-        return run(
-            ['git'] + command,
-            check=True,
-            capture_output=True
-        ).stdout.decode('utf-8')
+        if self.deadline is None:
+            return None
+        timeout = self.deadline - time.monotonic()
+        if timeout <= 0:
+            raise TimeoutExpired(['git'] + command, 0)
+        return timeout
 
-    def _count(self, command: list) -> int:
-        """Helper to count the number of records resulted from running a command.
-        :param command: the command that will be passed down to _run_command
-        :return: the count of lines returned from running the given command
+    def _stream_command(
+        self, command: list, size: int = 65536
+    ) -> Generator[bytes, None, None]:
+        """Run command yielding its stdout in chunks as they arrive.
+        git is killed when the caller stops reading early or the deadline passes.
+        :param command: subcommand and options used to call git
+        :param size: the most bytes read at once
+        :return: an iterator over the raw stdout
+        :raises TimeoutExpired: if the deadline passes before git completes
+        :raises CalledProcessError: if git fails
         """
-        rows = self._run_command(command).split('\n')
-        rows.remove('')
-        return len(rows)
+        timeout = self._remaining(command)
+        with trace.command(['git'] + command) as event, Popen(
+            ['git'] + command, stdout=PIPE, stderr=DEVNULL, cwd=self.cwd,
+        ) as process:
+            stdout = process.stdout.fileno()  # type: ignore[union-attr]
+            try:
+                while True:
+                    if self.deadline is not None:
+                        # pylint: disable-next=import-outside-toplevel
+                        from select import select
+                        timeout = self.deadline - time.monotonic()
+                        if timeout <= 0 or not select([stdout], [], [], timeout)[0]:
+                            raise TimeoutExpired(['git'] + command, timeout)
+                    if not (chunk := os.read(stdout, size)):
+                        break
+                    event['bytes'] += len(chunk)
+                    yield chunk
+            except BaseException:
+                # Includes GeneratorExit when the caller has read enough
+                process.kill()
+                raise
+            if process.wait():
+                raise CalledProcessError(process.returncode, ['git'] + command)
+
+    def prefetch(self, columns: Optional[int] = None):
+        """Run the outstanding independent git queries together and wait for them.
+        Latency becomes the slowest call rather than the sum of them all.
+        The root needs git when the repository reader can't answer and
+        ahead/behind when it isn't memoized, failures are left for the lazy
+        accessors to raise again where they are already handled.
+        Segments which are disabled or can't fit in columns aren't prepared.
+        :param columns: the width short_stats will be given, None if it is unlimited
+        """
+        if self.repository and ResultCache.from_environ():
+            # short_stats decides whether git is needed at all
+            return
+        wanted = plausible(self.segments, columns)
+        queries: list[Callable[[], object]] = []
+        if not self._root and not self.repository:
+            queries.append(lambda: self.root_dir)
+        if self._snapshot is None and ('status' in wanted or not self.repository):
+            queries.append(self.snapshot)
+        if 'ahead_behind' in wanted and not self._counted \
+                and not (self.repository and self._memoized()):
+            queries.append(self.ahead_behind)
+        if len(queries) < 2:
+            return
+        # pylint: disable-next=import-outside-toplevel
+        from concurrent.futures import ThreadPoolExecutor, wait
+        with ThreadPoolExecutor(len(queries)) as pool:
+            wait([pool.submit(query) for query in queries])
 
     @property
     def root_dir(self) -> str:
@@ -103,99 +606,382 @@ class Git:
 
         This is only generated once so if we
         change repo with this instance it would be wrong.
+        The repository reader is used when possible with git as a fallback.
         :return: the absolute path to the repository root
         """
+        if not self._root and self.repository:
+            self._root = self.repository.worktree
         if not self._root:
             self._root = self._run_command(
                 ['rev-parse', '--show-toplevel']
             ).strip()
         return self._root
 
+    @staticmethod
+    def _cap() -> Optional[int]:
+        """Read the largest count worth displaying from STATUSLINE_STATUS_CAP.
+        Counting is opt-in so by default every change is counted.
+        :return: the cap, None unless it is set to a positive number
+        """
+        cap = os.environ.get('STATUSLINE_STATUS_CAP', '')
+        return (int(cap) or None) if cap.isdigit() else None
+
+    def snapshot(self) -> Snapshot:
+        """Collect branch, upstream, working copy and stash details in one git call.
+
+        Like root_dir this is only generated once per instance, every other
+        query reads from the same snapshot rather than spawning more git processes.
+        Repositories the cost model has learned are slow get a cheaper status.
+        Counts stop at STATUSLINE_STATUS_CAP when it is set (see _cap).
+        In submodule mode git skips the submodules which are counted by submodules instead.
+        :return: the Snapshot of the current repository state
+        """
+        if self._snapshot is None:
+            root = self.repository.worktree if self.costs and self.repository else None
+            level, approximate = 0, False
+            config: list = []
+            options: list = []
+            if self.costs and root:
+                # pylint: disable-next=import-outside-toplevel
+                from statusline.costs import LEVELS, REDUCED
+                level = self.costs.level(root)
+                config, options = LEVELS[level]
+                approximate = level >= REDUCED
+            submodules = SubmoduleCache.from_environ() if self.repository else None
+            if submodules and '--ignore-submodules=all' not in options:
+                options = options + ['--ignore-submodules=all']
+            command = config + ['status', '--porcelain=v2', '-z', '--branch'] \
+                + ['--show-stash'] * ('stashes' in self.segments and not self.repository) \
+                + ['--no-ahead-behind'] + options
+            # Once the budget is spent git isn't started again, nor is that recorded as a run
+            self._remaining(command)
+            cap = self._cap()
+            start = time.monotonic()
+            # ahead_behind counts commits itself so status needn't walk them
+            chunks = self._stream_command(command)
+            elapsed: Optional[float] = None
+            try:
+                snapshot = Snapshot.parse(chunks, cap)
+            except TimeoutExpired:
+                # Cut short by the time budget so it was slow however long it ran
+                elapsed = float('inf')
+                raise
+            finally:
+                chunks.close()
+                if self.costs and root:
+                    self.costs.record(
+                        root, level, elapsed or 1000 * (time.monotonic() - start),
+                    )
+            snapshot.status.approximate = approximate
+            if submodules:
+                snapshot.status.submodules = self.submodules(submodules)
+            self._snapshot = snapshot
+        return self._snapshot
+
+    def _gitlinks(self, cache: SubmoduleCache, paths: list) -> dict[str, str]:
+        """Find the commit the index records for each submodule.
+        These only change with the index so are kept while its signature matches.
+        :param cache: where the answer is kept
+        :param paths: the submodule paths relative to the root
+        :return: each submodule path mapped to its recorded commit
+        """
+        git_dir = cast(Repository, self.repository).git_dir
+        key = signature([path.join(git_dir, 'index')]) + [paths]
+        if (gitlinks := cache.get(f'{git_dir} gitlinks', key, expires=False)) is not None:
+            return cast(dict[str, str], gitlinks)
+        output = self._run_command(
+            ['--literal-pathspecs', '-C', self.root_dir, 'ls-files', '--stage', '-z', '--']
+            + paths
+        )
+        gitlinks = {}
+        for record in output.split('\0'):
+            info, _, name = record.partition('\t')
+            if info.startswith('160000 '):
+                gitlinks[name] = info.split(' ')[1]
+        cache.put(f'{git_dir} gitlinks', key, gitlinks)
+        return gitlinks
+
+    def _modified(self, worktree: str) -> bool:
+        """Check a submodule's working copy for changes stopping at the first one.
+        :param worktree: the submodule's root
+        :return: whether git status reports anything
+        """
+        chunks = self._stream_command(['-C', worktree, 'status', '--porcelain=v2', '-z'])
+        try:
+            return any(chunks)
+        finally:
+            chunks.close()
+
+    def submodules(self, cache: SubmoduleCache) -> int:
+        """Count the submodules git status would report as modified.
+        That is a checked out commit other than the recorded one, or changes
+        in its working copy. Working copies are only scanned again once the
+        submodule's index, HEAD or commit move or its cached answer expires.
+        :param cache: where answers are kept between renders
+        :return: the number of submodules with changes
+        """
+        if not self.repository or not (paths := self.repository.submodules()):
+            return 0
+        gitlinks = self._gitlinks(cache, paths)
+        count = 0
+        for name in paths:
+            worktree = path.normpath(path.join(self.repository.worktree, name))
+            submodule = Repository.discover(worktree)
+            if not submodule or submodule.worktree != worktree:
+                # Not checked out, so the superproject was found instead
+                continue
+            head = submodule.resolve('HEAD')
+            if head != gitlinks.get(name):
+                count += 1
+                continue
+            key = signature([
+                path.join(submodule.git_dir, 'index'), path.join(submodule.git_dir, 'HEAD'),
+            ]) + [head]
+            if (modified := cache.get(submodule.git_dir, key)) is None:
+                modified = self._modified(worktree)
+                cache.put(submodule.git_dir, key, modified)
+            count += bool(modified)
+        return count
+
+    def refresh(self):
+        """Drop the cached snapshot so the next query sees current repository state.
+        The root and repository reader are kept since they do not change.
+        The time budget also restarts (see restart_budget).
+        """
+        self._snapshot = None
+        self._counted = False
+        self._ahead_behind = None
+        self.partial = False
+        self.restart_budget()
+
+    def restart_budget(self):
+        """Give queries from now the full time budget from STATUSLINE_TIMEOUT_MS.
+        Long-lived modes call this for every render even when the snapshot is kept.
+        """
+        timeout = os.environ.get('STATUSLINE_TIMEOUT_MS')
+        self.deadline = time.monotonic() + int(timeout) / 1000 if timeout else None
+
     @property
     def branch(self) -> str:
         """Property for the current branch name.
 
-        Using symbolic-ref reads HEAD directly which can point to a
+        Both HEAD and the branch.head header are read directly so this names a
         branch even if it does not yet have any commits accossiated with it.
-        Wheras in this case rev-parse will fail since it reverse-engineers
-        the ref from the current commit.
-        :return: the current local branch name
+        :return: the current local branch name (HEAD when detached)
         """
-        try:
-            return self._run_command(
-                ['symbolic-ref', '-q', '--short', 'HEAD']
-            ).strip()
-        except CalledProcessError:
-            return 'HEAD'
+        if self.repository:
+            return self.repository.branch or 'HEAD'
+        return self.snapshot().branch
 
     @property
     def last_fetch(self) -> int:
         """Get the timestamp of the last git fetch.
-        This information could be used to:
-            * run a fetch anytime >3h old †
-            * colourise short_stats as a reminder to fetch
+        This information is used to:
+            * run a fetch in the background once it is too old †
+            * colourise the branch as a reminder to fetch
 
             † regular fetches may be problematic for --force-with-lease
             see stackoverflow for details
             https://stackoverflow.com/questions/30542491/push-force-with-lease-by-default/43726130#43726130
+        Each worktree has its own FETCH_HEAD so the newest of this worktree's
+        and the main one's is used since they share remote tracking refs.
         :return: the unix timestamp that the last fetch occurred
+        :raises OSError: if the repository has never been fetched
         """
-        return int(path.getmtime(path.join(self.root_dir, '.git/FETCH_HEAD')))
+        if not self.repository:
+            return int(path.getmtime(path.join(self.root_dir, '.git/FETCH_HEAD')))
+        times = []
+        for directory in dict.fromkeys((self.repository.git_dir, self.repository.common_dir)):
+            try:
+                times.append(path.getmtime(path.join(directory, 'FETCH_HEAD')))
+            except OSError:
+                pass
+        if not times:
+            raise FileNotFoundError(path.join(self.repository.git_dir, 'FETCH_HEAD'))
+        return int(max(times))
 
-    def ahead_behind(self) -> Optional[AheadBehind]:
-        """Count unsynched commits between current branch and it's remote.
-        :return: AheadBehind comparing local and remote if remote branch exists
+    def fetch_age(self) -> float:
+        """Measure how long ago the repository was fetched.
+        :return: seconds since the last fetch, infinite if it never has been
         """
         try:
-            return AheadBehind(
-                ahead = self._count(['rev-list', '@{push}..HEAD']),
-                behind = self._count(['rev-list', 'HEAD..@{upstream}']),
+            return time.time() - self.last_fetch
+        except OSError:
+            return float('inf')
+
+    def _branch_label(self, fetcher: Optional['FetchScheduler']) -> str:
+        """Colour the branch name by how stale remote tracking information is.
+        :param fetcher: the background fetch configuration, None when disabled
+        :return: the branch name, coloured once the last fetch is stale
+        """
+        upstream = self.repository.upstream if self.repository else self.snapshot().upstream
+        if fetcher and upstream and (colour := fetcher.colour(self.fetch_age())):
+            return f'{colour}{self.branch}{escapes.RESET}'
+        return self.branch
+
+    def _refs(self) -> Optional[tuple[str, str, str]]:
+        """Resolve HEAD, @{push} and @{upstream} to commit hashes.
+        The repository reader is used when possible with git as a fallback.
+        :return: the three hashes, None if there's no push or upstream branch
+        """
+        if self.repository:
+            refs = (
+                self.repository.resolve('HEAD'),
+                self.repository.resolve(self.repository.push or ''),
+                self.repository.resolve(self.repository.upstream or ''),
             )
+            return refs if all(refs) else None  # type: ignore
+        try:
+            head, push, upstream = self._run_command(
+                ['rev-parse', 'HEAD', '@{push}', '@{upstream}']
+            ).split()
         except CalledProcessError:
-            # This occurs if there's no upstream repo to compare. (eg. a new branch)
             return None
+        return head, push, upstream
+
+    def _memoized(self) -> bool:
+        """Test if ahead_behind can answer without running git.
+        :return: whether there's no remote or the count is already memoized
+        """
+        refs = self._refs()
+        return refs is None or bool(self.memo and self.memo.get(' '.join(refs)))
+
+    def _left_right(self, left: str, right: str) -> tuple[int, int]:
+        """Count commits on each side of a symmetric difference in one walk.
+        :param left: the first commit
+        :param right: the second commit
+        :return: the number of commits only reachable from left and from right
+        """
+        counts = self._run_command(['rev-list', '--left-right', '--count', f'{left}...{right}'])
+        only_left, only_right = counts.split()
+        return int(only_left), int(only_right)
+
+    def ahead_behind(self) -> Optional[AheadBehind]:
+        """Count unsynched commits between current branch and it's remote.
+        Ahead is measured against @{push} and behind against @{upstream}.
+        Counts are memoized by the three commit hashes so nothing is walked
+        again until one of them moves.
+        :return: AheadBehind comparing local and remote if remote branch exists
+        """
+        if self._counted:
+            return self._ahead_behind
+        # None if there's no upstream repo to compare. (eg. a new branch)
+        if refs := self._refs():
+            key = ' '.join(refs)
+            if self.memo and (counts := self.memo.get(key)):
+                self._ahead_behind = AheadBehind(*counts)
+            else:
+                head, push, upstream = refs
+                if push == upstream:
+                    behind, ahead = self._left_right(upstream, head)
+                else:
+                    _, ahead = self._left_right(push, head)
+                    behind, _ = self._left_right(upstream, head)
+                self._ahead_behind = AheadBehind(ahead, behind)
+                if self.memo:
+                    self.memo.put(key, [ahead, behind])
+        self._counted = True
+        return self._ahead_behind
 
     def status(self) -> Status:
         """Count the number of changes files in the various statuses git tracks.
         :return: A Status which describes the current state of working copy
         """
-        output = self._run_command(['status', '--porcelain'])
-        result: dict = defaultdict(int)
-        for line in output.split('\n'):
-            if line:
-                if line.startswith('??'):
-                    result['untracked'] += 1
-                else:
-                    if line[0] != ' ':
-                        result['staged'] += 1
-                    if line[1] != ' ':
-                        result['unstaged'] += 1
-        return Status(**result)
+        return self.snapshot().status
 
     def stashes(self) -> int:
         """Count the number of records in the git stash.
         :return: current count of stash records
         """
-        return self._count(['stash', 'list'])
+        if self.repository:
+            return self.repository.stashes()
+        return self.snapshot().stashes
 
-    def short_stats(self) -> str:
+    def cache_key(self, columns: Optional[int] = None) -> list:
+        """Build the ResultCache key for a render.
+        :param columns: the width the render is given, None if it is unlimited
+        :return: the state file signature with the segments and width
+        """
+        files = self.repository.state_files() if self.repository else []
+        return signature(files) + [list(self.segments), columns]
+
+    @trace.phase('short_stats')
+    def short_stats(self, columns: Optional[int] = None) -> str:
         """Generate a short text summary of the repository status.
-        Colour coding is done with terminal escapes.
+        The on-disk ResultCache is used when it is enabled in the environment,
+        as is the background FetchScheduler.
+        :param columns: the most columns to use (see render_stats), None if it is unlimited
         :return: a short string which summarises repository status
         """
-        result = [self.ICON]
-        if not self.root_dir.endswith(self.branch):
+        if (fetcher := _fetcher()) and self.repository \
+                and self.repository.upstream:
+            fetcher.schedule(self.root_dir, self.fetch_age())
+        cache = ResultCache.from_environ()
+        if cache is None or not self.repository:
+            return self.render_stats(columns)
+        key = self.cache_key(columns)
+        if (cached := cache.lookup(self.root_dir, key, columns)) is not None:
+            return cached
+        result = self.render_stats(columns)
+        if not self.partial:
+            cache.store(self.root_dir, key, result)
+        return result
+
+    def _segment_branch(self) -> str:
+        """Render the branch segment.
+        :return: the branch name, empty if the worktree is named after it
+        """
+        if self.root_dir.endswith(self.branch):
             # No need for branch if worktree is repo-branch or repo/branch
-            result.append(self.branch)
+            return ''
+        return self._branch_label(_fetcher())
+
+    def _segment_ahead_behind(self) -> str:
+        """Render the ahead/behind segment.
+        :return: the arrows and counts, ↯ if there's no remote branch
+        """
         if ahead_behind := self.ahead_behind():
-            result.append(str(ahead_behind))
-        else:
-            result.append(f'{fg.brightred}↯{fx.reset}')
-        if status := self.status():
-            result.append(f'({status})')
-        if stashes := self.stashes():
-            result.append(f'{{{stashes}}}')
-        return ''.join(result)
+            return str(ahead_behind)
+        return f'{escapes.BRIGHTRED}↯{escapes.RESET}'
+
+    def _segment_status(self) -> str:
+        """Render the working copy status segment.
+        :return: the counts in brackets, empty if nothing has changed
+        """
+        return f'({status})' if (status := self.status()) else ''
+
+    def _segment_stashes(self) -> str:
+        """Render the stash segment.
+        :return: the count in braces, empty if nothing is stashed
+        """
+        return f'{{{stashes}}}' if (stashes := self.stashes()) else ''
+
+    def render_stats(self, columns: Optional[int] = None) -> str:
+        """Generate the short text summary from the current repository state.
+        Colour coding is done with terminal escapes.
+        The enabled segments (see statusline.segments) are rendered lazily in
+        priority order so those which are disabled or don't fit in columns
+        never run git, the ones that do are shown in their usual order.
+        If git runs out of time the segments so far are kept followed by PENDING.
+        :param columns: the most columns to use, None if it is unlimited
+        :return: a short string which summarises repository status
+        """
+        renders = {
+            'icon': lambda: self.ICON,
+            'branch': self._segment_branch,
+            'ahead_behind': self._segment_ahead_behind,
+            'status': self._segment_status,
+            'stashes': self._segment_stashes,
+        }
+        result = {}
+        pending = ''
+        try:
+            for name, text in evaluate(renders, self.segments, columns):
+                result[name] = text
+        except TimeoutExpired:
+            self.partial = True
+            pending = self.PENDING
+        return ''.join(result.get(name, '') for name in SEGMENTS) + pending
 
 
 if __name__ == '__main__':
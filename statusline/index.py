@@ -0,0 +1,526 @@
+#!/usr/bin/python3
+import json
+import os
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from os import path
+from subprocess import CalledProcessError
+from typing import Optional, Sequence, cast
+
+from statusline.cache import Memo, SubmoduleCache, cache_dir, signature
+from statusline.costs import LEVELS, REDUCED
+from statusline.git import Git, Repository, Snapshot, Status
+
+
+# Index entry layout from Documentation/gitformat-index.txt, ctime to size are 32 bit
+STAT = struct.Struct('>10I')
+FIELDS = 10
+CTIME, CTIME_NS, MTIME, MTIME_NS, DEV, INO, MODE, UID, GID, SIZE = range(FIELDS)
+FLAGS = struct.Struct('>H')
+HASH_SIZE = 20
+NAME_MASK = 0xfff
+STAGE_MASK = 0x3000
+EXTENDED = 0x4000
+# Set by git update-index --assume-unchanged, git status doesn't check these entries
+ASSUME_VALID = 0x8000
+# Extended flags (version 3 onwards)
+INTENT_TO_ADD = 0x2000
+SKIP_WORKTREE = 0x4000
+# Entry modes by their object type bits
+TYPE_MASK = 0o170000
+GITLINK = 0o160000
+# Where the skip-worktree bit is kept in place of the name length
+SKIPPED = 0x1
+# Entries git status leaves unchecked
+UNCHECKED = ASSUME_VALID | SKIPPED
+# The fewest entries worth handing to a thread
+CHUNK = 256
+# Extensions the entries can't be understood without
+UNSUPPORTED = (b'link', b'sdir')
+
+
+class UnsupportedIndex(ValueError):
+    """Raised for index features this reader leaves to git."""
+
+
+def _varint(data: bytes, offset: int) -> tuple[int, int]:
+    """Decode the offset encoding version 4 uses for name prefix lengths.
+    :param data: the index contents
+    :param offset: where the number starts
+    :return: the number and the offset after it
+    """
+    byte = data[offset]
+    offset += 1
+    value = byte & 0x7f
+    while byte & 0x80:
+        byte = data[offset]
+        offset += 1
+        value = ((value + 1) << 7) | (byte & 0x7f)
+    return value, offset
+
+
+class Index:
+    """The entries of a git index (versions 2 to 4) held in flat arrays.
+
+    Stat data for every entry lives in one array of 32 bit values (FIELDS
+    per entry) with the flags in another, so even large indexes only cost a
+    few bytes per entry beyond the path names. Object hashes aren't kept.
+    """
+
+    def __init__(self, data: bytes):
+        """Parse an index.
+        :param data: the whole index file
+        :raises UnsupportedIndex: for versions, extensions or entries this can't model
+        """
+        if data[:4] != b'DIRC':
+            raise UnsupportedIndex('not an index')
+        self.version, count = struct.unpack_from('>II', data, 4)
+        if self.version not in (2, 3, 4):
+            raise UnsupportedIndex(f'index version {self.version}')
+        self.stats = array('I')
+        self.flags = array('H')
+        self.names: list[bytes] = []
+        # Whether the cache-tree extension is valid for the whole index, and its tree
+        self.tree: Optional[str] = None
+        offset = self._entries(data, 12, count)
+        self._extensions(data, offset)
+
+    def __len__(self):
+        """Count the entries."""
+        return len(self.names)
+
+    def _entries(self, data: bytes, offset: int, count: int) -> int:
+        """Read every entry.
+        :param data: the whole index file
+        :param offset: where the first entry starts
+        :param count: the number of entries
+        :return: the offset after the last entry
+        """
+        previous = b''
+        for _ in range(count):
+            start = offset
+            self.stats.extend(STAT.unpack_from(data, offset))
+            offset += STAT.size + HASH_SIZE
+            flags, = FLAGS.unpack_from(data, offset)
+            offset += FLAGS.size
+            if flags & EXTENDED:
+                extended, = FLAGS.unpack_from(data, offset)
+                offset += FLAGS.size
+                if extended & INTENT_TO_ADD:
+                    raise UnsupportedIndex('intent to add entries')
+                # Only the skip-worktree bit matters here so it replaces the name length
+                flags = flags & ~NAME_MASK | SKIPPED * bool(extended & SKIP_WORKTREE)
+            else:
+                flags &= ~NAME_MASK
+            if self.version == 4:
+                strip, offset = _varint(data, offset)
+                end = data.index(b'\0', offset)
+                name = previous[:len(previous) - strip] + data[offset:end]
+                offset = end + 1
+            else:
+                end = data.index(b'\0', offset)
+                name = data[offset:end]
+                # Entries are padded with 1 to 8 NULs to a multiple of 8 bytes
+                offset = start + (end - start + 8) // 8 * 8
+            self.flags.append(flags)
+            self.names.append(name)
+            previous = name
+        return offset
+
+    def _extensions(self, data: bytes, offset: int):
+        """Read the extensions that matter, rejecting those that change the entries.
+        :param data: the whole index file
+        :param offset: where the extensions start
+        """
+        end = len(data) - HASH_SIZE
+        while offset + 8 <= end:
+            name, size = data[offset:offset + 4], struct.unpack_from('>I', data, offset + 4)[0]
+            offset += 8
+            if name in UNSUPPORTED:
+                raise UnsupportedIndex(f'{name.decode()} extension')
+            if name == b'TREE':
+                # The root comes first as an empty path, -1 entries if it is invalid
+                path_end = data.index(b'\0', offset)
+                line_end = data.index(b'\n', path_end)
+                entries = int(data[path_end + 1:line_end].split(b' ')[0])
+                if entries == len(self.names):
+                    self.tree = data[line_end + 1:line_end + 1 + HASH_SIZE].hex()
+            offset += size
+
+    def stage(self, position: int) -> int:
+        """Read the merge stage of an entry.
+        :param position: the entry number
+        :return: 0 for a normal entry, 1 to 3 while conflicted
+        """
+        return (self.flags[position] & STAGE_MASK) >> 12
+
+    def skipped(self, position: int) -> bool:
+        """Check if git status leaves an entry unchecked.
+        That is one outside a sparse checkout or assumed unchanged.
+        :param position: the entry number
+        :return: whether the skip-worktree or assume-valid bit is set
+        """
+        return bool(self.flags[position] & UNCHECKED)
+
+    def mode(self, position: int) -> int:
+        """Read the mode of an entry.
+        :param position: the entry number
+        :return: the git mode eg. 0o100644
+        """
+        return self.stats[position * FIELDS + MODE]
+
+
+def _matches(cached: array, position: int, stat: os.stat_result) -> bool:
+    """Compare an entry's cached stat data with the file the way git does by default.
+    :param cached: the index stat array
+    :param position: the entry number
+    :param stat: the lstat of the file
+    :return: whether nothing git checks has changed
+    """
+    base = position * FIELDS
+    mask = 0xffffffff
+    # Seconds are stored in 32 bits so this holds until 2106
+    return bool(
+        cached[base + MTIME] * 1000000000 + cached[base + MTIME_NS] == stat.st_mtime_ns
+        and cached[base + CTIME] * 1000000000 + cached[base + CTIME_NS] == stat.st_ctime_ns
+        and cached[base + SIZE] == stat.st_size & mask
+        and cached[base + INO] == stat.st_ino & mask
+        and cached[base + UID] == stat.st_uid
+        and cached[base + GID] == stat.st_gid
+        # The object type and executable bit
+        and (cached[base + MODE] ^ stat.st_mode) & (TYPE_MASK | 0o100) == 0
+    )
+
+
+def _modified(cached: array, position: int, stat: os.stat_result) -> bool:
+    """Check for the changes git counts as modifications without reading the file.
+    That is another type of file or another size, unless the size was
+    recorded as 0 which git does to mark racily clean entries.
+    :param cached: the index stat array
+    :param position: the entry number
+    :param stat: the lstat of the file
+    :return: whether the entry is certainly modified
+    """
+    base = position * FIELDS
+    size = cached[base + SIZE]
+    return bool(
+        (cached[base + MODE] ^ stat.st_mode) & TYPE_MASK
+        or size and size != stat.st_size & 0xffffffff
+    )
+
+
+def _check(
+    index: Index, base: bytes, written: int, positions: Sequence[int],
+) -> tuple[int, list]:
+    """Stat some of the index's entries.
+    :param index: the parsed index
+    :param base: the worktree with a trailing slash
+    :param written: the index file's mtime in nanoseconds
+    :param positions: the entry numbers to check
+    :return: the number of entries changed and the names of those which may have
+    """
+    changed = 0
+    uncertain = []
+    for position in positions:
+        try:
+            stat = os.lstat(base + index.names[position])
+        except (FileNotFoundError, NotADirectoryError):
+            changed += 1
+            continue
+        # Racily clean entries were written in the same instant as the index
+        if _matches(index.stats, position, stat) and stat.st_mtime_ns < written:
+            continue
+        if _modified(index.stats, position, stat):
+            changed += 1
+        else:
+            uncertain.append(index.names[position])
+    return changed, uncertain
+
+
+class IndexCache:
+    """Keep the parsed indexes of recently used worktrees.
+
+    A parse is reused while the index file's mtime, size and inode match,
+    git replaces the index by renaming a lock file over it.
+    """
+
+    def __init__(self, size: int = 16):
+        """Create an empty cache.
+        :param size: the most indexes to remember before forgetting the idlest
+        """
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._indexes: OrderedDict[str, tuple[tuple, Index]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Count the indexes currently remembered."""
+        return len(self._indexes)
+
+    def clear(self):
+        """Forget every index so each is parsed again."""
+        with self._lock:
+            self._indexes.clear()
+
+    def load(self, git_dir: str) -> tuple[Index, os.stat_result]:
+        """Parse a worktree's index reusing the previous parse if unchanged.
+        :param git_dir: the worktree's git dir
+        :return: the parsed index and the stat of the file it was read from
+        :raises OSError: if there is no index
+        :raises UnsupportedIndex: if the index uses features this can't model
+        """
+        filename = os.path.join(git_dir, 'index')
+        stat = os.stat(filename)
+        key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        with self._lock:
+            if (entry := self._indexes.get(filename)) and entry[0] == key:
+                self.hits += 1
+                self._indexes.move_to_end(filename)
+                return entry[1], stat
+            self.misses += 1
+        with open(filename, 'rb') as file:
+            index = Index(file.read())
+        with self._lock:
+            self._indexes[filename] = (key, index)
+            self._indexes.move_to_end(filename)
+            if len(self._indexes) > self.size:
+                self._indexes.popitem(last=False)
+        return index, stat
+
+
+# Shared so long-lived modes only parse an index again once git rewrites it
+INDEXES = IndexCache()
+
+
+class IndexReader:
+    """Count unstaged changes by comparing the index's stat data with the working tree.
+
+    The files are stat'ed from a thread pool without running git. Like git
+    a deleted file, a new file type or size is a modification. Other stat
+    changes, and entries which are racily clean (modified in the same
+    instant the index was written), can't be judged from stat data alone so
+    are returned for git to check, just as git would read their contents.
+    """
+
+    def __init__(self, workers: int = 1, limit: int = 256):
+        """Create a reader.
+        :param workers: the threads stat'ing files
+        :param limit: the most uncertain entries worth handing to git one by one
+        """
+        self.workers = workers
+        self.limit = limit
+
+    @staticmethod
+    def read(git_dir: str) -> tuple[Index, int]:
+        """Parse a worktree's index through INDEXES.
+        :param git_dir: the worktree's git dir
+        :return: the parsed index and the nanosecond mtime it was written at
+        :raises OSError: if there is no index
+        :raises UnsupportedIndex: if the index uses features this can't model
+        """
+        index, stat = INDEXES.load(git_dir)
+        return index, stat.st_mtime_ns
+
+    def compare(
+        self, index: Index, root: str, written: int, gitlinks: bool = False,
+    ) -> Optional[tuple[int, list[str]]]:
+        """Find the entries that differ from the working tree.
+        :param index: the worktree's parsed index
+        :param root: the worktree
+        :param written: the index file's mtime in nanoseconds
+        :param gitlinks: whether submodules are counted elsewhere and can be skipped
+        :return: the number of entries certainly changed and the paths of those
+            which may have, None if there are too many to check one by one
+        :raises UnsupportedIndex: for conflicts or submodules git has to judge
+        """
+        if any(flags & STAGE_MASK for flags in index.flags):
+            raise UnsupportedIndex('conflicted entries')
+        # Slicing the arrays keeps the per-entry work in C
+        modes = index.stats[MODE::FIELDS]
+        if GITLINK in modes and not gitlinks:
+            raise UnsupportedIndex('submodules')
+        positions: Sequence[int] = range(len(index))
+        if GITLINK in modes or any(flags & UNCHECKED for flags in index.flags):
+            positions = [
+                position for position in positions
+                if modes[position] != GITLINK and not index.skipped(position)
+            ]
+        base = os.fsencode(root) + b'/'
+        if self.workers < 2 or len(positions) < 2 * CHUNK:
+            changed, names = _check(index, base, written, positions)
+        else:
+            size = max(len(positions) // (self.workers * 4), CHUNK)
+            chunks = [positions[start:start + size] for start in range(0, len(positions), size)]
+            changed, names = 0, []
+            with ThreadPoolExecutor(min(self.workers, len(chunks))) as pool:
+                for count, found in pool.map(
+                    lambda chunk: _check(index, base, written, chunk), chunks,
+                ):
+                    changed += count
+                    names.extend(found)
+        if len(names) > self.limit:
+            return None
+        return changed, [os.fsdecode(name) for name in names]
+
+
+class IndexGit(Git):
+    """Count working copy changes from the index in-process rather than with git status.
+
+    Unstaged changes are found by IndexReader with git status only asked
+    about the few entries stat data can't settle. Nothing is staged when the
+    index's cached tree (kept valid by git commit) is HEAD's, otherwise git
+    diff-index counts what is once per index and HEAD. Untracked files are
+    still listed by git ls-files, alongside the rest. Indexes with conflicts,
+    intent to add entries, split or sparse indexes, unchecked submodules and
+    unborn or SHA-256 repositories fall back to git status.
+    """
+
+    @cached_property
+    def _reader(self) -> IndexReader:
+        """Property for the index reader.
+        STATUSLINE_INDEX_WORKERS sets its threads, by default one per CPU.
+        :return: the IndexReader
+        """
+        workers = os.environ.get('STATUSLINE_INDEX_WORKERS') or os.cpu_count() or 1
+        return IndexReader(workers=int(workers))
+
+    @cached_property
+    def _staged_memo(self) -> Optional[Memo]:
+        """Property for the memoized staged counts.
+        Like ahead/behind these aren't memoized once memo is disabled.
+        :return: the Memo kept in the cache dir, None without memo
+        """
+        return Memo(path.join(cache_dir(), 'staged.json')) if self.memo else None
+
+    def snapshot(self) -> Snapshot:
+        """Collect the working copy details reading the index where possible.
+        Counts match `git status --porcelain=v2` at the cost model's level.
+        :return: the Snapshot of the current repository state
+        """
+        if self._snapshot is not None:
+            return self._snapshot
+        if not self.repository:
+            return super().snapshot()
+        root = self.repository.worktree
+        level = self.costs.level(root) if self.costs else 0
+        config, options = LEVELS[level]
+        submodules = SubmoduleCache.from_environ()
+        if (status := self._index_status(config, options, bool(submodules))) is None:
+            return super().snapshot()
+        status.approximate = level >= REDUCED
+        if submodules:
+            status.submodules = self.submodules(submodules)
+        self._snapshot = Snapshot(status=status)
+        return self._snapshot
+
+    def _index_status(
+        self, config: list, options: list, separate: bool = False,
+    ) -> Optional[Status]:
+        """Count changes comparing the index with HEAD and the working tree.
+        :param config: options for git itself from the cost level
+        :param options: options for git status from the cost level
+        :param separate: whether submodules are counted separately so can be skipped
+        :return: the Status, None if git status must be used instead
+        """
+        repository = cast(Repository, self.repository)
+        head = repository.resolve('HEAD')
+        if not head or repository.object_format != 'sha1':
+            return None
+        skip = separate or '--ignore-submodules=all' in options
+        try:
+            index, written = self._reader.read(repository.git_dir)
+            if not (compared := self._reader.compare(index, repository.worktree, written, skip)):
+                return None
+        except (OSError, UnsupportedIndex):
+            return None
+        base = config + ['--literal-pathspecs', '-C', repository.worktree]
+        with ThreadPoolExecutor(1) as pool:
+            untracked = pool.submit(self._untracked, base) \
+                if '--untracked-files=no' not in options else None
+            unstaged = compared[0] + self._unstaged(base, compared[1])
+            # Nothing is staged while the index's cached tree is HEAD's
+            staged = self._staged(base, skip, head) \
+                if index.tree is None or index.tree != self._tree(head) else 0
+            return Status(
+                staged, unstaged, untracked.result() if untracked else 0, cap=self._cap(),
+            )
+
+    def _unstaged(self, base: list, paths: list) -> int:
+        """Ask git status which of the entries stat data couldn't settle have changed.
+        This also refreshes their stat data so they are settled next time.
+        :param base: options for git selecting the worktree
+        :param paths: the entries to check relative to the worktree
+        :return: the number of entries modified in the working tree
+        """
+        if not paths:
+            return 0
+        chunks = self._stream_command(
+            base + ['status', '--porcelain=v2', '-z', '--untracked-files=no']
+            + ['--ignore-submodules=all', '--'] + paths
+        )
+        try:
+            return Snapshot.parse(chunks).status.unstaged
+        finally:
+            chunks.close()
+
+    def _staged(self, base: list, skip: bool, head: str) -> int:
+        """Count the entries which differ between HEAD and the index, renames once.
+        Counts are memoized by HEAD and the index signature so git only runs
+        again once either moves.
+        :param base: options for git selecting the worktree
+        :param skip: whether submodules are ignored
+        :param head: the commit HEAD resolves to
+        :return: the number of staged entries
+        """
+        git_dir = cast(Repository, self.repository).git_dir
+        key = json.dumps([git_dir, head, skip] + signature([path.join(git_dir, 'index')]))
+        if self._staged_memo and (staged := self._staged_memo.get(key)) is not None:
+            return int(staged)
+        output = self._run_command(
+            base + ['diff-index', '--cached', '-M', '--name-only', '-z']
+            + ['--ignore-submodules=all'] * skip + ['HEAD', '--']
+        )
+        if self._staged_memo:
+            self._staged_memo.put(key, output.count('\0'))
+        return output.count('\0')
+
+    def _tree(self, commit: str) -> Optional[str]:
+        """Find the tree a commit records.
+        :param commit: the commit hash
+        :return: the tree hash, None if the commit couldn't be read
+        """
+        if tree := cast(Repository, self.repository).tree(commit):
+            return tree
+        try:
+            return self._run_command(['rev-parse', '--verify', '-q', f'{commit}^{{tree}}']).strip()
+        except CalledProcessError:
+            return None
+
+    def _untracked(self, base: list) -> int:
+        """Count untracked files the way git status shows them.
+        Following status.showUntrackedFiles directories holding only untracked
+        files count once unless it is all, listing stops past the cap.
+        :param base: options for git selecting the worktree
+        :return: the number of untracked entries, 0 when they aren't shown
+        """
+        if (mode := cast(Repository, self.repository).show_untracked) == 'no':
+            return 0
+        cap = self._cap()
+        count = 0
+        chunks = self._stream_command(
+            base + ['ls-files', '--others', '--exclude-standard']
+            + ['--directory', '--no-empty-directory'] * (mode == 'normal') + ['-z']
+        )
+        try:
+            for chunk in chunks:
+                count += chunk.count(b'\0')
+                if cap is not None and count > cap:
+                    break
+        finally:
+            chunks.close()
+        return count
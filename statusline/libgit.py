@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+from functools import cached_property
+
+import pygit2  # pylint: disable=import-error
+
+from statusline.cache import SubmoduleCache
+from statusline.costs import LEVELS
+from statusline.git import Git, Snapshot, Status
+
+
+# Status bits from <git2/status.h>
+INDEX_NEW = 0x1
+INDEX_DELETED = 0x4
+INDEX_CHANGES = 0x1f
+WT_NEW = 0x80
+# Modified, deleted, typechange, renamed and unreadable
+WORKTREE_CHANGES = 0x1f00
+CONFLICTED = 0x8000
+
+
+class LibGit(Git):
+    """Answer the queries Git would spawn processes for in-process with libgit2 (via pygit2).
+
+    The repository reader still provides the root, branch and stash count and
+    ahead/behind is memoized in the same way, so only status and the commit
+    walks differ. libgit2 can't be stopped part way so the time budget isn't
+    applied, and as it doesn't detect renames the status falls back to git
+    when the index holds both additions and deletions that may be one, as it
+    does in submodule mode and once the cost model skips submodules.
+    """
+
+    @cached_property
+    def _libgit(self) -> pygit2.Repository:
+        """Property for the libgit2 repository handle, opened on first use.
+        :return: the pygit2 Repository at the root
+        """
+        return pygit2.Repository(self.root_dir)
+
+    def _left_right(self, left: str, right: str) -> tuple[int, int]:
+        """Count commits on each side of a symmetric difference in one walk.
+        :param left: the first commit
+        :param right: the second commit
+        :return: the number of commits only reachable from left and from right
+        """
+        only_left, only_right = self._libgit.ahead_behind(left, right)
+        return only_left, only_right
+
+    def snapshot(self) -> Snapshot:
+        """Collect branch, upstream, working copy and stash details without running git.
+        Counts match `git status --porcelain=v2` at the cost model's level.
+        :return: the Snapshot of the current repository state
+        """
+        if self._snapshot is not None:
+            return self._snapshot
+        level = self.costs.level(self.repository.worktree) \
+            if self.costs and self.repository else 0
+        options = LEVELS[level][1]
+        if SubmoduleCache.from_environ() or '--ignore-submodules=all' in options:
+            # libgit2 can't be asked to skip submodules the way git status is
+            return super().snapshot()
+        mode = self.repository.show_untracked if self.repository else 'normal'
+        staged = unstaged = untracked = 0
+        added = deleted = False
+        for flags in self._libgit.status(untracked_files=mode).values():
+            if flags == WT_NEW:
+                untracked += 1
+                continue
+            conflicted = bool(flags & CONFLICTED)
+            staged += bool(flags & INDEX_CHANGES) or conflicted
+            unstaged += bool(flags & WORKTREE_CHANGES) or conflicted
+            added = added or bool(flags & INDEX_NEW)
+            deleted = deleted or bool(flags & INDEX_DELETED)
+        if added and deleted:
+            # git would count a rename as one entry where libgit2 sees two
+            return super().snapshot()
+        repository = self._libgit
+        snapshot = Snapshot(stashes=len(repository.listall_stashes()))
+        if repository.head_is_unborn:
+            # Like git an unborn branch is still named
+            snapshot.branch = (self.repository.branch or 'HEAD') if self.repository else 'HEAD'
+        elif not repository.head_is_detached:
+            local = repository.branches.local[repository.head.shorthand]
+            snapshot.branch = local.branch_name
+            if upstream := local.upstream:
+                snapshot.upstream = upstream.shorthand
+        snapshot.status = Status(staged, unstaged, untracked, cap=self._cap())
+        self._snapshot = snapshot
+        return snapshot
@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+import os
+from typing import Optional
+
+from statusline.cache import Memo, cache_dir
+
+
+def unique_prefix(name: str, siblings: list, minimum: int = 1) -> str:
+    """Find the shortest prefix of name which no sibling also starts with.
+    :param name: the directory name to shorten
+    :param siblings: the other names in the same directory
+    :param minimum: the shortest prefix worth returning
+    :return: the unambiguous prefix, the whole name if every prefix is shared
+    """
+    for length in range(minimum, len(name)):
+        prefix = name[:length]
+        if not any(sibling.startswith(prefix) for sibling in siblings):
+            return prefix
+    return name
+
+
+class PrefixCache:
+    """Shorten directory names to their minimum unique prefix among sibling directories.
+
+    Listing a directory is the expensive part so the answer is memoized on disk
+    keyed by the parent's device, inode and mtime. Any change to the parent's
+    entries changes its mtime, so repeat prompts only stat the path components.
+    """
+
+    def __init__(self, memo: Memo, limit: int = 1000):
+        """Create a cache over a memo.
+        :param memo: where answers are persisted
+        :param limit: directories with more entries than this aren't listed
+        """
+        self.memo = memo
+        self.limit = limit
+
+    @classmethod
+    def from_environ(cls) -> Optional['PrefixCache']:
+        """Build the cache configured by the environment.
+        STATUSLINE_MINIFY=unique enables it and STATUSLINE_LISTING_LIMIT
+        sets the size of directory that is too big to list.
+        :return: the configured cache, None if unique prefixes are disabled
+        """
+        if os.environ.get('STATUSLINE_MINIFY') != 'unique':
+            return None
+        return cls(
+            Memo(os.path.join(cache_dir(), 'prefixes.json'), size=1024),
+            limit=int(os.environ.get('STATUSLINE_LISTING_LIMIT', 1000)),
+        )
+
+    def _siblings(self, parent: str, name: str, start: str) -> Optional[list]:
+        """List the other directories in parent which could be confused with name.
+        :param parent: the directory containing name
+        :param name: the directory being shortened
+        :param start: the prefix every candidate shares with name
+        :return: the candidate names, None if parent has more than limit entries
+        """
+        result = []
+        with os.scandir(parent) as entries:
+            for count, entry in enumerate(entries):
+                if count >= self.limit:
+                    return None
+                if entry.name != name and entry.name.startswith(start) and entry.is_dir():
+                    result.append(entry.name)
+        return result
+
+    def shorten(self, parent: str, name: str, minimum: str) -> str:
+        """Shorten a directory name as far as its siblings allow.
+        :param parent: the directory containing name
+        :param name: the directory name to shorten
+        :param minimum: the shortest form to use (eg. from the regex minify)
+        :return: the unique prefix, minimum if parent can't or shouldn't be listed
+        """
+        try:
+            stat = os.stat(parent or os.sep)
+        except OSError:
+            return minimum
+        key = f'{stat.st_dev}:{stat.st_ino}:{stat.st_mtime_ns}:{name}'
+        if (cached := self.memo.get(key)) is not None:
+            return str(cached)
+        try:
+            siblings = self._siblings(parent or os.sep, name, minimum)
+        except OSError:
+            return minimum
+        result = minimum if siblings is None else unique_prefix(name, siblings, len(minimum))
+        self.memo.put(key, result)
+        return result
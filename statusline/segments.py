@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+import os
+import re
+from typing import Callable, Iterator, Optional
+
+
+# The repository segments in display order, also the default priority
+SEGMENTS = ('icon', 'branch', 'ahead_behind', 'status', 'stashes')
+# The fewest columns each segment takes when it shows anything, eg. ↯ or (1)
+MINIMUM_WIDTH = {'icon': 1, 'branch': 1, 'ahead_behind': 1, 'status': 3, 'stashes': 3}
+# Escapes are wrapped in \001 \002 for readline so they can be skipped when measuring
+INVISIBLE = re.compile('\001[^\002]*\002')
+
+
+def _config_file() -> str:
+    """Name the file segments are configured in.
+    :return: the path of $XDG_CONFIG_HOME/statusline/segments
+    """
+    base = os.environ.get('XDG_CONFIG_HOME') or os.path.join(os.path.expanduser('~'), '.config')
+    return os.path.join(base, 'statusline', 'segments')
+
+
+def configured() -> tuple[str, ...]:
+    """Read which segments are enabled in priority order.
+    STATUSLINE_SEGMENTS (comma separated) overrides the config file, which
+    lists them separated by commas or lines. Unknown names are ignored.
+    :return: the enabled segment names, highest priority first
+    """
+    if (value := os.environ.get('STATUSLINE_SEGMENTS')) is None:
+        try:
+            with open(_config_file(), encoding='utf-8') as file:
+                value = file.read().replace('\n', ',')
+        except OSError:
+            return SEGMENTS
+    return tuple(dict.fromkeys(
+        name for name in (name.strip() for name in value.split(',')) if name in SEGMENTS
+    ))
+
+
+def budget() -> Optional[int]:
+    """Find how many columns the statusline may use.
+    STATUSLINE_WIDTH is either a number of columns or a percentage of
+    $COLUMNS, without it (or with anything else) there is no limit.
+    :return: the column budget, None if it is unlimited
+    """
+    share = os.environ.get('STATUSLINE_WIDTH', '')
+    if share.isdigit():
+        return int(share)
+    if not share.endswith('%') or not share[:-1].isdigit() \
+            or not (columns := os.environ.get('COLUMNS', '')).isdigit():
+        return None
+    return int(columns) * int(share[:-1]) // 100
+
+
+def width(text: str) -> int:
+    """Measure the columns text takes on the terminal.
+    :param text: the rendered text including escapes
+    :return: the number of visible characters
+    """
+    return len(INVISIBLE.sub('', text))
+
+
+def plausible(order: tuple[str, ...], columns: Optional[int]) -> tuple[str, ...]:
+    """Find the segments which could fit if those before them took their minimum width.
+    Anything else can be left unevaluated.
+    :param order: the enabled segment names in priority order
+    :param columns: the column budget, None if it is unlimited
+    :return: the segments worth preparing
+    """
+    if columns is None:
+        return order
+    result = []
+    for name in order:
+        if MINIMUM_WIDTH[name] <= columns:
+            result.append(name)
+            columns -= MINIMUM_WIDTH[name]
+    return tuple(result)
+
+
+def evaluate(
+    renders: dict[str, Callable[[], str]], order: tuple[str, ...], columns: Optional[int],
+) -> Iterator[tuple[str, str]]:
+    """Render segments one at a time in priority order while they fit.
+    A segment is only rendered if its minimum width fits what is left of the
+    budget, and is dropped if its text turns out to be too wide.
+    :param renders: produce the text of each segment
+    :param order: the enabled segment names in priority order
+    :param columns: the column budget, None if it is unlimited
+    :return: the name and text of each segment that fit
+    """
+    for name in order:
+        if columns is not None and MINIMUM_WIDTH[name] > columns:
+            continue
+        text = renders[name]()
+        if columns is not None:
+            if (size := width(text)) > columns:
+                continue
+            columns -= size
+        yield name, text
@@ -0,0 +1,24 @@
+# Render the bash prompt with a long-lived `statusline --coproc` process.
+# Source this from ~/.bashrc, the process is restarted if it exits or is too slow to answer.
+
+__statusline_start() {
+    coproc STATUSLINE { statusline --coproc 2>/dev/null; }
+}
+
+__statusline_prompt() {
+    local status=$? line=
+    [[ -n ${STATUSLINE_PID:-} ]] && kill -0 "$STATUSLINE_PID" 2>/dev/null || __statusline_start
+    printf '%s\t%s\t%s\n' "$PWD" "$status" "${COLUMNS:-}" >&"${STATUSLINE[1]}"
+    if ! IFS= read -r -t 2 -u "${STATUSLINE[0]}" line; then
+        # A late answer would be read by the next prompt so start afresh instead
+        kill "$STATUSLINE_PID" 2>/dev/null
+        wait "$STATUSLINE_PID" 2>/dev/null
+        line=
+    fi
+    # Expanded by promptvars so path characters are never interpreted
+    __statusline_line=${line:-$PWD}
+    return $status
+}
+
+PS1='${__statusline_line}\$ '
+PROMPT_COMMAND="__statusline_prompt${PROMPT_COMMAND:+;$PROMPT_COMMAND}"
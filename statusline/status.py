@@ -1,11 +1,18 @@
 #!/usr/bin/python3
 import os
 import re
-from typing import cast
+import threading
+from collections import OrderedDict
+from functools import cache
+from subprocess import CalledProcessError, TimeoutExpired
+from typing import TYPE_CHECKING, Callable, Optional, cast
 
-from ansi.colour import fg, fx  # type: ignore
+from statusline import escapes, segments, trace
+from statusline.cache import cache_dir
+from statusline.git import Backend, Git
 
-from statusline.git import Git
+if TYPE_CHECKING:
+    from statusline.prefix import PrefixCache
 
 
 def _hilight(text: str) -> str:
@@ -13,12 +20,105 @@ def _hilight(text: str) -> str:
     :param text: the text to highlight
     :return: the string with colour escapes applied
     """
-    return f'{fg.brightblue}{text}{fx.reset}'
+    return f'{escapes.BRIGHTBLUE}{text}{escapes.RESET}'
+
+
+def _discover(path: str) -> Optional[Backend]:
+    """Create the backend for the repository containing a directory.
+    The backends module is only imported once a backend has been chosen,
+    by STATUSLINE_BACKEND or a persisted select, otherwise git is used.
+    :param path: the directory to look from
+    :return: the backend rooted at the repository, None if path isn't in one
+    """
+    if os.environ.get('STATUSLINE_BACKEND') \
+            or os.path.exists(os.path.join(cache_dir(), 'backends.json')):
+        # pylint: disable-next=import-outside-toplevel
+        from statusline.backends import discover
+        return discover(path)
+    return Git.discover(path)
+
+
+@cache
+def _home() -> str:
+    """Find the user's home directory once, when it is first needed.
+    :return: the expanded ~
+    """
+    return os.path.expanduser('~')
+
+
+class PathCache:
+    """Least recently used cache of minified path prefixes.
+
+    Entries are keyed by the unminified prefix so a directory is only
+    minified once and every descendant of it reuses the result.
+    """
+
+    def __init__(self, size: int = 512):
+        """Create an empty cache.
+        :param size: the most prefixes to keep before evicting the idlest
+        """
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Count the prefixes currently held."""
+        return len(self._entries)
+
+    def _store(self, key: str, value: str):
+        """Add an entry evicting the idlest if the cache is full.
+        :param key: the unminified prefix
+        :param value: the minified prefix
+        """
+        self._entries[key] = value
+        if len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def minify(self, names: list, minify_dir: Callable[[str], str]) -> str:
+        """Minify each name and join them with os.sep reusing the longest cached prefix.
+        :param names: the leading names of a path
+        :param minify_dir: shortens a single name
+        :return: the minified names joined as a path
+        """
+        with self._lock:
+            key = os.sep.join(names)
+            if (result := self._entries.get(key)) is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return result
+            self.misses += 1
+            # Walk back to the nearest minified ancestor then fill in below it
+            count = len(names) - 1
+            while count and (result := self._entries.get(os.sep.join(names[:count]))) is None:
+                count -= 1
+            for index in range(count, len(names)):
+                name = minify_dir(names[index])
+                result = name if index == 0 else f'{result}{os.sep}{name}'
+                self._store(os.sep.join(names[:index + 1]), result)
+            return cast(str, result)
+
+
+# Shared so batch and long-lived renders reuse prefixes between instances
+PATHS = PathCache()
 
 
 class DirectoryMinify:
     """Handle directory shortening and applying VCS."""
-    VCS = Git()
+
+    def __init__(self, vcs: Optional[Backend] = None, paths: Optional[PathCache] = None):
+        """Create a minifier.
+        :param vcs: the repository accessor to use, by default one is found for each path
+        :param paths: the cache of minified prefixes (defaults to the shared one)
+        """
+        self.VCS = vcs  # pylint: disable=invalid-name
+        self.paths = paths if paths is not None else PATHS
+        self.prefixes: Optional['PrefixCache'] = None
+        if os.environ.get('STATUSLINE_MINIFY') == 'unique':
+            # pylint: disable-next=import-outside-toplevel
+            from statusline.prefix import PrefixCache
+            self.prefixes = PrefixCache.from_environ()
 
     @staticmethod
     def _minify_dir(name: str, regex: re.Pattern = re.compile(r'^(\W*\w)')) -> str:
@@ -31,42 +131,90 @@ class DirectoryMinify:
             return cast(str, match[0])
         return name
 
-    def minify_path(self, path: str, home: str = os.path.expanduser('~'), keep: int = 1) -> str:
+    def _unique_dir(self, pathlist: list, index: int, home: str, base: str) -> str:
+        """Shorten a name to its unique prefix among the directories beside it.
+        :param pathlist: the names making up the path (with home as ~)
+        :param index: the position of the name to shorten
+        :param home: the user's home directory
+        :param base: the directory the path is relative to
+        :return: the minified name
+        """
+        name = pathlist[index]
+        minimum = self._minify_dir(name)
+        if not index or minimum == name:
+            return minimum
+        parent = os.sep.join(pathlist[:index])
+        if parent.startswith('~'):
+            parent = home + parent[1:]
+        return cast('PrefixCache', self.prefixes).shorten(base + parent, name, minimum)
+
+    @trace.phase('minify_path')
+    def minify_path(
+        self, path: str, home: Optional[str] = None, keep: int = 1, base: str = '',
+    ) -> str:
         """Minify a path string.
         Substitutes {home} to ~. Each name (every os.sep) is then reduced
-        with _minify_dir except for the last {keep} items.
+        with _minify_dir except for the last {keep} items, or to the shortest
+        unique prefix among its siblings when STATUSLINE_MINIFY=unique.
         :param path: the whole path to minify
-        :param home: the user's home directory (will be replaced with ~)
+        :param home: the user's home directory (will be replaced with ~, defaults to $HOME)
         :param keep: the number of complete names to keep at the end
+        :param base: the directory path is relative to (used to list siblings)
         :return: the minified path
         """
+        home = home or _home()
         pathlist = path.replace(home, '~', 1).split(os.sep)
         if len(pathlist) > keep:
-            pathlist = list(map(self._minify_dir, pathlist[:-keep])) + pathlist[-keep:]
+            if self.prefixes is None:
+                head = [self.paths.minify(pathlist[:-keep], self._minify_dir)]
+            else:
+                # Siblings can change at any time so these rely on the prefix cache's validation
+                head = [
+                    self._unique_dir(pathlist, index, home, base)
+                    for index in range(len(pathlist) - keep)
+                ]
+            pathlist = head + pathlist[-keep:]
         return _hilight(os.sep.join(pathlist))
 
-    def _apply_vcs(self, path: str) -> str:
+    @trace.phase('_apply_vcs')
+    def _apply_vcs(self, path: str, vcs: Backend) -> str:
         """Add VCS status information at the repository root in the path.
         :param path: the original path to generate details from
+        :param vcs: the repository accessor for path
         :return: the minified path with repository information inserted
         """
-        common = os.path.commonpath([path, self.VCS.root_dir])
+        common = os.path.commonpath([path, vcs.root_dir])
         keep = 1
-        # Accomodate morktrees located in etc/repo/branch
-        if self.VCS.branch == os.path.basename(common):
-            keep += 1
-        return self.minify_path(common, keep=keep) \
-            + self.VCS.short_stats() \
-            + self.minify_path(path[len(common):])
-
-    def get_statusline(self) -> str:
+        try:
+            # Accomodate morktrees located in etc/repo/branch
+            if vcs.branch == os.path.basename(common):
+                keep += 1
+        except TimeoutExpired:
+            # Without the branch in time the repository is shown as a normal one
+            pass
+        head = self.minify_path(common, keep=keep)
+        tail = self.minify_path(path[len(common):], base=common)
+        # The path is always shown, repository segments get whatever width is left
+        if (columns := segments.budget()) is not None:
+            columns = max(columns - segments.width(head + tail), 0)
+        vcs.prefetch(columns)
+        return head + vcs.short_stats(columns) + tail
+
+    @trace.phase('get_statusline', render=True)
+    def get_statusline(self, path: Optional[str] = None) -> str:
         """Generate a string of information to be used in bash prompt.
         This will include the working dir and the short summary from VCS.
+        :param path: the directory to describe (defaults to the working dir)
         :return: minified working dir with VCS status if available
         """
-        path = os.getcwd()
-        if self.VCS:
-            return self._apply_vcs(path)
+        path = path or os.getcwd()
+        vcs = self.VCS if self.VCS is not None else _discover(path)
+        if vcs:
+            try:
+                return self._apply_vcs(path, vcs)
+            except CalledProcessError:
+                # Discovery found a .git that git refuses (eg. empty or owned by another user)
+                pass
         return self.minify_path(path)
 
 
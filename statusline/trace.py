@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from subprocess import CalledProcessError, TimeoutExpired
+from typing import Any, Callable, Iterator, Optional, TypeVar, cast
+
+
+_local = threading.local()
+Function = TypeVar('Function', bound=Callable[..., Any])
+
+
+def destination() -> Optional[str]:
+    """Find where trace events should be written.
+    :return: the path from STATUSLINE_TRACE, None when tracing is off
+    """
+    return os.environ.get('STATUSLINE_TRACE') or None
+
+
+def _write(path: str, event: dict):
+    """Append an event to the trace file as a json line.
+    :param path: the trace file
+    :param event: the details to record
+    """
+    # pylint: disable-next=import-outside-toplevel
+    import json
+    event.update(pid=os.getpid(), render=getattr(_local, 'render', 0), time=time.time())
+    with open(path, 'a', encoding='utf-8') as file:
+        file.write(json.dumps(event) + '\n')
+
+
+@contextmanager
+def command(argv: list) -> Iterator[dict]:
+    """Record a subprocess call made inside the block.
+    The caller sets 'bytes' on the event once it has the output.
+    :param argv: the command being run
+    :return: the event which will be written when the block exits
+    """
+    event = {'type': 'command', 'argv': argv, 'exit': 0, 'bytes': 0}
+    if not (path := destination()):
+        yield event
+        return
+    start = time.perf_counter()
+    try:
+        yield event
+    except CalledProcessError as error:
+        event.update(exit=error.returncode, bytes=len(error.stdout or b''))
+        raise
+    except TimeoutExpired:
+        event['exit'] = 'timeout'
+        raise
+    finally:
+        event['ms'] = 1000 * (time.perf_counter() - start)
+        _write(path, event)
+
+
+def phase(name: str, render: bool = False) -> Callable[[Function], Function]:
+    """Decorate a function to record how long each call takes.
+    :param name: the phase name used in the trace
+    :param render: whether this phase starts a new render (grouping later events)
+    :return: the decorator
+    """
+    def decorator(function: Function) -> Function:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not (path := destination()):
+                return function(*args, **kwargs)
+            if render:
+                _local.render = getattr(_local, 'render', 0) + 1
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = 1000 * (time.perf_counter() - start)
+                _write(path, {'type': 'phase', 'name': name, 'ms': elapsed})
+        return cast(Function, wrapper)
+    return decorator
+
+
+def load(path: str) -> list:
+    """Read the events from a trace file skipping any partial lines.
+    :param path: the trace file
+    :return: the recorded events
+    """
+    # pylint: disable-next=import-outside-toplevel
+    import json
+    events = []
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                pass
+    return events
+
+
+def summarise(events: list) -> str:
+    """Total time per git command and phase and flag calls repeated within a render.
+    :param events: the events read from a trace
+    :return: a plain text report
+    """
+    totals: dict = defaultdict(lambda: [0, 0.0])
+    renders: dict = defaultdict(lambda: defaultdict(int))
+    for event in events:
+        if event['type'] == 'command':
+            name = ' '.join(event['argv'])
+            renders[event['pid'], event['render']][name] += 1
+        else:
+            name = f'[{event["name"]}]'
+        totals[name][0] += 1
+        totals[name][1] += event['ms']
+    lines = [f'{"calls":>7} {"total ms":>10} {"mean ms":>9}  name']
+    for name, (calls, total) in sorted(totals.items(), key=lambda item: -item[1][1]):
+        lines.append(f'{calls:>7} {total:>10.1f} {total / calls:>9.2f}  {name}')
+    repeated: dict = defaultdict(list)
+    for counts in renders.values():
+        for name, calls in counts.items():
+            if calls > 1:
+                repeated[name].append(calls)
+    if repeated:
+        lines.append('')
+        lines.append('repeated within a render:')
+        for name, occurrences in sorted(repeated.items()):
+            lines.append(f'  {name} up to {max(occurrences)}x in {len(occurrences)} renders')
+    return '\n'.join(lines)
+
+
+def profile(path: Optional[str] = None):
+    """Print the summary of a trace file.
+    :param path: the trace file (defaults to STATUSLINE_TRACE)
+    """
+    if not (path := path or destination()):
+        raise SystemExit('no trace file given and STATUSLINE_TRACE is not set')
+    print(summarise(load(path)))
@@ -0,0 +1,340 @@
+#!/usr/bin/python3
+import ctypes
+import errno
+import os
+import struct
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional, cast
+
+from statusline.cache import signature
+from statusline.git import Repository
+
+
+# inotify event bits from <sys/inotify.h>
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_EXCL_UNLINK = 0x4000000
+IN_MASK_ADD = 0x20000000
+IN_ISDIR = 0x40000000
+# Attribute changes alone don't alter what git status reports for the working tree
+WORKTREE_MASK = IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE \
+    | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_EXCL_UNLINK
+STATE_MASK = WORKTREE_MASK | IN_ATTRIB
+EVENT = struct.Struct('iIII')
+
+
+class Inotify:
+    """Minimal non-blocking wrapper of the Linux inotify calls using ctypes."""
+
+    def __init__(self):
+        """Open an inotify instance.
+        :raises OSError: if inotify isn't available on this system
+        """
+        try:
+            self._libc = ctypes.CDLL(None, use_errno=True)
+            init = self._libc.inotify_init1
+        except (OSError, AttributeError) as error:
+            raise OSError(errno.ENOSYS, 'inotify is not available') from error
+        self.descriptor = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.descriptor < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+
+    def add(self, name: str, mask: int) -> int:
+        """Watch a path, adding to the same watch if the path is already watched.
+        :param name: the file or directory to watch
+        :param mask: the events to report
+        :return: the watch descriptor
+        :raises OSError: eg. ENOSPC when the user's watch limit is reached
+        """
+        descriptor = self._libc.inotify_add_watch(self.descriptor, os.fsencode(name), mask)
+        if descriptor < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code), name)
+        return int(descriptor)
+
+    def remove(self, descriptor: int):
+        """Stop watching, ignoring watches the kernel already dropped.
+        :param descriptor: the watch descriptor from add
+        """
+        self._libc.inotify_rm_watch(self.descriptor, descriptor)
+
+    def read(self) -> list:
+        """Collect every pending event without blocking.
+        :return: (descriptor, mask, name) for each event
+        """
+        events: list = []
+        while True:
+            try:
+                data = os.read(self.descriptor, 65536)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                descriptor, mask, _, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                events.append((descriptor, mask, name))
+
+    def close(self):
+        """Release the inotify instance and all of its watches."""
+        os.close(self.descriptor)
+
+
+@dataclass
+class Watched:
+    """What the watcher knows about one repository."""
+
+    repository: Repository
+    dirty: bool = True
+    used: float = field(default_factory=time.monotonic)
+    descriptors: set = field(default_factory=set)
+    # Set once the repository couldn't be watched so it is validated by stat instead
+    fallback: bool = False
+    key: Optional[list] = None
+    checked: float = 0.0
+
+
+class Watcher:
+    """Tell long-lived renderers when a repository's status may have changed.
+
+    The git state files (see Repository.state_files) and every working tree
+    directory are watched with inotify, and any relevant event marks the
+    repository dirty until it is next checked. Repositories that would take
+    more than the remaining watches, or run into the system limit, fall back
+    to comparing the stat signature of the state files with a ttl for working
+    tree edits, as does everything when inotify isn't available.
+    """
+
+    def __init__(self, limit: int = 8192, idle: float = 600, ttl: float = 5.0):
+        """Create a watcher.
+        :param limit: the most watches to hold across all repositories
+        :param idle: seconds after which an unchecked repository's watches are released
+        :param ttl: seconds the stat fallback trusts an unchanged signature for
+        """
+        self.limit = limit
+        self.idle = idle
+        self.ttl = ttl
+        self._repos: dict[str, Watched] = {}
+        # Maps each watch to its path and the repositories sharing it (sibling worktrees
+        # share the common dir) with the names that matter to each (None for any)
+        self._watches: dict[int, tuple[str, dict[str, Optional[frozenset]]]] = {}
+        self._lock = threading.Lock()
+        try:
+            self._inotify: Optional[Inotify] = Inotify()
+        except OSError:
+            self._inotify = None
+
+    @classmethod
+    def from_environ(cls) -> Optional['Watcher']:
+        """Build the watcher configured by the environment.
+        STATUSLINE_WATCH=off disables it and STATUSLINE_WATCH_LIMIT caps the watches used.
+        :return: the configured watcher, None if it is disabled
+        """
+        if os.environ.get('STATUSLINE_WATCH') in ('0', 'off'):
+            return None
+        return cls(limit=int(os.environ.get('STATUSLINE_WATCH_LIMIT', 8192)))
+
+    def _add(self, root: str, name: str, mask: int, names: Optional[frozenset]) -> bool:
+        """Add one watch for a repository.
+        :param root: the repository root
+        :param name: the path to watch
+        :param mask: the events to report
+        :param names: the entries of the path whose events matter (None for any)
+        :return: False if the watch limit has been reached
+        """
+        inotify = cast(Inotify, self._inotify)
+        try:
+            # Adding to the mask so another repository's events on a shared watch are kept
+            descriptor = inotify.add(name, mask | IN_MASK_ADD)
+        except OSError as error:
+            # A path vanishing while walking is harmless, running out of watches isn't
+            return error.errno != errno.ENOSPC
+        if descriptor not in self._watches:
+            if len(self._watches) >= self.limit:
+                inotify.remove(descriptor)
+                return False
+            self._watches[descriptor] = (name, {})
+        subscribers = self._watches[descriptor][1]
+        if root in subscribers:
+            # Several state files sharing a directory coalesce into one watch
+            previous = subscribers[root]
+            names = None if previous is None or names is None else previous | names
+        subscribers[root] = names
+        self._repos[root].descriptors.add(descriptor)
+        return True
+
+    def _watch_state(self, watched: Watched) -> bool:
+        """Watch the directories holding the repository's state files.
+        A missing directory is covered by watching for its creation in the
+        nearest existing ancestor, the next check then watches further down.
+        :param watched: the repository to watch
+        :return: False if the watch limit has been reached
+        """
+        root = watched.repository.worktree
+        for name in watched.repository.state_files():
+            directory, entry = os.path.split(name)
+            while not os.path.isdir(directory) and directory != os.path.dirname(directory):
+                directory, entry = os.path.split(directory)
+            if not self._add(root, directory, STATE_MASK, frozenset([entry])):
+                return False
+        return True
+
+    @staticmethod
+    def _ignored(root: str, top: str) -> set:
+        """Find the ignored directories below a working tree directory.
+        Git stops at each ignored directory so this is far cheaper than
+        walking into build output to watch it.
+        :param root: the repository root
+        :param top: the directory to look below
+        :return: the ignored directories' paths, empty if git couldn't say
+        """
+        result = subprocess.run(
+            ['git', '-C', root, 'ls-files', '-z', '--others', '--ignored', '--exclude-standard',
+             '--directory', '--', os.path.relpath(top, root)],
+            capture_output=True, check=False,
+        )
+        if result.returncode:
+            return set()
+        return {
+            os.path.join(root, os.fsdecode(name.rstrip(b'/')))
+            for name in result.stdout.split(b'\0') if name.endswith(b'/')
+        }
+
+    def _watch_tree(self, root: str, top: str) -> bool:
+        """Watch a working tree directory and everything below it except .git
+        and ignored directories.
+        :param root: the repository root
+        :param top: the directory to start from
+        :return: False if the watch limit has been reached
+        """
+        ignored = self._ignored(root, top)
+        if top in ignored:
+            return True
+        for directory, subdirs, _ in os.walk(top):
+            subdirs[:] = [
+                subdir for subdir in subdirs
+                if subdir != '.git' and os.path.join(directory, subdir) not in ignored
+            ]
+            if not self._add(root, directory, WORKTREE_MASK, None):
+                return False
+        return True
+
+    def _release(self, watched: Watched):
+        """Drop every watch held for a repository.
+        Watches shared with another repository are only removed once neither uses them.
+        :param watched: the repository to stop watching
+        """
+        root = watched.repository.worktree
+        for descriptor in watched.descriptors:
+            if not (target := self._watches.get(descriptor)):
+                continue
+            target[1].pop(root, None)
+            if not target[1]:
+                del self._watches[descriptor]
+                if self._inotify:
+                    self._inotify.remove(descriptor)
+        watched.descriptors.clear()
+
+    def _start(self, repository: Repository) -> Watched:
+        """Begin tracking a repository, falling back to stat validation if it can't be watched.
+        :param repository: the repository to track
+        :return: the tracking state
+        """
+        root = repository.worktree
+        watched = self._repos[root] = Watched(repository)
+        if not self._inotify or not (
+            self._watch_state(watched) and self._watch_tree(root, root)
+        ):
+            self._release(watched)
+            watched.fallback = True
+        return watched
+
+    def _drain(self):
+        """Apply pending events marking the repositories they affect dirty."""
+        if not self._inotify:
+            return
+        for descriptor, mask, name in self._inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost so nothing can be trusted
+                for watched in self._repos.values():
+                    watched.dirty = True
+                continue
+            if not (target := self._watches.get(descriptor)):
+                continue
+            directory, subscribers = target
+            if mask & IN_IGNORED:
+                del self._watches[descriptor]
+                for root in subscribers:
+                    self._repos[root].descriptors.discard(descriptor)
+            for root, names in list(subscribers.items()):
+                if names is not None and name not in names or root not in self._repos:
+                    continue
+                watched = self._repos[root]
+                watched.dirty = True
+                if names is None and mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    # New directories in the working tree need watches of their own
+                    if not self._watch_tree(root, os.path.join(directory, name)):
+                        self._release(watched)
+                        watched.fallback = True
+
+    def _expire(self, now: float):
+        """Release repositories which haven't been checked for a while.
+        :param now: the current monotonic time
+        """
+        for root, watched in list(self._repos.items()):
+            if now - watched.used > self.idle:
+                self._release(watched)
+                del self._repos[root]
+
+    def dirty(self, repository: Repository) -> bool:
+        """Check whether a repository may have changed since it was last checked.
+        The first check of a repository starts watching it and is always dirty.
+        :param repository: the repository about to be rendered
+        :return: whether cached git results for it should be refreshed
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._drain()
+            self._expire(now)
+            root = repository.worktree
+            if not (watched := self._repos.get(root)):
+                watched = self._start(repository)
+            watched.used = now
+            if watched.fallback:
+                key = signature(repository.state_files())
+                result = key != watched.key or now - watched.checked >= self.ttl
+                if result:
+                    watched.key, watched.checked = key, now
+                return result
+            result = watched.dirty
+            if result:
+                watched.dirty = False
+                # A branch switch or new upstream moves the state files
+                watched.repository = repository
+                if not self._watch_state(watched):
+                    self._release(watched)
+                    watched.fallback = True
+            return result
+
+    def close(self):
+        """Release every watch."""
+        with self._lock:
+            if self._inotify:
+                self._inotify.close()
+                self._inotify = None
+            self._repos.clear()
+            self._watches.clear()
@@ -0,0 +1,105 @@
+import os
+from unittest.mock import patch
+
+import pytest
+
+from statusline import backends
+from statusline.bench import Scenario, build
+from statusline.git import Git, Status
+from statusline.index import INDEXES, IndexGit
+
+
+class Disagreeing(Git):
+    """A backend which miscounts the working copy."""
+
+    def status(self) -> Status:
+        return Status(untracked=100)
+
+
+@pytest.fixture(autouse=True)
+def cache_home(monkeypatch, tmp_path):
+    monkeypatch.delenv('STATUSLINE_BACKEND', raising=False)
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+
+
+@pytest.fixture(scope='module')
+def scenario_dir(tmp_path_factory):
+    scenario = Scenario(tracked=3, modified=1, untracked=1, ahead=1, stashes=1)
+    return build(scenario, str(tmp_path_factory.mktemp('backends')))
+
+
+def test_available():
+    actual = backends.available()
+    assert actual['git'] is Git
+    assert set(actual) <= set(backends.BACKENDS)
+
+
+@pytest.mark.parametrize('environ, persisted, expected', (
+    (None, None, Git),
+    ('git', 'missing', Git),
+    ('missing', None, Git),
+    (None, 'disagreeing', Disagreeing),
+    ('disagreeing', 'git', Disagreeing),
+))
+def test_selected_backend(environ, persisted, expected, monkeypatch):
+    if environ:
+        monkeypatch.setenv('STATUSLINE_BACKEND', environ)
+    if persisted:
+        backends._choices().put('/repo', persisted)
+    with patch.dict(backends.BACKENDS, {'disagreeing': ('test.test_backends', 'Disagreeing')}):
+        assert backends.selected_backend('/repo') is expected
+        # Other repositories keep git unless told otherwise
+        assert backends.selected_backend('/other') is (expected if environ else Git)
+
+
+@patch('statusline.backends.importlib.import_module', side_effect=ImportError)
+def test_selected_backend_unavailable(mock_import, monkeypatch):
+    # A backend whose dependency was uninstalled falls back to git
+    monkeypatch.setenv('STATUSLINE_BACKEND', 'pygit2')
+    assert backends.selected_backend() is Git
+
+
+def test_select(scenario_dir):
+    with patch('statusline.backends.available', return_value={
+        'git': Git, 'disagreeing': Disagreeing,
+    }):
+        actual = backends.select(scenario_dir, runs=2)
+    assert actual['backend'] == 'git'
+    assert set(actual['median_ms']) == {'git'}
+    assert actual['mismatched'] == ['disagreeing']
+    assert backends.selected_backend(scenario_dir) is Git
+
+
+def test_select_outside(tmp_path):
+    with pytest.raises(ValueError):
+        backends.select(str(tmp_path))
+
+
+def test_select_none(scenario_dir):
+    # Nothing eligible keeps the previous choice
+    previous = backends.select(scenario_dir, runs=1)['backend']
+    with patch('statusline.backends.available', return_value={'disagreeing': Disagreeing}), \
+            patch('statusline.backends._sample', side_effect=[(1.0, ()), (1.0, (1,))]):
+        actual = backends.select(scenario_dir, runs=1)
+    assert actual == {'backend': None, 'median_ms': {}, 'mismatched': ['disagreeing']}
+    assert backends.selected_backend(scenario_dir) is backends.load(previous)
+
+
+def test_sample_cold(scenario_dir):
+    misses = INDEXES.misses
+    first = backends._sample(IndexGit, scenario_dir)[1]
+    assert backends._sample(IndexGit, scenario_dir)[1] == first
+    # Every sample parses the index again
+    assert INDEXES.misses == misses + 2
+
+
+def test_select_per_repository(scenario_dir, tmp_path):
+    # A choice made in one repository isn't used for another
+    other = build(Scenario(tracked=1), str(tmp_path / 'other'))
+    with patch('statusline.backends.available', return_value={'index': IndexGit}):
+        assert backends.select(scenario_dir, runs=1)['backend'] == 'index'
+    assert backends.selected_backend(scenario_dir) is IndexGit
+    assert backends.selected_backend(other) is Git
+    assert isinstance(backends.discover(os.path.join(scenario_dir, 'src')), IndexGit)
+    assert not isinstance(backends.discover(other), IndexGit)
+    assert backends.discover(str(tmp_path)) is None
@@ -0,0 +1,66 @@
+import io
+import json
+from subprocess import CalledProcessError
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from statusline import batch
+from statusline.git import Repository
+
+
+def discover(path):
+    """Stand in for Repository.discover treating /a and /b as repositories."""
+    root = path[:2]
+    return MagicMock(spec=Repository, worktree=root) if root in ('/a', '/b') else None
+
+
+@pytest.fixture(autouse=True)
+def repositories():
+    with patch('statusline.batch.Repository.discover', side_effect=discover):
+        yield
+
+
+@patch('statusline.status._hilight', side_effect=lambda x: x)
+@patch('statusline.batch.DirectoryMinify.get_statusline', side_effect=lambda path: f'git:{path}')
+@patch('statusline.batch.selected_backend')
+def test_render(mock_backend, mock_statusline, mock_hilight):
+    mock_git = mock_backend.return_value
+    actual = list(batch.render(['/a/x', '/etc/apt/sources.list.d', '/b', '/a/y'], workers=2))
+    # Paths outside a repository don't wait for git so come first
+    assert actual[0] == {'path': '/etc/apt/sources.list.d', 'statusline': '/e/a/sources.list.d'}
+    assert sorted(actual[1:], key=lambda result: result['path']) == [
+        {'path': '/a/x', 'statusline': 'git:/a/x'},
+        {'path': '/a/y', 'statusline': 'git:/a/y'},
+        {'path': '/b', 'statusline': 'git:/b'},
+    ]
+    # One Git (and so one snapshot) per repository
+    assert sorted(c.args for c in mock_git.call_args_list) == [('/a',), ('/b',)]
+
+
+@patch('statusline.batch.DirectoryMinify.get_statusline', side_effect=[
+    'git:/a/x', CalledProcessError(128, ['git']),
+])
+@patch('statusline.batch.selected_backend')
+def test_render_error(mock_backend, mock_statusline):
+    actual = list(batch.render(['/a/x', '/a/y']))
+    assert actual[0] == {'path': '/a/x', 'statusline': 'git:/a/x'}
+    assert actual[1]['path'] == '/a/y'
+    assert 'error' in actual[1]
+
+
+@pytest.mark.parametrize('paths, stdin', (
+    (['/a', '/b'], ''),
+    ([], '/a\n\n/b\n'),
+))
+@patch('statusline.batch.render', side_effect=lambda paths, workers: (
+    {'path': path, 'statusline': path.upper()} for path in paths
+))
+def test_main(mock_render, paths, stdin, capsys):
+    with patch('statusline.batch.sys.stdin', io.StringIO(stdin)):
+        batch.main(paths)
+    lines = capsys.readouterr().out.splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {'path': '/a', 'statusline': '/A'},
+        {'path': '/b', 'statusline': '/B'},
+    ]
@@ -0,0 +1,46 @@
+from unittest.mock import patch
+
+import pytest
+
+from statusline import bench
+from statusline.bench import Scenario
+
+
+@pytest.mark.parametrize('values, fraction, expected', (
+    ([3], 0.5, 3.0),
+    ([4, 1, 3, 2], 0.5, 2.0),
+    (list(range(1, 21)), 0.95, 19.0),
+))
+def test_percentile(values, fraction, expected):
+    assert bench.percentile(values, fraction) == expected
+
+
+@pytest.fixture(scope='module')
+def scenario_dir(tmp_path_factory):
+    scenario = Scenario(
+        tracked=3, modified=2, untracked=1, ahead=1, behind=2, stashes=1, worktrees=1, depth=2,
+    )
+    return bench.build(scenario, str(tmp_path_factory.mktemp('bench')))
+
+
+def test_build(scenario_dir, monkeypatch, tmp_path):
+    # Rendering the synthetic repository is an end to end check of the git backend
+    monkeypatch.chdir(scenario_dir)
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    with patch('statusline.status._hilight', side_effect=lambda x: x):
+        actual = bench.render_once()
+    # git status and the ahead/behind count, which is memoized for later renders
+    assert actual['git_processes'] == 2
+    assert actual['output'].endswith(
+        '\001\033[0m\002master\001\033[30;101m\002↕3\001\033[0m\002'
+        '(\001\033[31m\0022\001\033[90m\0021\001\033[0m\002){1}/n/n1'
+    )
+
+
+def test_measure(scenario_dir, monkeypatch, tmp_path):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    actual = bench.measure(scenario_dir, runs=2)
+    assert actual['runs'] == 2
+    assert actual['git_processes'] == 2
+    assert actual['peak_rss_kb'] > 0
+    assert 0 < actual['render_p50_ms'] <= actual['render_p95_ms']
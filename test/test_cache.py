@@ -0,0 +1,196 @@
+import os
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from statusline.cache import Memo, ResultCache, SubmoduleCache, cache_dir, signature, refresh
+
+
+@pytest.fixture()
+def cache(tmp_path):
+    return ResultCache(str(tmp_path / 'cache'), size=2, ttl=60)
+
+
+@pytest.fixture()
+def files(tmp_path):
+    index = tmp_path / 'index'
+    index.write_text('DIRC')
+    return [str(index), str(tmp_path / 'missing')]
+
+
+@pytest.mark.parametrize('environ, expected', (
+    ({'XDG_CACHE_HOME': '/path/cache'}, '/path/cache/statusline'),
+    ({'HOME': '/home/kevna'}, '/home/kevna/.cache/statusline'),
+))
+def test_cache_dir(environ, expected):
+    with patch.dict('statusline.cache.os.environ', environ, clear=True):
+        assert cache_dir() == expected
+
+
+def test_signature(files):
+    stat = os.stat(files[0])
+    assert signature(files) == [[stat.st_mtime_ns, 4], None]
+
+
+@pytest.mark.parametrize('environ, expected', (
+    ({}, None),
+    ({'STATUSLINE_CACHE': 'off'}, None),
+    ({'STATUSLINE_CACHE': 'on'}, (256, 5.0, False)),
+    (
+        {'STATUSLINE_CACHE': 'stale', 'STATUSLINE_CACHE_SIZE': '8', 'STATUSLINE_CACHE_TTL': '1.5'},
+        (8, 1.5, True),
+    ),
+))
+def test_from_environ(environ, expected):
+    with patch.dict('statusline.cache.os.environ', environ, clear=True):
+        actual = ResultCache.from_environ()
+        if expected is None:
+            assert actual is None
+        else:
+            assert (actual.size, actual.ttl, actual.stale) == expected
+
+
+def test_evict_memos(tmp_path, files):
+    # Entries are kept apart from the memos sharing the cache dir
+    with patch.dict('statusline.cache.os.environ', {
+        'STATUSLINE_CACHE': 'on', 'STATUSLINE_CACHE_SIZE': '1', 'XDG_CACHE_HOME': str(tmp_path),
+    }):
+        Memo(os.path.join(cache_dir(), 'costs.json')).put('/repo', 1)
+        results = ResultCache.from_environ()
+        for root in ('/a', '/b'):
+            results.store(root, signature(files), 'master')
+        assert os.path.exists(os.path.join(cache_dir(), 'costs.json'))
+    assert len(os.listdir(results.directory)) == 1
+
+
+def test_lookup(cache, files):
+    key = signature(files)
+    assert cache.lookup('/repo', key) is None
+    cache.store('/repo', key, 'master↑1')
+    assert cache.lookup('/repo', key) == 'master↑1'
+    assert cache.lookup('/other', key) is None
+
+
+def test_lookup_invalidated(cache, files):
+    cache.store('/repo', signature(files), 'master')
+    with open(files[1], 'w', encoding='utf-8') as file:
+        file.write('ref: refs/heads/feature')
+    assert cache.lookup('/repo', signature(files)) is None
+
+
+def test_lookup_expired(cache, files):
+    cache.ttl = 0
+    cache.store('/repo', signature(files), 'master')
+    assert cache.lookup('/repo', signature(files)) is None
+
+
+@patch('statusline.cache.ResultCache.revalidate')
+def test_lookup_stale(mock, cache, files):
+    cache.stale = True
+    cache.ttl = 0
+    cache.store('/repo', signature(files), 'master')
+    assert cache.lookup('/repo', signature(files)) == 'master'
+    mock.assert_called_once_with('/repo', None)
+
+
+def test_evict(cache):
+    for mtime, root in enumerate(('/repo/a', '/repo/b', '/repo/c')):
+        cache.store(root, [], root)
+        os.utime(cache._entry(root), (mtime, mtime))
+    assert len(os.listdir(cache.directory)) == 2
+    assert cache.load('/repo/a') is None
+    assert cache.load('/repo/c')['value'] == '/repo/c'
+
+
+@patch('subprocess.Popen')
+def test_revalidate(mock, cache):
+    os.makedirs(cache.directory)
+    cache.revalidate('/repo')
+    cache.revalidate('/repo')
+    lock = f'{cache._entry("/repo")}.lock'
+    assert os.path.exists(lock)
+    assert mock.call_count == 1
+    assert mock.call_args.args[0][-2:] == ['/repo', lock]
+    os.unlink(lock)
+    # The width the entry was rendered for is passed on
+    cache.revalidate('/repo', 40)
+    assert mock.call_args.args[0][-3:] == ['/repo', lock, '40']
+
+
+def test_memo(tmp_path):
+    memo = Memo(str(tmp_path / 'cache' / 'memo.json'), size=2)
+    assert memo.get('a') is None
+    for key in ('a', 'b', 'c'):
+        memo.put(key, [1, 2])
+    # A fresh instance reads back what was written keeping only the newest
+    memo = Memo(memo.path, size=2)
+    assert memo.get('a') is None
+    assert memo.get('c') == [1, 2]
+    assert list(memo.entries) == ['b', 'c']
+
+
+def test_memo_threads(tmp_path):
+    # Daemon threads write the same file from their own instances
+    path = str(tmp_path / 'cache' / 'memo.json')
+    errors = []
+
+    def put(key):
+        for value in range(50):
+            try:
+                Memo(path).put(key, value)
+            except OSError as error:
+                errors.append(error)
+
+    threads = [threading.Thread(target=put, args=(str(key),)) for key in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert Memo(path).entries
+    assert os.listdir(tmp_path / 'cache') == ['memo.json']
+
+
+@pytest.mark.parametrize('partial, expected', (
+    (False, 'master'),
+    (True, None),
+))
+@patch('statusline.git.Git')
+def test_refresh(mock_git, partial, expected, cache, files):
+    git = mock_git.return_value
+    git.cache_key.return_value = signature(files)
+    git.render_stats.return_value = 'master'
+    git.partial = partial
+    os.makedirs(cache.directory)
+    lock = f'{cache._entry("/repo")}.lock'
+    with open(lock, 'w', encoding='utf-8'):
+        pass
+    with patch('statusline.cache.ResultCache.from_environ', return_value=cache):
+        refresh('/repo', lock)
+    assert cache.lookup('/repo', signature(files)) == expected
+    assert not os.path.exists(lock)
+
+
+@pytest.mark.parametrize('environ, expected', (
+    ({}, None),
+    ({'STATUSLINE_SUBMODULES': 'cached'}, 60.0),
+    ({'STATUSLINE_SUBMODULES': 'cached', 'STATUSLINE_SUBMODULE_TTL': '5'}, 5.0),
+))
+def test_submodule_from_environ(environ, expected):
+    with patch.dict('os.environ', environ, clear=True):
+        actual = SubmoduleCache.from_environ()
+    assert (actual and actual.ttl) == expected
+
+
+def test_submodule_cache(tmp_path):
+    submodules = SubmoduleCache(Memo(str(tmp_path / 'submodules.json')), ttl=60)
+    assert submodules.get('/sub/.git', [[1, 2]]) is None
+    submodules.put('/sub/.git', [[1, 2]], True)
+    assert submodules.get('/sub/.git', [[1, 2]]) is True
+    assert submodules.get('/sub/.git', [[1, 3]]) is None
+    with patch('statusline.cache.time.time', return_value=time.time() + 61):
+        # Working copy edits don't change the key so answers expire
+        assert submodules.get('/sub/.git', [[1, 2]]) is None
+        assert submodules.get('/sub/.git', [[1, 2]], expires=False) is True
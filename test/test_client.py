@@ -0,0 +1,66 @@
+import os
+import socket
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from statusline import client
+
+
+@pytest.mark.parametrize('environ, expected', (
+    ({'STATUSLINE_SOCKET': '/path/custom.sock'}, '/path/custom.sock'),
+    ({'XDG_RUNTIME_DIR': '/run/user/1000'}, '/run/user/1000/statusline-1000.sock'),
+    ({'TMPDIR': '/var/tmp'}, '/var/tmp/statusline-1000/daemon.sock'),
+    ({}, '/tmp/statusline-1000/daemon.sock'),
+))
+@patch('statusline.client.os.getuid', return_value=1000)
+def test_socket_path(mock, environ, expected):
+    with patch.dict('statusline.client.os.environ', environ, clear=True):
+        assert client.socket_path() == expected
+
+
+def test_request_unavailable(tmp_path):
+    environ = {'STATUSLINE_SOCKET': str(tmp_path / 'missing')}
+    with patch.dict('statusline.client.os.environ', environ):
+        assert client.request('/path') is None
+
+
+def test_request_untrusted(tmp_path):
+    # Neither a plain file nor another user's socket is connected to
+    address = tmp_path / 'statusline.sock'
+    address.write_text('')
+    with patch.dict('statusline.client.os.environ', {'STATUSLINE_SOCKET': str(address)}):
+        assert client.request('/path') is None
+    address.unlink()
+    with socket.socket(socket.AF_UNIX) as server:
+        server.bind(str(address))
+        server.listen()
+        with patch.dict('statusline.client.os.environ', {'STATUSLINE_SOCKET': str(address)}), \
+                patch('statusline.client.os.getuid', return_value=os.getuid() + 1):
+            assert client.request('/path') is None
+
+
+@pytest.mark.parametrize('response, expected', (
+    (b'~/D/statusline\n', '~/D/statusline'),
+    (b'\n', None),
+))
+def test_request(response, expected, tmp_path):
+    address = str(tmp_path / 'statusline.sock')
+    received = []
+    with socket.socket(socket.AF_UNIX) as server:
+        server.bind(address)
+        server.listen()
+
+        def answer():
+            conn, _ = server.accept()
+            with conn:
+                received.append(conn.makefile('rb').readline())
+                conn.sendall(response)
+
+        thread = threading.Thread(target=answer)
+        thread.start()
+        with patch.dict('statusline.client.os.environ', {'STATUSLINE_SOCKET': address}):
+            assert client.request('/path') == expected
+        thread.join()
+    assert received == [b'/path\n']
@@ -0,0 +1,33 @@
+import os
+from unittest.mock import MagicMock
+
+from statusline.common import CommonCache
+
+
+def test_load(tmp_path):
+    cache = CommonCache()
+    parse = MagicMock(side_effect=lambda content: content.split())
+    assert cache.load(str(tmp_path), 'packed-refs', parse) is None
+    (tmp_path / 'packed-refs').write_text('a b\n')
+    assert cache.load(str(tmp_path), 'packed-refs', parse) == ['a', 'b']
+    assert cache.load(str(tmp_path), 'packed-refs', parse) == ['a', 'b']
+    assert parse.call_count == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    # Git renames a new file into place
+    (tmp_path / 'packed-refs.lock').write_text('a b c\n')
+    os.replace(tmp_path / 'packed-refs.lock', tmp_path / 'packed-refs')
+    assert cache.load(str(tmp_path), 'packed-refs', parse) == ['a', 'b', 'c']
+    assert parse.call_count == 2
+    (tmp_path / 'packed-refs').unlink()
+    assert cache.load(str(tmp_path), 'packed-refs', parse) is None
+
+
+def test_load_evicts(tmp_path):
+    cache = CommonCache(size=2)
+    for name in ('a', 'b', 'c'):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / 'config').write_text(name)
+        assert cache.load(str(tmp_path / name), 'config', str.upper) == name.upper()
+    assert len(cache) == 2
+    assert cache.load(str(tmp_path / 'a'), 'config', str.upper) == 'A'
+    assert cache.misses == 4
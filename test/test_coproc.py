@@ -0,0 +1,92 @@
+import io
+import os
+from subprocess import CalledProcessError
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from statusline.coproc import Coprocess, serve
+from statusline.git import Repository
+from statusline.watch import Watcher
+
+
+@pytest.fixture()
+def coprocess():
+    result = Coprocess()
+    result.watcher = MagicMock(spec=Watcher)
+    result.watcher.dirty.return_value = True
+    return result
+
+
+@patch('statusline.coproc.Repository.discover', return_value=None)
+@patch('statusline.status._hilight', side_effect=lambda x: x)
+def test_render_nogit(mock_hilight, mock_discover, coprocess):
+    assert coprocess.handle('/etc/X11/xorg.conf.d') == '/e/X/xorg.conf.d'
+    assert coprocess.git is None
+
+
+@patch('statusline.coproc.DirectoryMinify.get_statusline', return_value='~/D/statusline')
+@patch('statusline.coproc.selected_backend')
+def test_render_git(mock_backend, mock_statusline, coprocess):
+    mock_git = mock_backend.return_value
+    # Git state is kept until the shell moves to another repository
+    with patch('statusline.coproc.Repository.discover', side_effect=[
+        MagicMock(spec=Repository, worktree=worktree) for worktree in ('/a', '/a', '/b')
+    ]):
+        for path in ('/a', '/a/src', '/b'):
+            assert coprocess.handle(path) == '~/D/statusline'
+    assert [c.args for c in mock_git.call_args_list] == [('/a',), ('/b',)]
+    assert mock_git.return_value.refresh.call_count == 1
+    assert [c.args for c in mock_statusline.call_args_list] == [('/a',), ('/a/src',), ('/b',)]
+
+
+@pytest.mark.parametrize('dirty, partial, refreshed', (
+    (False, False, False),
+    (False, True, True),
+    (True, False, True),
+))
+@patch('statusline.coproc.DirectoryMinify.get_statusline', return_value='~/D/statusline')
+@patch('statusline.coproc.selected_backend')
+def test_render_watched(mock_backend, mock_statusline, dirty, partial, refreshed, coprocess):
+    mock_git = mock_backend.return_value
+    # The snapshot is reused until the watcher sees a relevant change
+    repository = MagicMock(spec=Repository, worktree='/a')
+    with patch('statusline.coproc.Repository.discover', return_value=repository):
+        coprocess.handle('/a')
+        coprocess.watcher.dirty.return_value = dirty
+        mock_git.return_value.partial = partial
+        coprocess.handle('/a')
+    coprocess.watcher.dirty.assert_called_with(repository)
+    assert mock_git.return_value.refresh.called == refreshed
+    # The time budget restarts for every request
+    assert mock_git.return_value.restart_budget.called != refreshed
+
+
+@pytest.mark.parametrize('line', ('relative/path', '', '\t0\t80'))
+def test_handle_invalid(line, coprocess):
+    assert coprocess.handle(line) == ''
+
+
+@patch('statusline.coproc.Coprocess.render', side_effect=CalledProcessError(128, ''))
+def test_handle_failure(mock_render, coprocess):
+    assert coprocess.handle('/repo') == ''
+
+
+@pytest.mark.parametrize('line, expected', (
+    ('/repo\t1\t120', '120'),
+    ('/repo\t0', '80'),
+    ('/repo\t0\t', '80'),
+))
+@patch('statusline.coproc.Coprocess.render', return_value='/repo')
+def test_handle_columns(mock_render, line, expected, coprocess):
+    with patch.dict('statusline.coproc.os.environ', {'COLUMNS': '80'}):
+        assert coprocess.handle(line) == '/repo'
+        assert mock_render.call_args.args == ('/repo',)
+        assert os.environ['COLUMNS'] == expected
+
+
+@patch('statusline.coproc.Coprocess.render', side_effect=lambda path: path.upper())
+def test_serve(mock_render):
+    stdout = io.StringIO()
+    serve(io.StringIO('/a\t0\t80\nrelative\n/b\n'), stdout)
+    assert stdout.getvalue() == '/A\n\n/B\n'
@@ -0,0 +1,73 @@
+import json
+from unittest.mock import patch
+
+import pytest
+
+from statusline.costs import CostModel, LEVELS
+
+
+@pytest.fixture()
+def model(tmp_path):
+    path = str(tmp_path / 'statusline' / 'costs.json')
+    return CostModel(path, threshold=100, strikes=2, probe=60)
+
+
+def saved(instance):
+    with open(instance.path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+@pytest.mark.parametrize('environ, expected', (
+    ({'STATUSLINE_ADAPTIVE': 'off'}, None),
+    ({'XDG_CACHE_HOME': '/cache'}, ('/cache/statusline/costs.json', 300, 3600)),
+    (
+        {'XDG_CACHE_HOME': '/cache', 'STATUSLINE_SLOW_MS': '50', 'STATUSLINE_PROBE_S': '10'},
+        ('/cache/statusline/costs.json', 50, 10),
+    ),
+))
+def test_from_environ(environ, expected):
+    with patch.dict('statusline.costs.os.environ', environ, clear=True):
+        actual = CostModel.from_environ()
+        if expected is None:
+            assert actual is None
+        else:
+            assert (actual.path, actual.threshold, actual.probe) == expected
+
+
+def test_fast_is_not_saved(model):
+    model.record('/repo', 0, 10)
+    assert model.level('/repo') == 0
+    assert model.repos == {}
+
+
+def test_degrade(model):
+    for level in range(len(LEVELS) + 1):
+        model.record('/repo', model.level('/repo'), 500)
+        model.record('/repo', model.level('/repo'), 500)
+        assert model.level('/repo') == min(level + 1, len(LEVELS) - 1)
+    assert saved(model)['/repo']['level'] == len(LEVELS) - 1
+
+
+def test_fast_run_resets_strikes(model):
+    model.record('/repo', 0, 500)
+    model.record('/repo', 0, 10)
+    model.record('/repo', 0, 500)
+    assert model.level('/repo') == 0
+
+
+@pytest.mark.parametrize('elapsed, expected', (
+    (10, 1),
+    (500, 2),
+))
+def test_probe(elapsed, expected, model):
+    model.repos['/repo'] = {'level': 2, 'strikes': 0, 'probe': 0.0}
+    assert model.level('/repo') == 1
+    model.record('/repo', 1, elapsed)
+    assert model.level('/repo') == expected
+    assert CostModel(model.path).level('/repo') == expected
+
+
+def test_load_corrupt(model, tmp_path):
+    (tmp_path / 'statusline').mkdir()
+    (tmp_path / 'statusline' / 'costs.json').write_text('{"/repo": ')
+    assert model.level('/repo') == 0
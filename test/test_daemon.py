@@ -0,0 +1,104 @@
+import json
+import os
+import socket
+import stat
+import threading
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from statusline import client
+from statusline.daemon import RepoCache, StatuslineServer, serve
+from statusline.git import Git, Repository
+
+
+def test_repo_cache():
+    cache = RepoCache(size=2)
+    first, _ = cache.get('/repo/a')
+    assert isinstance(first, Git)
+    assert first.cwd == '/repo/a'
+    cache.get('/repo/b')
+    assert cache.get('/repo/a')[0] is first
+    cache.get('/repo/c')
+    assert len(cache) == 2
+    assert cache.get('/repo/a')[0] is first
+    assert (cache.hits, cache.misses, cache.evictions) == (2, 3, 1)
+    cache.get('/repo/b')
+    assert (cache.hits, cache.misses, cache.evictions) == (2, 4, 2)
+
+
+@pytest.fixture()
+def server(tmp_path):
+    address = str(tmp_path / 'statusline.sock')
+    with StatuslineServer(address) as result:
+        thread = threading.Thread(target=result.serve_forever)
+        thread.start()
+        with patch.dict('statusline.client.os.environ', {'STATUSLINE_SOCKET': address}):
+            yield result
+        result.shutdown()
+        thread.join()
+
+
+@patch('statusline.daemon.Repository.discover', return_value=None)
+@patch('statusline.status._hilight', side_effect=lambda x: x)
+def test_render_nogit(mock_hilight, mock_discover, server):
+    assert client.request('/etc/X11/xorg.conf.d') == '/e/X/xorg.conf.d'
+    assert server.stats()['requests'] == 1
+
+
+@patch('statusline.daemon.DirectoryMinify.get_statusline', return_value='~/D/statusline')
+def test_render_git(mock_statusline, server):
+    repository = MagicMock(spec=Repository, worktree='/repo')
+    with patch('statusline.daemon.Repository.discover', return_value=repository):
+        assert client.request('/repo/src') == '~/D/statusline'
+        assert client.request('/repo') == '~/D/statusline'
+    assert [c.args for c in mock_statusline.call_args_list] == [('/repo/src',), ('/repo',)]
+    stats = json.loads(client.request('stats'))
+    assert stats['requests'] == 2
+    assert stats['repos'] == 1
+    assert stats['hit_rate'] == 0.5
+    assert {'path_hits', 'path_misses', 'index_hits', 'index_misses'} <= set(stats)
+
+
+@pytest.mark.parametrize('line', ('relative/path', ''))
+def test_render_invalid(line, server):
+    assert client.request(line) is None
+    assert server.stats()['requests'] == 0
+
+
+def test_serve(tmp_path):
+    # Without a runtime dir the socket is bound owner only in a private directory
+    address = str(tmp_path / 'statusline-1000' / 'daemon.sock')
+    modes = []
+
+    def interrupt():
+        modes.append(stat.S_IMODE(os.stat(address).st_mode))
+        modes.append(stat.S_IMODE(os.stat(os.path.dirname(address)).st_mode))
+        raise KeyboardInterrupt
+
+    with patch('statusline.daemon.StatuslineServer.serve_forever', side_effect=interrupt):
+        serve(address)
+    assert modes == [0o600, 0o700]
+    assert not os.path.exists(address)
+
+
+def test_serve_running(server):
+    # A live daemon keeps its socket, a second one refuses to start
+    address = server.server_address
+    with patch('statusline.daemon.StatuslineServer.serve_forever') as mock:
+        with pytest.raises(SystemExit):
+            serve(address)
+    assert not mock.called
+    assert json.loads(client.request('stats'))['requests'] == 0
+
+
+def test_serve_stale(tmp_path):
+    # The socket of a daemon that died is replaced
+    address = str(tmp_path / 'statusline.sock')
+    with socket.socket(socket.AF_UNIX) as stale:
+        stale.bind(address)
+    with patch('statusline.daemon.StatuslineServer.serve_forever', side_effect=KeyboardInterrupt) \
+            as mock:
+        serve(address)
+    assert mock.called
+    assert not os.path.exists(address)
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from statusline.discovery import Discovery
+
+
+@pytest.fixture()
+def discovery(monkeypatch):
+    for name in ('GIT_DIR', 'GIT_WORK_TREE', 'GIT_CEILING_DIRECTORIES'):
+        monkeypatch.delenv(name, raising=False)
+    return Discovery(size=8)
+
+
+@pytest.fixture()
+def tree(tmp_path):
+    (tmp_path / 'repo' / '.git').mkdir(parents=True)
+    (tmp_path / 'repo' / 'src' / 'deep').mkdir(parents=True)
+    (tmp_path / 'plain').mkdir()
+    return tmp_path
+
+
+def test_find(discovery, tree):
+    repo = str(tree / 'repo')
+    assert discovery.find(str(tree / 'repo' / 'src' / 'deep')) == (repo, f'{repo}/.git')
+    assert discovery.find(repo) == (repo, f'{repo}/.git')
+
+
+def test_find_cached(discovery, tree):
+    discovery.find(str(tree / 'repo' / 'src' / 'deep'))
+    assert (discovery.hits, discovery.misses) == (0, 3)
+    # A sibling only needs to probe itself, the rest of the walk is reused
+    discovery.find(str(tree / 'repo' / 'src'))
+    assert (discovery.hits, discovery.misses) == (2, 3)
+
+
+def test_find_invalidated(discovery, tree):
+    nested = tree / 'repo' / 'src'
+    assert discovery.find(str(nested))[0] == str(tree / 'repo')
+    # Creating a repository changes the directory mtime so it is probed again
+    (nested / '.git').mkdir()
+    assert discovery.find(str(nested))[0] == str(nested)
+
+
+def test_find_none(discovery, tree):
+    assert discovery.find(str(tree / 'plain')) is None
+
+
+@pytest.mark.parametrize('content, expected', (
+    ('gitdir: ../repo/.git/worktrees/feature\n', 'repo/.git/worktrees/feature'),
+    ('not a pointer\n', None),
+))
+def test_find_pointer(content, expected, discovery, tree):
+    (tree / 'plain' / '.git').write_text(content)
+    actual = discovery.find(str(tree / 'plain'))
+    assert actual == (expected and (str(tree / 'plain'), str(tree / expected)))
+
+
+def test_find_git_dir(discovery, tree, monkeypatch):
+    monkeypatch.setenv('GIT_DIR', str(tree / 'repo' / '.git'))
+    assert discovery.find(str(tree / 'plain')) == (str(tree / 'plain'), str(tree / 'repo/.git'))
+    monkeypatch.setenv('GIT_WORK_TREE', str(tree / 'repo'))
+    assert discovery.find(str(tree / 'plain')) == (str(tree / 'repo'), str(tree / 'repo/.git'))
+
+
+def test_find_ceiling(discovery, tree, monkeypatch):
+    ceilings = os.pathsep.join(['/unrelated', str(tree / 'repo')])
+    monkeypatch.setenv('GIT_CEILING_DIRECTORIES', ceilings)
+    assert discovery.find(str(tree / 'repo' / 'src')) is None
+    # The starting directory is always checked even if it is a ceiling
+    assert discovery.find(str(tree / 'repo'))[0] == str(tree / 'repo')
+
+
+def test_size(discovery, tree):
+    for index in range(10):
+        (tree / 'plain' / str(index)).mkdir()
+        discovery.find(str(tree / 'plain' / str(index)))
+    assert len(discovery) == 8
@@ -0,0 +1,19 @@
+from ansi.colour import fg, bg, fx  # type: ignore
+
+import pytest
+
+from statusline import ansi_patch, escapes
+
+
+@pytest.mark.parametrize('actual, expected', (
+    (escapes.RESET, fx.reset),
+    (escapes.GREEN, fg.green),
+    (escapes.RED, fg.red),
+    (escapes.BRIGHTBLACK, fg.brightblack),
+    (escapes.BRIGHTRED, fg.brightred),
+    (escapes.BRIGHTBLUE, fg.brightblue),
+    (escapes.BLACK_ON_BRIGHTRED, fg.black + bg.brightred),
+    (escapes.GIT_ORANGE, ansi_patch.colour256(202)),
+))
+def test_matches_ansi(actual, expected):
+    assert actual == str(expected)
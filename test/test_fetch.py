@@ -0,0 +1,99 @@
+import os
+import time
+from subprocess import run
+from unittest.mock import patch
+
+import pytest
+
+from statusline import escapes
+from statusline.fetch import FetchScheduler, fetch
+from statusline.git import AheadBehind, Git
+
+
+@pytest.fixture()
+def scheduler(tmp_path):
+    return FetchScheduler(str(tmp_path / 'fetch'), age=3600, interval=300)
+
+
+def git(cwd, *args):
+    run(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', *args],
+        cwd=cwd, check=True, capture_output=True)
+
+
+@pytest.mark.parametrize('age, expected', (
+    (0, ''),
+    (3599, ''),
+    (3600, escapes.YELLOW),
+    (4 * 3600 - 1, escapes.YELLOW),
+    (4 * 3600, escapes.RED),
+    (float('inf'), escapes.RED),
+))
+def test_colour(scheduler, age, expected):
+    assert scheduler.colour(age) == expected
+
+
+@patch('subprocess.Popen')
+def test_schedule_fresh(mock, scheduler):
+    assert not scheduler.schedule('/path/repo', 60)
+    assert not mock.called
+
+
+@patch('subprocess.Popen')
+def test_schedule_stale(mock, scheduler):
+    assert scheduler.schedule('/path/repo', 7200)
+    assert mock.call_args.args[0][-2:] == ['statusline.fetch', '/path/repo']
+    assert mock.call_args.kwargs['start_new_session']
+    assert os.path.exists(scheduler._stamp('/path/repo'))
+    # Rate limited whether or not that fetch succeeded
+    assert not scheduler.schedule('/path/repo', 7200)
+    assert mock.call_count == 1
+    # Other repositories have their own stamps
+    assert scheduler.schedule('/path/other', float('inf'))
+    assert mock.call_count == 2
+
+
+@patch('subprocess.Popen')
+def test_schedule_interval(mock, scheduler):
+    assert scheduler.schedule('/path/repo', 7200)
+    stamp = scheduler._stamp('/path/repo')
+    os.utime(stamp, (time.time() - 301, time.time() - 301))
+    assert scheduler.schedule('/path/repo', 7200)
+    assert mock.call_count == 2
+
+
+@pytest.mark.parametrize('environ, expected', (
+    ({}, None),
+    ({'STATUSLINE_FETCH_AGE': '0'}, None),
+    ({'STATUSLINE_FETCH_AGE': '600'}, (600, 300)),
+    ({'STATUSLINE_FETCH_AGE': '600', 'STATUSLINE_FETCH_INTERVAL': '60'}, (600, 60)),
+))
+def test_from_environ(environ, expected):
+    with patch.dict('os.environ', environ, clear=True):
+        actual = FetchScheduler.from_environ()
+    assert (actual and (actual.age, actual.interval)) == expected
+
+
+@patch('statusline.fetch.os.nice')
+def test_fetch(mock_nice, tmp_path):
+    remote, local, other = (str(tmp_path / name) for name in ('remote', 'local', 'other'))
+    git(tmp_path, 'init', '--bare', '--initial-branch=master', remote)
+    git(tmp_path, 'clone', remote, other)
+    git(other, 'commit', '--allow-empty', '-m', 'first')
+    git(other, 'push', 'origin', 'master')
+    git(tmp_path, 'clone', remote, local)
+    git(other, 'commit', '--allow-empty', '-m', 'second')
+    git(other, 'push', 'origin', 'master')
+    assert Git(local).fetch_age() == float('inf')
+    fetch(local)
+    assert mock_nice.call_args.args == (19,)
+    result = Git(local)
+    result.memo = None
+    assert result.fetch_age() < 60
+    assert result.ahead_behind() == AheadBehind(0, 1)
+
+
+@patch('statusline.fetch.os.nice')
+@patch('subprocess.run', side_effect=OSError)
+def test_fetch_error(mock_run, mock_nice, tmp_path):
+    # Failures are left for the next stale prompt to retry
+    fetch(str(tmp_path))
@@ -1,15 +1,53 @@
-from unittest.mock import patch, PropertyMock, call
-from subprocess import CalledProcessError
+import os
+import subprocess
+import threading
+from unittest.mock import patch, PropertyMock, MagicMock, call
+import time
+import zlib
+from subprocess import CalledProcessError, Popen, TimeoutExpired
 from types import SimpleNamespace
 
 import pytest
 
-from statusline.git import AheadBehind, Status, Git
+from statusline import trace
+from statusline.bench import GIT_ENV
+from statusline.cache import Memo, ResultCache, SubmoduleCache
+from statusline.common import CommonCache
+from statusline.costs import CostModel
+from statusline.fetch import FetchScheduler
+from statusline.git import AheadBehind, Status, Snapshot, Repository, Git
+from statusline.segments import SEGMENTS
 
 
 @pytest.fixture()
 def git():
-    return Git()
+    result = Git()
+    result.repository = None
+    result.costs = None
+    result.memo = None
+    return result
+
+
+def chunks(*items):
+    """Stand in for Git._stream_command yielding each item or raising it if it is an error."""
+    for item in items:
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def shell(script):
+    """Stand in for Popen running script in place of git."""
+    # pylint: disable-next=consider-using-with
+    return lambda argv, **kwargs: Popen(['sh', '-c', script], **kwargs)
+
+
+@pytest.fixture()
+def repo(tmp_path):
+    git_dir = tmp_path / 'repo' / '.git'
+    (git_dir / 'refs' / 'heads').mkdir(parents=True)
+    (git_dir / 'HEAD').write_text('ref: refs/heads/master\n')
+    return Repository(str(tmp_path / 'repo'), str(git_dir))
 
 
 class TestAheadBehind:
@@ -36,18 +74,261 @@ class TestStatus:
         status = Status(*args)
         assert bool(status) == expected
 
+    def test_bool_approximate(self):
+        assert Status(approximate=True)
+        assert Status(submodules=1)
+
     @pytest.mark.parametrize('args, expected', (
         ((), ''),
+        ((0, 0, 0, True), '\001\033[90m\002~\001\033[0m\002'),
+        ((1, 0, 0, True), '\001\033[32m\0021\001\033[90m\002~\001\033[0m\002'),
         ((1, 0, 0), '\001\033[32m\0021\001\033[0m\002'),
         ((0, 1, 0), '\001\033[31m\0021\001\033[0m\002'),
         ((0, 0, 1), '\001\033[90m\0021\001\033[0m\002'),
         ((5, 7, 2), '\001\033[32m\0025\001\033[31m\0027\001\033[90m\0022\001\033[0m\002'),
+        ((0, 1, 0, False, None, 2), '\001\033[31m\0021\001\033[36m\0022\001\033[0m\002'),
     ))
     def test_str(self, args, expected):
         status = Status(*args)
         assert f'{status}' == expected
 
 
+class TestSnapshot:
+    @pytest.mark.parametrize('porcelain, expected', (
+        (b'', Snapshot(status=Status(cap=9))),
+        (
+            b'# branch.oid (initial)\0# branch.head master\0',
+            Snapshot(branch='master', status=Status(cap=9)),
+        ),
+        (
+            b'# branch.oid 1a2b3c\0# branch.head (detached)\0',
+            Snapshot(branch='HEAD', status=Status(cap=9)),
+        ),
+        (
+            b'# branch.oid 1a2b3c\0'
+            b'# branch.head feature/snapshot\0'
+            b'# branch.upstream origin/feature/snapshot\0'
+            b'# branch.ab +3 -2\0'
+            b'# stash 4\0',
+            Snapshot(
+                'feature/snapshot', 'origin/feature/snapshot', AheadBehind(3, 2), Status(cap=9), 4,
+            ),
+        ),
+        (
+            b'# branch.upstream origin/master\0# branch.ab +? -?\0',
+            Snapshot(upstream='origin/master', status=Status(cap=9)),
+        ),
+        (
+            b'1 M. N... 100644 100644 100644 1a2b3c 4d5e6f stag.ed\0'
+            b'1 .M N... 100644 100644 100644 1a2b3c 1a2b3c unstag\xffed\0'
+            b'1 MM N... 100644 100644 100644 1a2b3c 4d5e6f bo\nth\0'
+            b'2 R. N... 100644 100644 100644 1a2b3c 1a2b3c R100 renam.ed\0? ori.g\0'
+            b'u UU N... 100644 100644 100644 100644 1a2b3c 4d5e6f 7a8b9c conflict.ed\0'
+            b'? untrack.ed\0'
+            b'? spaced untrack.ed\0',
+            Snapshot(status=Status(4, 3, 2, cap=9)),
+        ),
+    ))
+    def test_parse(self, porcelain, expected):
+        assert Snapshot.parse([porcelain], cap=9) == expected
+
+    def test_parse_chunks(self):
+        # Records split across chunks are joined before being counted
+        porcelain = b'# branch.head master\0' + b'1 .M N... 100644 100644 100644 1a 1a file\0' * 5
+        output = [porcelain[index:index + 7] for index in range(0, len(porcelain), 7)]
+        assert Snapshot.parse(output) == Snapshot('master', status=Status(unstaged=5))
+
+    def test_parse_cap(self):
+        # Nothing after the untracked entries exceed the cap can change the output
+        output = iter([b'1 M. N... 100644 100644 100644 1a 1a f\0', b'? a\0? b\0? c\0', b'? d\0'])
+        actual = Snapshot.parse(output, cap=2)
+        assert actual.status == Status(1, 0, 3, cap=2)
+        assert f'{actual.status}' == '\001\033[32m\0021\001\033[90m\0022+\001\033[0m\002'
+        assert next(output) == b'? d\0'
+        # However far past the cap counting went the result is the same
+        assert Status(1, 0, 3, cap=2) == Status(1, 0, 1000, cap=2)
+
+
+class TestRepository:
+    def test_discover(self, repo):
+        nested = os.path.join(repo.worktree, 'src', 'deep')
+        os.makedirs(nested)
+        actual = Repository.discover(nested)
+        assert (actual.worktree, actual.git_dir) == (repo.worktree, repo.git_dir)
+        assert actual.common_dir == repo.git_dir
+
+    def test_discover_worktree(self, repo, tmp_path):
+        git_dir = os.path.join(repo.git_dir, 'worktrees', 'feature')
+        os.makedirs(git_dir)
+        with open(os.path.join(git_dir, 'commondir'), 'w', encoding='utf-8') as file:
+            file.write('../..\n')
+        worktree = tmp_path / 'feature'
+        worktree.mkdir()
+        (worktree / '.git').write_text(f'gitdir: {git_dir}\n')
+        actual = Repository.discover(str(worktree))
+        assert actual.worktree == str(worktree)
+        assert actual.git_dir == git_dir
+        assert actual.common_dir == repo.git_dir
+
+    def test_discover_none(self, tmp_path):
+        assert Repository.discover(str(tmp_path)) is None
+
+    def test_worktrees_share_common(self, repo, tmp_path):
+        git_dir = tmp_path / 'repo' / '.git' / 'worktrees' / 'feature'
+        git_dir.mkdir(parents=True)
+        (git_dir / 'commondir').write_text('../..\n')
+        (git_dir / 'HEAD').write_text('ref: refs/heads/feature\n')
+        (tmp_path / 'repo' / '.git' / 'packed-refs').write_text(
+            '1a2b3c refs/heads/master\n4d5e6f refs/heads/feature\n'
+        )
+        (tmp_path / 'repo' / '.git' / 'config').write_text(
+            '[branch "master"]\n\tremote = origin\n\tmerge = refs/heads/master\n'
+        )
+        feature = Repository(str(tmp_path / 'feature'), str(git_dir))
+        with patch('statusline.git.COMMON', CommonCache()) as cache:
+            assert repo.resolve('HEAD') == '1a2b3c'
+            assert repo.upstream == 'refs/remotes/origin/master'
+            assert repo.stashes() == 0
+            misses = cache.misses
+            # The sibling worktree reuses the parses but has its own HEAD
+            assert feature.resolve('HEAD') == '4d5e6f'
+            assert feature.upstream is None
+            assert feature.stashes() == 0
+            assert cache.misses == misses
+
+    @pytest.mark.parametrize('head, expected', (
+        ('ref: refs/heads/master\n', 'master'),
+        ('ref: refs/heads/feature/reader\n', 'feature/reader'),
+        ('1a2b3c4d\n', None),
+    ))
+    def test_branch(self, head, expected, repo):
+        with open(os.path.join(repo.git_dir, 'HEAD'), 'w', encoding='utf-8') as file:
+            file.write(head)
+        assert repo.branch == expected
+
+    def test_resolve(self, repo):
+        with open(os.path.join(repo.git_dir, 'refs/heads/master'), 'w', encoding='utf-8') as file:
+            file.write('1a2b3c\n')
+        with open(os.path.join(repo.git_dir, 'packed-refs'), 'w', encoding='utf-8') as file:
+            file.write(
+                '# pack-refs with: peeled fully-peeled sorted\n'
+                '4d5e6f refs/remotes/origin/master\n'
+                '7a8b9c refs/tags/v1\n'
+                '^4d5e6f\n'
+            )
+        assert repo.resolve('HEAD') == '1a2b3c'
+        assert repo.resolve('refs/remotes/origin/master') == '4d5e6f'
+        assert repo.resolve('refs/tags/v1') == '7a8b9c'
+        assert repo.resolve('refs/heads/missing') is None
+
+    @pytest.mark.parametrize('config, expected', (
+        ('', None),
+        (
+            '[branch "master"]\n\tremote = origin\n\tmerge = refs/heads/main\n',
+            'refs/remotes/origin/main',
+        ),
+        ('[branch "master"]\n\tremote = .\n\tmerge = refs/heads/develop\n', 'refs/heads/develop'),
+        ('[branch "other"]\n\tremote = origin\n\tmerge = refs/heads/other\n', None),
+    ))
+    def test_upstream(self, config, expected, repo):
+        with open(os.path.join(repo.git_dir, 'config'), 'w', encoding='utf-8') as file:
+            file.write(f'[core]\n\tbare = false\n{config}')
+        assert repo.upstream == expected
+
+    @pytest.mark.parametrize('config, expected', (
+        ('', None),
+        (
+            '[branch "master"]\n\tremote = origin\n\tmerge = refs/heads/master\n',
+            'refs/remotes/origin/master',
+        ),
+        # Simple refuses an upstream of another name where upstream pushes to it
+        ('[branch "master"]\n\tremote = origin\n\tmerge = refs/heads/main\n', None),
+        (
+            '[push]\n\tdefault = upstream\n'
+            '[branch "master"]\n\tremote = origin\n\tmerge = refs/heads/main\n',
+            'refs/remotes/origin/main',
+        ),
+        (
+            '[push]\n\tdefault = current\n'
+            '[branch "master"]\n\tremote = origin\n\tmerge = refs/heads/main\n',
+            'refs/remotes/origin/master',
+        ),
+        (
+            '[remote]\n\tpushDefault = fork\n'
+            '[branch "master"]\n\tremote = origin\n\tmerge = refs/heads/main\n',
+            'refs/remotes/fork/master',
+        ),
+        (
+            '[branch "master"]\n\tremote = origin\n\tpushRemote = fork\n'
+            '\tmerge = refs/heads/main\n',
+            'refs/remotes/fork/master',
+        ),
+        ('[push]\n\tdefault = nothing\n[branch "master"]\n\tremote = origin\n', None),
+    ))
+    def test_push(self, config, expected, repo):
+        with open(os.path.join(repo.git_dir, 'config'), 'w', encoding='utf-8') as file:
+            file.write(config)
+        assert repo.push == expected
+
+    def test_push_nested(self, repo):
+        # Branch names holding slashes are compared whole
+        with open(os.path.join(repo.git_dir, 'HEAD'), 'w', encoding='utf-8') as file:
+            file.write('ref: refs/heads/feature/x\n')
+        with open(os.path.join(repo.git_dir, 'config'), 'w', encoding='utf-8') as file:
+            file.write('[branch "feature/x"]\n\tremote = origin\n\tmerge = refs/heads/feature/x\n')
+        assert repo.push == 'refs/remotes/origin/feature/x'
+
+    def test_state_files(self, repo):
+        with open(os.path.join(repo.git_dir, 'config'), 'w', encoding='utf-8') as file:
+            file.write('[branch "master"]\n\tremote = origin\n\tmerge = refs/heads/master\n')
+        assert repo.state_files() == [
+            os.path.join(repo.git_dir, name) for name in (
+                'index', 'HEAD', 'packed-refs', 'logs/refs/stash',
+                'refs/heads/master', 'refs/remotes/origin/master',
+            )
+        ]
+
+    @pytest.mark.parametrize('reflog, expected', (
+        (None, 0),
+        ('0000 1a2b WIP on master\n1a2b 4d5e WIP on master\n', 2),
+    ))
+    def test_stashes(self, reflog, expected, repo):
+        if reflog is not None:
+            os.makedirs(os.path.join(repo.git_dir, 'logs/refs'))
+            with open(os.path.join(repo.git_dir, 'logs/refs/stash'), 'w', encoding='utf-8') as file:
+                file.write(reflog)
+        assert repo.stashes() == expected
+
+    @pytest.mark.parametrize('config, expected', (
+        ('', 'sha1'),
+        ('[extensions]\n\tobjectFormat = sha256\n', 'sha256'),
+    ))
+    def test_object_format(self, config, expected, repo):
+        with open(os.path.join(repo.git_dir, 'config'), 'w', encoding='utf-8') as file:
+            file.write(config)
+        assert repo.object_format == expected
+
+    @pytest.mark.parametrize('config, expected', (
+        ('', 'normal'),
+        ('[status]\n\tshowUntrackedFiles = no\n', 'no'),
+        ('[status]\n\tshowUntrackedFiles = false\n', 'no'),
+        ('[status]\n\tshowUntrackedFiles = all\n', 'all'),
+        ('[status]\n\tshowUntrackedFiles = true\n', 'normal'),
+    ))
+    def test_show_untracked(self, config, expected, repo):
+        with open(os.path.join(repo.git_dir, 'config'), 'w', encoding='utf-8') as file:
+            file.write(config)
+        assert repo.show_untracked == expected
+
+    def test_tree(self, repo):
+        commit = '1a2b' + '0' * 36
+        assert repo.tree(commit) is None
+        os.makedirs(os.path.join(repo.git_dir, 'objects', '1a'))
+        body = b'tree ' + b'f' * 40 + b'\nauthor a <a> 0 +0000\n\nmessage\n'
+        with open(os.path.join(repo.git_dir, 'objects', '1a', commit[2:]), 'wb') as file:
+            file.write(zlib.compress(b'commit %d\0' % len(body) + body))
+        assert repo.tree(commit) == 'f' * 40
+
 
 class TestGit:
     @pytest.mark.parametrize('cmd, mock, expected_return, expected_call', (
@@ -55,7 +336,10 @@ class TestGit:
             ['stash', 'list', '--porcelain'],
             SimpleNamespace(stdout=b'stash@{0}\nstash@{1}\n'),
             'stash@{0}\nstash@{1}\n',
-            call(['git', 'stash', 'list', '--porcelain'], check=True, capture_output=True),
+            call(
+                ['git', 'stash', 'list', '--porcelain'],
+                check=True, capture_output=True, cwd=None, timeout=None,
+            ),
         ),
     ))
     def test__run_command(self, cmd, mock, expected_return, expected_call, git):
@@ -64,16 +348,6 @@ class TestGit:
             assert actual == expected_return
             assert mock_run.call_args == expected_call
 
-    @pytest.mark.parametrize('cmd, mock, expected', (
-        (['stash', 'list'], '', 0),
-        (['stash', 'list'], 'stash@{0}\nstash@{1}\n', 2),
-    ))
-    def test__count(self, cmd, mock, expected, git):
-        with patch('statusline.git.Git._run_command', return_value=mock) as mock_run:
-            actual = git._count(cmd)
-            assert actual == expected
-            assert mock_run.call_args == call(cmd)
-
     @patch('statusline.git.Git._run_command', return_value='~/.local/chezmoi\n')
     def test_root_dir_cached(self, mock, git):
         git._root = '/path/'
@@ -85,66 +359,126 @@ class TestGit:
         assert git.root_dir == '~/.local/chezmoi'
         assert mock.call_args == call(['rev-parse', '--show-toplevel'])
 
-    @patch('statusline.git.Git._run_command', return_value='  master  ')
-    def test_branch(self, mock, git):
-        assert git.branch == 'master'
-        assert mock.call_args == call(
-            ['symbolic-ref', '-q', '--short', 'HEAD']
+    @patch('statusline.git.Git._stream_command', return_value=chunks(b'# branch.head master\0'))
+    def test_snapshot(self, mock, git):
+        assert git.snapshot() == Snapshot(branch='master')
+        assert git.snapshot() is git.snapshot()
+        mock.assert_called_once_with(
+            ['status', '--porcelain=v2', '-z', '--branch', '--show-stash', '--no-ahead-behind']
         )
 
+    @pytest.mark.parametrize('environ, expected', (
+        ({}, None),
+        ({'STATUSLINE_STATUS_CAP': '999'}, 999),
+        ({'STATUSLINE_STATUS_CAP': '0'}, None),
+        ({'STATUSLINE_STATUS_CAP': 'many'}, None),
+    ))
+    def test_cap(self, environ, expected):
+        with patch.dict('statusline.git.os.environ', environ, clear=True):
+            assert Git._cap() == expected
+
+    def test_prefetch(self, git):
+        # Each query waits for the others so this only passes if they run concurrently
+        barrier = threading.Barrier(3, timeout=5)
+
+        def run_command(command):
+            if command[0] == 'rev-list':
+                return '2\t1\n'
+            barrier.wait()
+            if command[1] == '--show-toplevel':
+                return '/path/repo\n'
+            return 'abc\ndef\ndef\n'
+
+        def stream_command(_):
+            barrier.wait()
+            yield b'# branch.head master\0'
+
+        with patch('statusline.git.Git._run_command', side_effect=run_command) as mock, \
+            patch('statusline.git.Git._stream_command', side_effect=stream_command):
+            git.prefetch()
+            assert mock.call_count == 3
+        assert git.root_dir == '/path/repo'
+        assert git.snapshot().branch == 'master'
+        assert git.ahead_behind() == AheadBehind(1, 2)
+
+    def test_prefetch_failure(self, git):
+        with patch(
+            'statusline.git.Git._run_command', side_effect=CalledProcessError(128, '')
+        ) as mock, patch(
+            'statusline.git.Git._stream_command', side_effect=CalledProcessError(128, '')
+        ), patch('statusline.git.path.exists', return_value=False):
+            git.prefetch()
+            assert mock.call_count == 2
+            assert not git
+        assert git._snapshot is None
+
+    @patch('statusline.git.Git._run_command')
+    def test_prefetch_repository(self, mock, git):
+        # A single outstanding query is left to run lazily
+        git.repository = MagicMock(spec=Repository, worktree='/path/repo')
+        git.repository.resolve.return_value = None
+        git.prefetch()
+        assert not mock.called
+
+    @patch('statusline.git.Git._run_command')
+    def test_prefetch_result_cache(self, mock, git):
+        # short_stats may be served from the cache without running git at all
+        git.repository = MagicMock(spec=Repository, worktree='/path/repo')
+        with patch.dict('statusline.git.os.environ', {'STATUSLINE_CACHE': 'on'}):
+            git.prefetch()
+        assert not mock.called
+
+    def test_refresh(self, git):
+        git._root = '/path/repo'
+        git._snapshot = Snapshot()
+        git.refresh()
+        assert git._snapshot is None
+        assert git._root == '/path/repo'
+
+    def test_branch(self, git):
+        git._snapshot = Snapshot(branch='master')
+        assert git.branch == 'master'
+
+    @pytest.mark.parametrize('branch, expected', (
+        ('master', 'master'),
+        (None, 'HEAD'),
+    ))
+    def test_branch_repository(self, branch, expected, git):
+        git.repository = MagicMock(spec=Repository, branch=branch)
+        assert git.branch == expected
+        assert git._snapshot is None
+
+    def test_root_dir_repository(self, git):
+        git.repository = MagicMock(spec=Repository, worktree='/path/repo')
+        assert git.root_dir == '/path/repo'
+
+    def test_stashes_repository(self, git):
+        git.repository = MagicMock(spec=Repository)
+        git.repository.stashes.return_value = 3
+        assert git.stashes() == 3
+        assert git._snapshot is None
+
     @patch('statusline.git.path.getmtime', return_value=1604363715.999)
     def test_last_fetch(self, mock, git):
         git._root = 'root'
         assert git.last_fetch == 1604363715
         assert mock.call_args == call('root/.git/FETCH_HEAD')
 
-    @pytest.mark.parametrize('exists, root, expected', (
-        (True, [None], True),
-        (False, ['root'], True),
-        (False, [''], False),
-        (False, [None], False),
-        (False, [CalledProcessError(128, '')], False),
-    ))
-    def test_bool(self, exists, root, expected, git):
-        with patch('statusline.git.path.exists', return_value=exists) as mock_exists, \
-            patch('statusline.git.Git.root_dir', new_callable=PropertyMock, side_effect=root):
-            assert bool(git) == expected
-            mock_exists.called_once_with('.git')
-
-    @pytest.mark.parametrize('porcelain, expected', (
-        ([0, 0], AheadBehind()),
-        ([5, 10], AheadBehind(5, 10)),
-    ))
-    def test_ahead_behind(self, porcelain, expected, git):
-        with patch('statusline.git.Git._count', side_effect=porcelain) as mock:
-            actual = git.ahead_behind()
-            assert actual == expected
-            assert mock.call_args_list == [
-                call(['rev-list', '@{push}..HEAD']),
-                call(['rev-list', 'HEAD..@{upstream}']),
-            ]
-
-    def test_ahead_behind_noupstream(self, git):
-        with patch('statusline.git.Git._count', side_effect=CalledProcessError(128, '')) as mock:
-            actual = git.ahead_behind()
-            assert actual is None
-            assert mock.call_args == call(['rev-list', '@{push}..HEAD'])
+    @patch('statusline.git.Git._run_command')
+    def test_bool(self, mock, git):
+        # Discovery answers without running git
+        assert not git
+        git.repository = MagicMock(spec=Repository)
+        assert git
+        assert not mock.called
 
-    @pytest.mark.parametrize('porcelain, expected', (
-        ('', Status()),
-        ('?? untrack.ed\nM  stag.ed\n M unstag.ed', Status(1, 1, 1)),
-    ))
-    def test_status(self, porcelain, expected, git):
-        with patch('statusline.git.Git._run_command', return_value=porcelain) as mock:
-            actual = git.status()
-            assert actual == expected
-            assert mock.call_args == call(['status', '--porcelain'])
+    def test_status(self, git):
+        git._snapshot = Snapshot(status=Status(1, 1, 1))
+        assert git.status() == Status(1, 1, 1)
 
-    @patch('statusline.git.Git._count', return_value=1)
-    def test_stashes(self, mock, git):
-        actual = git.stashes()
-        assert actual == 1
-        assert mock.call_args == call(['stash', 'list'])
+    def test_stashes(self, git):
+        git._snapshot = Snapshot(stashes=1)
+        assert git.stashes() == 1
 
     @pytest.mark.parametrize('root, branch, aheadbehind, status, stashes, expected', (
         # Normal clean repo
@@ -208,3 +542,364 @@ class TestGit:
         ):
             actual = git.short_stats()
             assert actual == expected
+
+    @pytest.mark.parametrize('enabled, repository, cached, expected', (
+        (False, MagicMock(spec=Repository), 'cached', 'rendered'),
+        (True, None, 'cached', 'rendered'),
+        (True, MagicMock(spec=Repository), 'cached', 'cached'),
+        (True, MagicMock(spec=Repository), None, 'rendered'),
+    ))
+    def test_short_stats_cache(self, enabled, repository, cached, expected, git):
+        git.repository = repository
+        cache = MagicMock(spec=ResultCache)
+        cache.lookup.return_value = cached
+        with patch(
+            'statusline.git.ResultCache.from_environ', return_value=cache if enabled else None
+        ), patch(
+            'statusline.git.signature', return_value=[[1, 2]]
+        ), patch(
+            'statusline.git.Git.render_stats', return_value='rendered'
+        ), patch(
+            'statusline.git.Git.root_dir', new_callable=PropertyMock, return_value='/repo'
+        ):
+            assert git.short_stats() == expected
+        if repository and enabled:
+            cache.lookup.assert_called_once_with('/repo', [[1, 2], list(SEGMENTS), None], None)
+            assert cache.store.called == (cached is None)
+
+
+
+class TestGitFetch:
+    def test_last_fetch_worktree(self, git, tmp_path):
+        # Linked worktrees write their own FETCH_HEAD, the newest one counts
+        common = tmp_path / 'repo' / '.git'
+        git_dir = common / 'worktrees' / 'feature'
+        git_dir.mkdir(parents=True)
+        (git_dir / 'commondir').write_text('../..\n')
+        (git_dir / 'HEAD').write_text('ref: refs/heads/feature\n')
+        git.repository = Repository(str(tmp_path / 'feature'), str(git_dir))
+        with pytest.raises(OSError):
+            assert git.last_fetch
+        assert git.fetch_age() == float('inf')
+        (common / 'FETCH_HEAD').write_text('')
+        os.utime(common / 'FETCH_HEAD', (1000, 1000))
+        assert git.last_fetch == 1000
+        (git_dir / 'FETCH_HEAD').write_text('')
+        os.utime(git_dir / 'FETCH_HEAD', (2000, 2000))
+        assert git.last_fetch == 2000
+        assert git.fetch_age() > 0
+
+    @pytest.mark.parametrize('upstream, age, expected', (
+        (None, 1e9, 'master'),
+        ('origin/master', 10, 'master'),
+        ('origin/master', 5000, '\x01\x1b[33m\x02master\x01\x1b[0m\x02'),
+        ('origin/master', 1e9, '\x01\x1b[31m\x02master\x01\x1b[0m\x02'),
+    ))
+    def test__branch_label(self, git, upstream, age, expected):
+        git.repository = MagicMock(
+            spec=Repository, head='ref: refs/heads/master', upstream=upstream,
+        )
+        with patch('statusline.git.Git.branch', new_callable=PropertyMock, return_value='master'), \
+                patch('statusline.git.Git.fetch_age', return_value=age):
+            assert git._branch_label(FetchScheduler('/cache', age=3600)) == expected
+            assert git._branch_label(None) == 'master'
+
+
+class TestGitDiscover:
+    def test_repository(self):
+        with patch('statusline.git.Repository.discover') as mock:
+            assert Git('/path/repo').repository is mock.return_value
+        mock.assert_called_once_with('/path/repo')
+
+    @pytest.mark.parametrize('found', (True, False))
+    def test_discover(self, found):
+        repository = MagicMock(spec=Repository, worktree='/path/repo') if found else None
+        with patch('statusline.git.Repository.discover', return_value=repository) as mock:
+            actual = Git.discover('/path/repo/src')
+        mock.assert_called_once_with('/path/repo/src')
+        if found:
+            assert actual.cwd == '/path/repo'
+            assert actual.repository is repository
+        else:
+            assert actual is None
+
+
+class TestGitStream:
+    @pytest.mark.parametrize('script, expected', (
+        ('printf "a\\0b"', [b'a\0b']),
+        ('exit 3', CalledProcessError),
+        ('sleep 5', TimeoutExpired),
+    ))
+    def test_stream_command(self, script, expected, git):
+        git.deadline = time.monotonic() + 0.2
+        with patch('statusline.git.Popen', side_effect=shell(script)):
+            if isinstance(expected, list):
+                assert list(git._stream_command(['status'])) == expected
+            else:
+                with pytest.raises(expected):
+                    list(git._stream_command(['status']))
+
+    def test_stream_command_close(self, git):
+        # A reader that stops early kills git rather than waiting for it
+        with patch('statusline.git.Popen', side_effect=shell('echo a; exec sleep 5')):
+            start = time.monotonic()
+            output = git._stream_command(['status'])
+            assert next(output) == b'a\n'
+            output.close()
+            assert time.monotonic() - start < 2
+
+
+class TestGitAheadBehind:
+    @pytest.mark.parametrize('refs, counts, expected, commands', (
+        # Pushing to the upstream needs one walk
+        ('abc\ndef\ndef\n', ['10\t5\n'], AheadBehind(5, 10), [
+            ['rev-list', '--left-right', '--count', 'def...abc'],
+        ]),
+        # A triangular workflow compares each side separately
+        ('abc\nfff\ndef\n', ['1\t5\n', '10\t2\n'], AheadBehind(5, 10), [
+            ['rev-list', '--left-right', '--count', 'fff...abc'],
+            ['rev-list', '--left-right', '--count', 'def...abc'],
+        ]),
+        (CalledProcessError(128, ''), [], None, []),
+    ))
+    def test_ahead_behind(self, refs, counts, expected, commands, git):
+        with patch('statusline.git.Git._run_command', side_effect=[refs, *counts]) as mock:
+            assert git.ahead_behind() == expected
+            assert git.ahead_behind() == expected
+        assert mock.call_args_list == [
+            call(['rev-parse', 'HEAD', '@{push}', '@{upstream}']),
+            *(call(command) for command in commands),
+        ]
+
+    @patch('statusline.git.Git._run_command')
+    def test_ahead_behind_repository(self, mock, git):
+        git.repository = MagicMock(spec=Repository, push='push', upstream='upstream')
+        git.repository.resolve.side_effect = {'HEAD': 'abc', 'push': 'def', 'upstream': 'def'}.get
+        git.memo = MagicMock(spec=Memo)
+        git.memo.get.return_value = [3, 4]
+        assert git.ahead_behind() == AheadBehind(3, 4)
+        git.memo.get.assert_called_once_with('abc def def')
+        assert not mock.called
+
+    @patch('statusline.git.Git._run_command', side_effect=['abc\ndef\ndef\n', '4\t3\n'])
+    def test_ahead_behind_memoize(self, mock, git):
+        git.memo = MagicMock(spec=Memo)
+        git.memo.get.return_value = None
+        assert git.ahead_behind() == AheadBehind(3, 4)
+        git.memo.put.assert_called_once_with('abc def def', [3, 4])
+        git.refresh()
+        assert not git._counted
+
+
+class TestGitCosts:
+    # The repository reader counts stashes so git isn't asked to
+    @pytest.mark.parametrize('level, expected_command, approximate', (
+        (0, [
+            'status', '--porcelain=v2', '-z', '--branch', '--no-ahead-behind',
+        ], False),
+        (3, [
+            '-c', 'core.untrackedCache=true',
+            'status', '--porcelain=v2', '-z', '--branch', '--no-ahead-behind',
+            '--ignore-submodules=all', '--untracked-files=no',
+        ], True),
+    ))
+    def test_snapshot_costs(self, level, expected_command, approximate, git):
+        git.repository = MagicMock(spec=Repository, worktree='/path/repo')
+        git.costs = MagicMock(spec=CostModel)
+        git.costs.level.return_value = level
+        with patch('statusline.git.Git._stream_command', return_value=chunks()) as mock:
+            assert git.snapshot().status.approximate == approximate
+        mock.assert_called_once_with(expected_command)
+        git.costs.level.assert_called_once_with('/path/repo')
+        assert git.costs.record.call_args.args[:2] == ('/path/repo', level)
+
+    def test_snapshot_costs_timeout(self, git):
+        git.repository = MagicMock(spec=Repository, worktree='/path/repo')
+        git.costs = MagicMock(spec=CostModel)
+        git.costs.level.return_value = 0
+        with patch(
+            'statusline.git.Git._stream_command', return_value=chunks(TimeoutExpired(['git'], 1))
+        ), pytest.raises(TimeoutExpired):
+            git.snapshot()
+        # However quickly it was cut short a timed out run counts as slow
+        assert git.costs.record.call_args.args == ('/path/repo', 0, float('inf'))
+
+    def test_snapshot_costs_spent(self, git):
+        # Asked again after the budget ran out git isn't run and nothing is learned
+        git.repository = MagicMock(spec=Repository, worktree='/path/repo')
+        git.costs = MagicMock(spec=CostModel)
+        git.costs.level.return_value = 0
+        git.deadline = time.monotonic() - 1
+        with patch('statusline.git.Popen') as mock, pytest.raises(TimeoutExpired):
+            git.snapshot()
+        assert not mock.called
+        assert not git.costs.record.called
+
+
+class TestGitBudget:
+    def test_short_stats_partial(self, git):
+        git.repository = MagicMock(spec=Repository)
+        cache = MagicMock(spec=ResultCache)
+        cache.lookup.return_value = None
+        with patch(
+            'statusline.git.ResultCache.from_environ', return_value=cache
+        ), patch(
+            'statusline.git.Git.root_dir', new_callable=PropertyMock, return_value='/repo'
+        ), patch(
+            'statusline.git.Git.branch', new_callable=PropertyMock, return_value='master'
+        ), patch(
+            'statusline.git.Git.ahead_behind', side_effect=TimeoutExpired(['git'], 0)
+        ):
+            assert git.short_stats() == f'{Git.ICON}master{Git.PENDING}'
+        assert git.partial
+        assert not cache.store.called
+
+    @pytest.mark.parametrize('environ, expected', (
+        ({}, None),
+        ({'STATUSLINE_TIMEOUT_MS': '250'}, 100.25),
+    ))
+    @patch('statusline.git.time.monotonic', return_value=100.0)
+    def test_refresh_deadline(self, mock, environ, expected, git):
+        with patch.dict('statusline.git.os.environ', environ):
+            git.refresh()
+        assert git.deadline == expected
+
+    @patch('statusline.git.time.monotonic', return_value=100.0)
+    def test_restart_budget(self, mock, git):
+        # A kept snapshot still gets the full budget for whatever isn't computed yet
+        git._snapshot = snapshot = Snapshot()
+        git.deadline = 1.0
+        with patch.dict('statusline.git.os.environ', {'STATUSLINE_TIMEOUT_MS': '250'}):
+            git.restart_budget()
+        assert git.deadline == 100.25
+        assert git.snapshot() is snapshot
+
+    def test__run_command_trace(self, git, tmp_path):
+        path = str(tmp_path / 'trace.jsonl')
+        with patch.dict('statusline.trace.os.environ', {'STATUSLINE_TRACE': path}), \
+            patch('statusline.git.run', return_value=SimpleNamespace(stdout=b'master\n')):
+            git._run_command(['branch', '--show-current'])
+        event = trace.load(path)[-1]
+        assert event['argv'] == ['git', 'branch', '--show-current']
+        assert (event['exit'], event['bytes']) == (0, 7)
+
+    def test__run_command_deadline(self, git):
+        git.deadline = time.monotonic() + 5
+        with patch('statusline.git.run') as mock:
+            git._run_command(['status'])
+            assert 0 < mock.call_args.kwargs['timeout'] <= 5
+        git.deadline = time.monotonic()
+        with patch('statusline.git.run') as mock, pytest.raises(TimeoutExpired):
+            git._run_command(['status'])
+        assert not mock.called
+
+
+class TestGitSegments:
+    @pytest.fixture()
+    def stats(self, git):
+        git.repository = MagicMock(spec=Repository)
+        with patch(
+            'statusline.git.Git.root_dir', new_callable=PropertyMock, return_value='/repo'
+        ), patch(
+            'statusline.git.Git.branch', new_callable=PropertyMock, return_value='master'
+        ), patch(
+            'statusline.git.Git.ahead_behind', return_value=AheadBehind(1, 0)
+        ) as mock_ahead_behind, patch(
+            'statusline.git.Git.status', return_value=Status(0, 12, 0)
+        ) as mock_status, patch(
+            'statusline.git.Git.stashes', return_value=1
+        ) as mock_stashes:
+            yield SimpleNamespace(
+                ahead_behind=mock_ahead_behind, status=mock_status, stashes=mock_stashes,
+            )
+
+    def test_render_stats_disabled(self, git, stats):
+        git.segments = ('branch', 'status')
+        assert git.render_stats() == 'master(\001\033[31m\00212\001\033[0m\002)'
+        assert not stats.ahead_behind.called
+        assert not stats.stashes.called
+
+    @pytest.mark.parametrize('columns, expected, stashed', (
+        (None, f'{Git.ICON}master↑1(\001\033[31m\00212\001\033[0m\002){{1}}', True),
+        (13, f'{Git.ICON}master↑1(\001\033[31m\00212\001\033[0m\002)', False),
+        (11, f'{Git.ICON}↑1(\001\033[31m\00212\001\033[0m\002){{1}}', True),
+        (3, f'{Git.ICON}↑1', False),
+    ))
+    def test_render_stats_columns(self, columns, expected, stashed, git, stats):
+        # Priority decides what is kept but not where it is shown
+        git.segments = ('icon', 'status', 'ahead_behind', 'branch', 'stashes')
+        assert git.render_stats(columns) == expected
+        assert stats.stashes.called == stashed
+
+    @patch('statusline.git.Git._run_command')
+    def test_prefetch_disabled(self, mock, git):
+        git.repository = MagicMock(spec=Repository, worktree='/path/repo')
+        git.segments = ('branch', 'stashes')
+        with patch('statusline.git.Git.snapshot') as mock_snapshot:
+            git.prefetch()
+        assert not mock.called
+        assert not mock_snapshot.called
+
+    def test_snapshot_stashes(self, git):
+        # Without the repository reader the stash count only comes from status
+        git.segments = ('branch', 'status')
+        with patch('statusline.git.Git._stream_command', return_value=chunks()) as mock:
+            git.snapshot()
+        assert '--show-stash' not in mock.call_args.args[0]
+
+
+@pytest.fixture(scope='module')
+def superproject(tmp_path_factory):
+    """A repository with three submodules: one modified, one on a new commit and one clean."""
+    base = tmp_path_factory.mktemp('submodules')
+    environ = {**os.environ, **GIT_ENV}
+
+    def run_git(*args):
+        subprocess.run(['git', *args], cwd=base, check=True, capture_output=True, env=environ)
+
+    for name in ('a', 'b', 'c'):
+        run_git('init', '-q', f'src/{name}')
+        run_git('-C', f'src/{name}', 'commit', '-q', '--allow-empty', '-m', name)
+    run_git('init', '-q', 'super')
+    for name in ('a', 'b', 'c'):
+        run_git(
+            '-C', 'super', '-c', 'protocol.file.allow=always',
+            'submodule', 'add', '-q', str(base / 'src' / name), f'lib/{name}',
+        )
+    run_git('-C', 'super', 'commit', '-q', '-m', 'submodules')
+    (base / 'super' / 'lib' / 'a' / 'new').write_text('')
+    run_git('-C', 'super/lib/b', 'commit', '-q', '--allow-empty', '-m', 'moved')
+    return str(base / 'super')
+
+
+class TestGitSubmodules:
+    def test_submodules(self, superproject):
+        assert Repository.discover(superproject).submodules() == ['lib/a', 'lib/b', 'lib/c']
+
+    def test_submodules_none(self, repo):
+        assert repo.submodules() == []
+
+    def test_count(self, superproject, tmp_path):
+        cache = SubmoduleCache(Memo(str(tmp_path / 'submodules.json')))
+        found = Git.discover(superproject)
+        with patch('statusline.git.Git._modified', wraps=found._modified) as mock:
+            assert found.submodules(cache) == 2
+        # The submodule on another commit isn't scanned
+        assert sorted(c.args[0][-1] for c in mock.call_args_list) == ['a', 'c']
+        with patch('statusline.git.Git._modified') as mock, \
+                patch('statusline.git.Git._run_command') as mock_run:
+            assert Git.discover(superproject).submodules(cache) == 2
+        assert not mock.called
+        assert not mock_run.called
+
+    def test_snapshot(self, superproject, tmp_path, monkeypatch):
+        monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+        monkeypatch.setenv('STATUSLINE_SUBMODULES', 'cached')
+        found = Git.discover(superproject)
+        found.costs = None
+        with patch('statusline.git.Git._stream_command', wraps=found._stream_command) as mock:
+            assert found.status() == Status(submodules=2)
+        assert '--ignore-submodules=all' in mock.call_args_list[0].args[0]
+        monkeypatch.delenv('STATUSLINE_SUBMODULES')
+        found.refresh()
+        assert found.status() == Status(unstaged=2)
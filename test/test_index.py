@@ -0,0 +1,301 @@
+import os
+import subprocess
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from statusline.bench import GIT_ENV, Scenario, build
+from statusline.git import Snapshot, Status
+from statusline.index import (
+    Index, IndexCache, IndexGit, IndexReader, UnsupportedIndex, _varint,
+)
+
+
+def run_git(cwd, *args):
+    return subprocess.run(
+        ['git', *args], cwd=cwd, check=True, capture_output=True, env={**os.environ, **GIT_ENV},
+    ).stdout
+
+
+def write(name, content):
+    os.makedirs(os.path.dirname(name), exist_ok=True)
+    with open(name, 'w', encoding='utf-8') as file:
+        file.write(content)
+
+
+def parse(repo):
+    with open(os.path.join(repo, '.git', 'index'), 'rb') as file:
+        return Index(file.read())
+
+
+@pytest.fixture(autouse=True)
+def cache_home(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+
+
+@pytest.fixture()
+def clean(tmp_path):
+    return build(Scenario(tracked=20), str(tmp_path))
+
+
+@pytest.fixture(scope='module', params=[10, 500, 3000])
+def changed(request, tmp_path_factory):
+    """A repository of each size with every kind of change git status counts."""
+    size = request.param
+    repo = build(
+        Scenario(tracked=size, modified=min(size // 10, 50), untracked=size // 10),
+        str(tmp_path_factory.mktemp('index')),
+    )
+    tracked = os.path.join(repo, 'src', 'd0')
+    os.remove(os.path.join(tracked, 'f9.txt'))
+    os.chmod(os.path.join(tracked, 'f8.txt'), 0o755)
+    run_git(repo, 'mv', 'src/d0/f7.txt', 'renamed.txt')
+    write(os.path.join(repo, 'staged', 'new.txt'), 'new\n')
+    run_git(repo, 'add', 'staged')
+    write(os.path.join(tracked, 'f6.txt'), 'staged\n')
+    run_git(repo, 'add', 'src/d0/f6.txt')
+    write(os.path.join(tracked, 'f6.txt'), 'staged then changed\n')
+    # The same size as before so only the mtime differs
+    write(os.path.join(tracked, 'f5.txt'), 'x\n')
+    write(os.path.join(repo, '.gitignore'), '*.log\n')
+    write(os.path.join(repo, 'ignored.log'), '')
+    return repo
+
+
+def test_varint():
+    assert _varint(b'\x05', 0) == (5, 1)
+    assert _varint(b'\x7f', 0) == (127, 1)
+    # Each continuation adds one before shifting
+    assert _varint(b'\x80\x00', 0) == (128, 2)
+    assert _varint(b'x\x81\x7f!', 1) == (383, 3)
+
+
+class TestIndex:
+    @pytest.mark.parametrize('version', [2, 3, 4])
+    def test_entries(self, version, changed):
+        run_git(changed, 'update-index', '--index-version', str(version))
+        index = parse(changed)
+        # Git only writes version 3 when an entry has extended flags
+        assert index.version == (2 if version == 3 else version)
+        names = run_git(changed, 'ls-files', '-z').split(b'\0')[:-1]
+        assert index.names == names
+        assert len(index.stats) == 10 * len(index)
+        assert index.mode(names.index(b'src/d0/f8.txt')) == 0o100644
+        assert not any(index.stage(position) for position in range(len(index)))
+
+    def test_tree(self, clean):
+        run_git(clean, 'commit', '-q', '--allow-empty', '-m', 'tree')
+        assert parse(clean).tree == run_git(clean, 'rev-parse', 'HEAD^{tree}').decode().strip()
+        write(os.path.join(clean, 'new.txt'), '')
+        run_git(clean, 'add', 'new.txt')
+        assert parse(clean).tree is None
+
+    def test_skip_worktree(self, clean):
+        run_git(clean, 'update-index', '--skip-worktree', 'src/d0/f1.txt')
+        index = parse(clean)
+        assert index.version == 3
+        assert [index.skipped(position) for position in range(3)] == [False, True, False]
+
+    def test_assume_unchanged(self, clean):
+        run_git(clean, 'update-index', '--assume-unchanged', 'src/d0/f1.txt')
+        index = parse(clean)
+        assert index.version == 2
+        assert [index.skipped(position) for position in range(3)] == [False, True, False]
+
+    def test_conflicts(self, clean):
+        run_git(clean, 'checkout', '-q', '-b', 'other')
+        write(os.path.join(clean, 'src', 'd0', 'f0.txt'), 'other\n')
+        run_git(clean, 'commit', '-q', '-am', 'other')
+        run_git(clean, 'checkout', '-q', 'master')
+        write(os.path.join(clean, 'src', 'd0', 'f0.txt'), 'master\n')
+        run_git(clean, 'commit', '-q', '-am', 'master')
+        with pytest.raises(subprocess.CalledProcessError):
+            run_git(clean, 'merge', '-q', 'other')
+        assert sorted(parse(clean).stage(position) for position in range(3)) == [1, 2, 3]
+
+    @pytest.mark.parametrize('args', [
+        ['add', '-N', 'new.txt'],
+        ['update-index', '--split-index'],
+    ])
+    def test_unsupported(self, args, clean):
+        write(os.path.join(clean, 'new.txt'), '')
+        run_git(clean, *args)
+        with pytest.raises(UnsupportedIndex):
+            parse(clean)
+
+    @pytest.mark.parametrize('data', [b'', b'DIRD', b'DIRC\0\0\0\x05\0\0\0\0'])
+    def test_invalid(self, data):
+        with pytest.raises(UnsupportedIndex):
+            Index(data)
+
+
+def test_cache(clean):
+    cache = IndexCache(size=1)
+    git_dir = os.path.join(clean, '.git')
+    first, stat = cache.load(git_dir)
+    assert stat.st_size == os.stat(os.path.join(git_dir, 'index')).st_size
+    assert cache.load(git_dir)[0] is first
+    assert (cache.hits, cache.misses) == (1, 1)
+    run_git(clean, 'rm', '-q', '--cached', 'src/d0/f0.txt')
+    assert len(cache.load(git_dir)[0]) == len(first) - 1
+    assert len(cache) == 1
+    with pytest.raises(OSError):
+        cache.load(clean)
+
+
+class TestIndexReader:
+    def compare(self, repo, reader=None, **kwargs):
+        reader = reader or IndexReader(workers=2)
+        index, written = reader.read(os.path.join(repo, '.git'))
+        assert written == os.stat(os.path.join(repo, '.git', 'index')).st_mtime_ns
+        return reader.compare(index, repo, written, **kwargs)
+
+    def test_clean(self, clean):
+        assert self.compare(clean) == (0, [])
+
+    def test_changes(self, clean):
+        os.remove(os.path.join(clean, 'src', 'd0', 'f1.txt'))
+        write(os.path.join(clean, 'src', 'd0', 'f2.txt'), 'changed\n')
+        os.chmod(os.path.join(clean, 'src', 'd0', 'f3.txt'), 0o755)
+        # The same size as before
+        write(os.path.join(clean, 'src', 'd0', 'f4.txt'), 'x\n')
+        assert self.compare(clean) == (2, ['src/d0/f3.txt', 'src/d0/f4.txt'])
+
+    def test_racy(self, clean):
+        index = os.path.join(clean, '.git', 'index')
+        stat = os.stat(index)
+        times = (stat.st_atime_ns, stat.st_mtime_ns)
+        os.utime(os.path.join(clean, 'src', 'd0', 'f4.txt'), ns=times)
+        run_git(clean, 'update-index', '--refresh')
+        os.utime(index, ns=times)
+        assert self.compare(clean) == (0, ['src/d0/f4.txt'])
+
+    def test_skip_worktree(self, clean):
+        run_git(clean, 'update-index', '--skip-worktree', 'src/d0/f1.txt')
+        os.remove(os.path.join(clean, 'src', 'd0', 'f1.txt'))
+        assert self.compare(clean) == (0, [])
+
+    def test_assume_unchanged(self, clean):
+        run_git(clean, 'update-index', '--assume-unchanged', 'src/d0/f1.txt')
+        write(os.path.join(clean, 'src', 'd0', 'f1.txt'), 'changed\n')
+        assert self.compare(clean) == (0, [])
+
+    def test_limit(self, clean):
+        for index in range(3):
+            write(os.path.join(clean, 'src', 'd0', f'f{index}.txt'), 'x\n')
+        assert self.compare(clean, IndexReader(limit=2)) is None
+
+    def test_gitlinks(self, clean):
+        commit = run_git(clean, 'rev-parse', 'HEAD').decode().strip()
+        run_git(clean, 'update-index', '--add', '--cacheinfo', f'160000,{commit},lib')
+        with pytest.raises(UnsupportedIndex):
+            self.compare(clean)
+        assert self.compare(clean, gitlinks=True) == (0, [])
+
+
+class TestIndexGit:
+    @pytest.mark.parametrize('version', [2, 3, 4])
+    def test_matches_git_status(self, version, changed):
+        run_git(changed, 'update-index', '--index-version', str(version))
+        found = IndexGit.discover(changed)
+        with patch('statusline.git.Git._stream_command', wraps=found._stream_command) as mock:
+            status = found._index_status([], [])
+        # Only the entries stat data couldn't settle were given to git status
+        assert all('--' in c.args[0] for c in mock.call_args_list if 'status' in c.args[0])
+        output = run_git(changed, 'status', '--porcelain=v2', '-z')
+        expected = Snapshot.parse([output], found._cap()).status
+        assert status == expected
+        assert status.staged == 3
+
+    @pytest.mark.parametrize('flag', ['--assume-unchanged', '--skip-worktree'])
+    def test_unchecked(self, flag, clean):
+        # Git status trusts these entries so their changes aren't counted either
+        run_git(clean, 'update-index', flag, 'src/d0/f1.txt', 'src/d0/f2.txt')
+        write(os.path.join(clean, 'src', 'd0', 'f1.txt'), 'changed\n')
+        write(os.path.join(clean, 'src', 'd0', 'f2.txt'), 'x\n')
+        write(os.path.join(clean, 'src', 'd0', 'f3.txt'), 'changed\n')
+        found = IndexGit.discover(clean)
+        output = run_git(clean, 'status', '--porcelain=v2', '-z')
+        assert found._index_status([], []) == Snapshot.parse([output], found._cap()).status
+        assert found._index_status([], []).unstaged == 1
+
+    def test_staged_from_tree(self, clean):
+        found = IndexGit.discover(clean)
+        with patch('statusline.git.Git._run_command') as mock:
+            status = found._index_status([], [])
+        assert not mock.called
+        assert not status
+
+    @pytest.mark.parametrize('options, expected', [
+        (['--ignore-submodules=all'], 1),
+        (['--ignore-submodules=all', '--untracked-files=no'], 0),
+    ])
+    def test_untracked(self, options, expected, clean):
+        write(os.path.join(clean, 'build', 'a.o'), '')
+        write(os.path.join(clean, 'build', 'b.o'), '')
+        assert IndexGit.discover(clean)._index_status([], options).untracked == expected
+
+    @pytest.mark.parametrize('mode', ['no', 'normal', 'all'])
+    def test_show_untracked(self, mode, clean):
+        run_git(clean, 'config', 'status.showUntrackedFiles', mode)
+        write(os.path.join(clean, 'build', 'a.o'), '')
+        write(os.path.join(clean, 'build', 'b.o'), '')
+        write(os.path.join(clean, 'new.txt'), '')
+        found = IndexGit.discover(clean)
+        output = run_git(clean, 'status', '--porcelain=v2', '-z')
+        assert found._index_status([], []) == Snapshot.parse([output], found._cap()).status
+        assert found._index_status([], []).untracked == {'no': 0, 'normal': 2, 'all': 3}[mode]
+
+    @pytest.mark.parametrize('args', [
+        ['update-index', '--split-index'],
+        ['checkout', '-q', '--orphan', 'unborn'],
+    ])
+    def test_unsupported(self, args, clean):
+        run_git(clean, *args)
+        assert IndexGit.discover(clean)._index_status([], []) is None
+
+    def test_reader(self, monkeypatch):
+        monkeypatch.setenv('STATUSLINE_INDEX_WORKERS', '3')
+        assert IndexGit('.')._reader.workers == 3
+
+    def test_snapshot(self, clean):
+        write(os.path.join(clean, 'src', 'd0', 'f0.txt'), 'changed\n')
+        write(os.path.join(clean, 'src', 'd0', 'f1.txt'), 'x\n')
+        found = IndexGit.discover(clean)
+        found.costs = None
+        with patch('statusline.git.Git._stream_command', wraps=found._stream_command) as mock:
+            assert (found.status().unstaged, found.status().untracked) == (2, 0)
+        assert sorted(c.args[0][-1] for c in mock.call_args_list) == ['-z', 'src/d0/f1.txt']
+        # Conflicts and the like are left to git status
+        found.refresh()
+        with patch('statusline.index.IndexReader.compare', side_effect=UnsupportedIndex), \
+                patch('statusline.git.Git._stream_command', wraps=found._stream_command) as mock:
+            assert found.status().unstaged == 2
+        assert '--branch' in mock.call_args_list[0].args[0]
+
+    def test_staged_memo(self, clean):
+        write(os.path.join(clean, 'src', 'd0', 'f0.txt'), 'changed\n')
+        run_git(clean, 'add', 'src/d0/f0.txt')
+        with patch('statusline.git.Git._run_command', return_value='src/d0/f0.txt\0') as mock:
+            assert IndexGit.discover(clean)._index_status([], []).staged == 1
+            assert IndexGit.discover(clean)._index_status([], []).staged == 1
+        assert mock.call_count == 1
+        run_git(clean, 'reset', '-q')
+        assert IndexGit.discover(clean)._index_status([], []).staged == 0
+
+    def test_staged_without_memo(self, clean):
+        write(os.path.join(clean, 'src', 'd0', 'f0.txt'), 'changed\n')
+        run_git(clean, 'add', 'src/d0/f0.txt')
+        with patch('statusline.git.Git._run_command', return_value='src/d0/f0.txt\0') as mock:
+            for _ in range(2):
+                found = IndexGit.discover(clean)
+                found.memo = None
+                assert found._index_status([], []).staged == 1
+        assert mock.call_count == 2
+
+    def test_snapshot_level(self, clean):
+        found = IndexGit.discover(clean)
+        found.costs = MagicMock(**{'level.return_value': 3})
+        with patch('statusline.index.IndexGit._untracked') as mock:
+            assert found.status() == Status(approximate=True)
+        assert not mock.called
@@ -0,0 +1,62 @@
+import os
+import subprocess
+from unittest.mock import patch
+
+import pytest
+
+from statusline.bench import GIT_ENV, Scenario, build
+from statusline.costs import REDUCED
+from statusline.git import Git
+
+pytest.importorskip('pygit2')
+# pylint: disable-next=wrong-import-position
+from statusline.libgit import LibGit
+
+
+def git(cwd, *args):
+    subprocess.run(
+        ['git', *args], cwd=cwd, check=True, capture_output=True, env={**os.environ, **GIT_ENV},
+    )
+
+
+def answers(backend, cwd):
+    vcs = backend(cwd)
+    vcs.memo = None
+    return vcs.branch, vcs.ahead_behind(), vcs.status(), vcs.stashes(), vcs.snapshot().upstream
+
+
+@pytest.mark.parametrize('scenario', (
+    Scenario(),
+    Scenario(tracked=20, modified=3, untracked=150, ahead=2, behind=3, stashes=2),
+    Scenario(tracked=5, behind=1, worktrees=1, depth=2),
+))
+def test_identical(scenario, tmp_path):
+    cwd = build(scenario, str(tmp_path))
+    assert answers(LibGit, cwd) == answers(Git, cwd)
+
+
+def test_identical_index(tmp_path):
+    cwd = build(Scenario(tracked=5), str(tmp_path))
+    git(cwd, 'rm', '-q', '--cached', os.path.join('src', 'd0', 'f0.txt'))
+    with open(os.path.join(cwd, 'added'), 'w', encoding='utf-8') as file:
+        file.write('added\n')
+    git(cwd, 'add', 'added')
+    git(cwd, 'mv', os.path.join('src', 'd0', 'f1.txt'), 'moved')
+    git(cwd, 'checkout', '-q', '--detach')
+    assert answers(LibGit, cwd) == answers(Git, cwd)
+
+
+@pytest.mark.parametrize('mode', ('no', 'normal', 'all'))
+def test_identical_untracked(mode, tmp_path):
+    cwd = build(Scenario(tracked=5, untracked=3, depth=2), str(tmp_path))
+    git(cwd, 'config', 'status.showUntrackedFiles', mode)
+    assert answers(LibGit, cwd) == answers(Git, cwd)
+
+
+def test_cost_level(tmp_path):
+    cwd = build(Scenario(tracked=5, untracked=3), str(tmp_path))
+    vcs = LibGit(cwd)
+    vcs.memo = None
+    with patch.object(vcs, 'costs') as mock_costs, patch('statusline.git.Git.snapshot') as mock:
+        mock_costs.level.return_value = REDUCED
+        assert vcs.snapshot() is mock.return_value
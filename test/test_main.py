@@ -0,0 +1,21 @@
+from unittest.mock import patch
+
+import pytest
+
+from statusline.__main__ import command
+
+
+@patch('statusline.__main__.client.request', return_value='{"requests": 1}')
+def test_stats(mock, capsys):
+    command(['--stats'])
+    assert capsys.readouterr().out == '{"requests": 1}\n'
+    mock.assert_called_once_with('stats')
+
+
+@patch('statusline.__main__.client.request', return_value=None)
+def test_stats_unavailable(mock, capsys):
+    # Without a daemon there are no counters to print
+    with pytest.raises(SystemExit) as error:
+        command(['--stats'])
+    assert error.value.code == 'no statusline daemon is running'
+    assert not capsys.readouterr().out
@@ -0,0 +1,69 @@
+import os
+from unittest.mock import patch
+
+import pytest
+
+from statusline.cache import Memo
+from statusline.prefix import PrefixCache, unique_prefix
+
+
+@pytest.mark.parametrize('name, siblings, minimum, expected', (
+    ('Documents', [], 1, 'D'),
+    ('Documents', ['Downloads', 'Desktop'], 1, 'Doc'),
+    ('.config', ['.cache'], 2, '.co'),
+    ('python', ['python3'], 1, 'python'),
+))
+def test_unique_prefix(name, siblings, minimum, expected):
+    assert unique_prefix(name, siblings, minimum) == expected
+
+
+@pytest.fixture()
+def prefixes(tmp_path):
+    return PrefixCache(Memo(str(tmp_path / 'cache' / 'prefixes.json')), limit=5)
+
+
+@pytest.fixture()
+def home(tmp_path):
+    for name in ('Documents', 'Downloads', 'Music'):
+        (tmp_path / 'home' / name).mkdir(parents=True)
+    # Files can't be confused with directories when changing into them
+    (tmp_path / 'home' / 'Doc.txt').write_text('')
+    return str(tmp_path / 'home')
+
+
+def test_shorten(prefixes, home):
+    assert prefixes.shorten(home, 'Documents', 'D') == 'Doc'
+    assert prefixes.shorten(home, 'Music', 'M') == 'M'
+
+
+def test_shorten_cached(prefixes, home):
+    prefixes.shorten(home, 'Documents', 'D')
+    with patch('statusline.prefix.os.scandir') as mock:
+        assert PrefixCache(Memo(prefixes.memo.path)).shorten(home, 'Documents', 'D') == 'Doc'
+    assert not mock.called
+
+
+def test_shorten_invalidated(prefixes, home):
+    assert prefixes.shorten(home, 'Documents', 'D') == 'Doc'
+    os.rmdir(os.path.join(home, 'Downloads'))
+    assert prefixes.shorten(home, 'Documents', 'D') == 'D'
+
+
+def test_shorten_limit(prefixes, home):
+    for index in range(5):
+        os.mkdir(os.path.join(home, f'Data{index}'))
+    assert prefixes.shorten(home, 'Documents', 'D') == 'D'
+
+
+def test_shorten_missing(prefixes, tmp_path):
+    assert prefixes.shorten(str(tmp_path / 'missing'), 'Documents', 'D') == 'D'
+
+
+@pytest.mark.parametrize('environ, expected', (
+    ({}, None),
+    ({'STATUSLINE_MINIFY': 'unique', 'STATUSLINE_LISTING_LIMIT': '50'}, 50),
+))
+def test_from_environ(environ, expected):
+    with patch.dict('statusline.prefix.os.environ', environ, clear=True):
+        actual = PrefixCache.from_environ()
+    assert (actual and actual.limit) == expected
@@ -0,0 +1,95 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from statusline import segments
+from statusline.segments import SEGMENTS
+
+
+@pytest.fixture(autouse=True)
+def config_home(monkeypatch, tmp_path):
+    monkeypatch.delenv('STATUSLINE_SEGMENTS', raising=False)
+    monkeypatch.setenv('XDG_CONFIG_HOME', str(tmp_path))
+    return tmp_path
+
+
+@pytest.mark.parametrize('environ, config, expected', (
+    (None, None, SEGMENTS),
+    ('status, branch', None, ('status', 'branch')),
+    ('', None, ()),
+    ('branch,unknown,branch', 'stashes', ('branch',)),
+    (None, 'branch\nstatus\n\n', ('branch', 'status')),
+    (None, 'icon,ahead_behind', ('icon', 'ahead_behind')),
+))
+def test_configured(environ, config, expected, config_home, monkeypatch):
+    if environ is not None:
+        monkeypatch.setenv('STATUSLINE_SEGMENTS', environ)
+    if config is not None:
+        (config_home / 'statusline').mkdir()
+        (config_home / 'statusline' / 'segments').write_text(config)
+    assert segments.configured() == expected
+
+
+@pytest.mark.parametrize('environ, expected', (
+    ({}, None),
+    # Opt-in so existing prompts aren't cut short
+    ({'COLUMNS': '80'}, None),
+    ({'COLUMNS': '80', 'STATUSLINE_WIDTH': '75%'}, 60),
+    ({'COLUMNS': '80', 'STATUSLINE_WIDTH': '30'}, 30),
+    ({'STATUSLINE_WIDTH': '30'}, 30),
+    ({'STATUSLINE_WIDTH': '50%'}, None),
+    ({'COLUMNS': '80', 'STATUSLINE_WIDTH': 'wide'}, None),
+    ({'COLUMNS': '80', 'STATUSLINE_WIDTH': 'x%'}, None),
+))
+def test_budget(environ, expected, monkeypatch):
+    monkeypatch.delenv('COLUMNS', raising=False)
+    monkeypatch.delenv('STATUSLINE_WIDTH', raising=False)
+    for name, value in environ.items():
+        monkeypatch.setenv(name, value)
+    assert segments.budget() == expected
+
+
+@pytest.mark.parametrize('text, expected', (
+    ('', 0),
+    ('master', 6),
+    ('\001\033[30;101m\002↕5\001\033[0m\002{1}', 5),
+))
+def test_width(text, expected):
+    assert segments.width(text) == expected
+
+
+@pytest.mark.parametrize('columns, expected', (
+    (None, SEGMENTS),
+    (100, SEGMENTS),
+    (5, ('icon', 'branch', 'ahead_behind')),
+    (6, ('icon', 'branch', 'ahead_behind', 'status')),
+    (2, ('icon', 'branch')),
+    (0, ()),
+))
+def test_plausible(columns, expected):
+    assert segments.plausible(SEGMENTS, columns) == expected
+
+
+def test_evaluate():
+    renders = {
+        'icon': MagicMock(return_value='>'),
+        'branch': MagicMock(return_value='a-long-branch'),
+        'ahead_behind': MagicMock(return_value='↑1'),
+        'status': MagicMock(return_value='(12)'),
+        'stashes': MagicMock(return_value='{1}'),
+    }
+    order = ('status', 'icon', 'branch', 'ahead_behind', 'stashes')
+    # The branch is too wide once rendered, then stashes can't possibly fit
+    actual = list(segments.evaluate(renders, order, 8))
+    assert actual == [('status', '(12)'), ('icon', '>'), ('ahead_behind', '↑1')]
+    assert renders['branch'].called
+    assert not renders['stashes'].called
+
+
+def test_evaluate_lazy():
+    renders = {'icon': MagicMock(return_value='>'), 'stashes': MagicMock(side_effect=ValueError)}
+    evaluated = segments.evaluate(renders, ('icon', 'stashes'), None)
+    assert next(evaluated) == ('icon', '>')
+    assert not renders['stashes'].called
+    with pytest.raises(ValueError):
+        next(evaluated)
@@ -0,0 +1,55 @@
+import subprocess
+import sys
+
+import pytest
+
+
+# Cumulative microseconds allowed for importing each entry point.
+# statusline.status took about 30ms before opt-in features were added, half as much
+# again leaves room for slow CI hosts while still catching a feature imported eagerly.
+BUDGET = {
+    'statusline.__main__': 20_000,
+    'statusline.status': 45_000,
+}
+
+
+def importtime(module: str) -> dict:
+    """Import a module in a fresh interpreter recording what it loads.
+    :param module: the module to import
+    :return: cumulative import time in microseconds keyed by module name
+    """
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        check=True, capture_output=True, text=True,
+    ).stderr
+    result = {}
+    for line in stderr.splitlines():
+        if line.startswith('import time:') and not line.endswith('package'):
+            _, cumulative, name = line[12:].split('|')
+            result[name.strip()] = int(cumulative)
+    return result
+
+
+@pytest.mark.parametrize('module, excluded', (
+    # Asking the daemon only needs the client
+    ('statusline.__main__', (
+        'ansi', 'socket', 'subprocess', 'dataclasses', 'typing', 'statusline.git',
+    )),
+    # Rendering in-process uses precomputed escapes and stays off optional paths,
+    # opt-in features are only imported once their environment switch is set
+    ('statusline.status', (
+        'ansi', 'hashlib', 'tempfile', 'socket', 'concurrent.futures', 'zlib',
+        'statusline.backends', 'statusline.costs', 'statusline.fetch', 'statusline.prefix',
+    )),
+))
+def test_imports(module, excluded):
+    loaded = importtime(module)
+    assert module in loaded
+    assert not set(excluded) & set(loaded)
+
+
+@pytest.mark.parametrize('module', BUDGET)
+def test_importtime(module):
+    # Best of several runs to tolerate a noisy host
+    actual = min(importtime(module)[module] for _ in range(5))
+    assert actual < BUDGET[module]
@@ -1,14 +1,16 @@
-from unittest.mock import patch, MagicMock
+from subprocess import TimeoutExpired
+from unittest.mock import patch, MagicMock, PropertyMock
 
 import pytest
 
-from statusline.status import DirectoryMinify
+from statusline.status import DirectoryMinify, PathCache, _discover
 from statusline.git import Git
+from statusline.prefix import PrefixCache
 
 
 @pytest.fixture()
 def instance():
-    result = DirectoryMinify()
+    result = DirectoryMinify(paths=PathCache())
     result.VCS = vcs = MagicMock(spec=Git)
     vcs.branch = 'master'
     return result
@@ -36,6 +38,26 @@ def test_minify_path(mock, path, expected, instance):
     assert actual == expected
 
 
+def test_path_cache():
+    cache = PathCache(size=4)
+    minify_dir = MagicMock(side_effect=lambda name: name[:1])
+    assert cache.minify(['', 'home', 'kevna', 'Documents'], minify_dir) == '/h/k/D'
+    assert minify_dir.call_count == 4
+    # Descendants reuse the minified ancestors
+    assert cache.minify(['', 'home', 'kevna', 'Downloads'], minify_dir) == '/h/k/D'
+    assert minify_dir.call_count == 5
+    assert cache.minify(['', 'home', 'kevna', 'Documents'], minify_dir) == '/h/k/D'
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert len(cache) == 4
+
+
+@patch('statusline.status._hilight', side_effect=lambda x: x)
+def test_minify_path_cached(mock, instance):
+    assert instance.minify_path('/etc/apt/sources.list.d') == '/e/a/sources.list.d'
+    assert instance.minify_path('/etc/apt/sources.list.d') == '/e/a/sources.list.d'
+    assert (instance.paths.hits, instance.paths.misses) == (1, 1)
+
+
 @pytest.mark.parametrize('path, expected', (
     ('/home/kevna', '~'),
     ('/home/kevna/.config', '~/.config'),
@@ -70,7 +92,7 @@ def test_minify_path_home(mock, path, expected, instance):
 def test__apply_vcs(mock, root, stats, path, expected, instance):
     instance.VCS.root_dir = root
     instance.VCS.short_stats.return_value = stats
-    actual = instance._apply_vcs(path)
+    actual = instance._apply_vcs(path, instance.VCS)
     assert actual == expected
 
 @pytest.mark.parametrize('root, stats, path, expected', (
@@ -86,10 +108,39 @@ def test__apply_vcs_with_branch(mock, root, stats, path, expected, instance):
     instance.VCS.root_dir = root
     instance.VCS.branch = 'feature/newfeature'
     instance.VCS.short_stats.return_value = stats
-    actual = instance._apply_vcs(path)
+    actual = instance._apply_vcs(path, instance.VCS)
     assert actual == expected
 
 
+@pytest.mark.parametrize('environ, expected', (
+    ({}, None),
+    ({'COLUMNS': '80'}, None),
+    ({'COLUMNS': '80', 'STATUSLINE_WIDTH': '50%'}, 40 - len('~/D/p/statusline/src')),
+    ({'STATUSLINE_WIDTH': '10'}, 0),
+))
+@patch('statusline.status._hilight', side_effect=lambda x: x)
+def test__apply_vcs_columns(mock, environ, expected, instance, monkeypatch):
+    # Repository segments get the width the path leaves
+    monkeypatch.delenv('COLUMNS', raising=False)
+    monkeypatch.delenv('STATUSLINE_WIDTH', raising=False)
+    for name, value in environ.items():
+        monkeypatch.setenv(name, value)
+    instance.VCS.root_dir = '~/Documents/python/statusline'
+    instance.VCS.short_stats.return_value = ''
+    instance._apply_vcs('~/Documents/python/statusline/src', instance.VCS)
+    instance.VCS.prefetch.assert_called_once_with(expected)
+    instance.VCS.short_stats.assert_called_once_with(expected)
+
+
+@patch('statusline.status._hilight', side_effect=lambda x: x)
+def test__apply_vcs_timeout(mock, instance):
+    instance.VCS.root_dir = '~/Documents/python/statusline/master'
+    type(instance.VCS).branch = PropertyMock(side_effect=TimeoutExpired(['git'], 0))
+    instance.VCS.short_stats.return_value = '\uE0A0master\u2026'
+    actual = instance._apply_vcs('~/Documents/python/statusline/master/statusline', instance.VCS)
+    assert actual == '~/D/p/s/master\uE0A0master\u2026/statusline'
+
+
 @patch('statusline.status.os.getcwd', return_value='/home/kevna/.local/share/chezmoi')
 @patch('statusline.status.DirectoryMinify._apply_vcs', return_value='~/.l/s/chezmoi')
 def test_get_statusline_git(mock_minify, mock_cwd, instance):
@@ -97,7 +148,7 @@ def test_get_statusline_git(mock_minify, mock_cwd, instance):
     actual = instance.get_statusline()
     assert actual == mock_minify.return_value
     assert instance.VCS.__bool__.called
-    mock_minify.assert_called_once_with(mock_cwd.return_value)
+    mock_minify.assert_called_once_with(mock_cwd.return_value, instance.VCS)
 
 
 @patch('statusline.status.os.getcwd', return_value='/home/kevna/.local/share/chezmoi')
@@ -108,3 +159,65 @@ def test_get_statusline_nogit(mock_minify, mock_cwd, instance):
     assert actual == mock_minify.return_value
     assert instance.VCS.__bool__.called
     mock_minify.assert_called_once_with(mock_cwd.return_value)
+
+
+@pytest.mark.parametrize('found', (True, False))
+@patch('statusline.status.DirectoryMinify._apply_vcs', return_value='~/.l/s/chezmoi')
+@patch('statusline.status.DirectoryMinify.minify_path', return_value='~/.l/s/chezmoi')
+def test_get_statusline_discover(mock_minify, mock_apply, found):
+    # Without an explicit VCS each path gets the selected backend for its own repository
+    vcs = MagicMock(spec=Git) if found else None
+    with patch('statusline.status._discover', return_value=vcs) as mock_discover:
+        assert DirectoryMinify().get_statusline('/repo/src') == '~/.l/s/chezmoi'
+    mock_discover.assert_called_once_with('/repo/src')
+    assert mock_apply.called == found
+    assert mock_minify.called != found
+
+
+@pytest.mark.parametrize('environ, chosen, backends', (
+    ({}, False, False),
+    ({'STATUSLINE_BACKEND': 'index'}, False, True),
+    ({}, True, True),
+))
+def test_discover(environ, chosen, backends, tmp_path):
+    # The backends module is only needed once a backend has been chosen
+    if chosen:
+        (tmp_path / 'statusline').mkdir()
+        (tmp_path / 'statusline' / 'backends.json').write_text('{}')
+    with patch.dict('os.environ', {**environ, 'XDG_CACHE_HOME': str(tmp_path)}, clear=True), \
+            patch('statusline.status.Git.discover') as mock_git, \
+            patch('statusline.backends.discover') as mock_backends:
+        actual = _discover('/repo/src')
+    expected = mock_backends if backends else mock_git
+    assert actual == expected.return_value
+    expected.assert_called_once_with('/repo/src')
+
+
+def test_get_statusline_refused(tmp_path, monkeypatch):
+    # An empty .git is discovered but git refuses it, so it is shown as a plain directory
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    (tmp_path / 'bogus' / '.git').mkdir(parents=True)
+    (tmp_path / 'bogus' / 'sub').mkdir()
+    path = str(tmp_path / 'bogus' / 'sub')
+    minify = DirectoryMinify(paths=PathCache())
+    with patch('statusline.backends.selected_backend', return_value=Git):
+        assert minify.get_statusline(path) == minify.minify_path(path)
+
+
+@pytest.mark.parametrize('path, base, expected, parents', (
+    (
+        '/home/kevna/Documents/python/x', '', '~/Doc/p/x',
+        ['/home/kevna', '/home/kevna/Documents'],
+    ),
+    ('/etc/apt/x', '', '/e/a/x', ['', '/etc']),
+    ('/src/.hidden/x', '/repo', '/s/.h/x', ['/repo', '/repo/src']),
+))
+@patch('statusline.status._hilight', side_effect=lambda x: x)
+def test_minify_path_unique(mock, path, base, expected, parents, instance):
+    instance.prefixes = MagicMock(spec=PrefixCache)
+    instance.prefixes.shorten.side_effect = lambda parent, name, minimum: (
+        'Doc' if name == 'Documents' else minimum
+    )
+    actual = instance.minify_path(path, home='/home/kevna', base=base)
+    assert actual == expected
+    assert [c.args[0] for c in instance.prefixes.shorten.call_args_list] == parents
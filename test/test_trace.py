@@ -0,0 +1,84 @@
+from subprocess import CalledProcessError, TimeoutExpired
+from unittest.mock import patch
+
+import pytest
+
+from statusline import trace
+
+
+@pytest.fixture()
+def trace_file(tmp_path):
+    path = str(tmp_path / 'trace.jsonl')
+    with patch.dict('statusline.trace.os.environ', {'STATUSLINE_TRACE': path}):
+        yield path
+
+
+def test_command_disabled(tmp_path):
+    with patch.dict('statusline.trace.os.environ', {}, clear=True):
+        with trace.command(['git', 'status']) as event:
+            event['bytes'] = 10
+    assert not list(tmp_path.iterdir())
+
+
+@pytest.mark.parametrize('error, expected_exit, expected_bytes', (
+    (None, 0, 10),
+    (CalledProcessError(128, 'git', output=b'fatal'), 128, 5),
+    (TimeoutExpired('git', 1), 'timeout', 0),
+))
+def test_command(error, expected_exit, expected_bytes, trace_file):
+    with pytest.raises(type(error)) if error else patch.dict({}):
+        with trace.command(['git', 'status']) as event:
+            if error:
+                raise error
+            event['bytes'] = 10
+    actual = trace.load(trace_file)[-1]
+    assert actual['argv'] == ['git', 'status']
+    assert (actual['exit'], actual['bytes']) == (expected_exit, expected_bytes)
+    assert actual['ms'] >= 0
+
+
+def test_phase(trace_file):
+    @trace.phase('outer', render=True)
+    def outer():
+        return inner()
+
+    @trace.phase('inner')
+    def inner():
+        return 'result'
+
+    assert outer() == 'result'
+    assert outer() == 'result'
+    actual = trace.load(trace_file)
+    assert [event['name'] for event in actual] == ['inner', 'outer', 'inner', 'outer']
+    assert actual[0]['render'] + 1 == actual[2]['render']
+
+
+def test_load_partial(trace_file):
+    with open(trace_file, 'w', encoding='utf-8') as file:
+        file.write('{"type": "phase", "name": "render", "ms": 1}\n{"type": "comm')
+    assert len(trace.load(trace_file)) == 1
+
+
+def test_summarise():
+    symbolic_ref = ['git', 'symbolic-ref', 'HEAD']
+    events = [
+        {'type': 'command', 'argv': symbolic_ref, 'ms': 2, 'pid': 1, 'render': 1},
+        {'type': 'command', 'argv': symbolic_ref, 'ms': 2, 'pid': 1, 'render': 1},
+        {'type': 'command', 'argv': ['git', 'status'], 'ms': 10, 'pid': 1, 'render': 1},
+        {'type': 'command', 'argv': symbolic_ref, 'ms': 2, 'pid': 2, 'render': 1},
+        {'type': 'phase', 'name': 'short_stats', 'ms': 15, 'pid': 1, 'render': 1},
+    ]
+    assert trace.summarise(events).split('\n') == [
+        '  calls   total ms   mean ms  name',
+        '      1       15.0     15.00  [short_stats]',
+        '      1       10.0     10.00  git status',
+        '      3        6.0      2.00  git symbolic-ref HEAD',
+        '',
+        'repeated within a render:',
+        '  git symbolic-ref HEAD up to 2x in 1 renders',
+    ]
+
+
+def test_profile_unset():
+    with patch.dict('statusline.trace.os.environ', {}, clear=True), pytest.raises(SystemExit):
+        trace.profile()
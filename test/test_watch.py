@@ -0,0 +1,164 @@
+import os
+import subprocess
+from unittest.mock import patch
+
+import pytest
+
+from statusline import bench
+from statusline.git import Repository
+from statusline.watch import Inotify, Watcher
+
+
+@pytest.fixture()
+def repository(tmp_path):
+    git_dir = tmp_path / 'repo' / '.git'
+    (git_dir / 'refs' / 'heads').mkdir(parents=True)
+    (git_dir / 'HEAD').write_text('ref: refs/heads/master\n')
+    (git_dir / 'refs' / 'heads' / 'master').write_text('1a2b3c\n')
+    (git_dir / 'index').write_text('DIRC')
+    (tmp_path / 'repo' / 'src').mkdir()
+    return Repository(str(tmp_path / 'repo'), str(git_dir))
+
+
+@pytest.fixture()
+def watcher():
+    result = Watcher()
+    if result._inotify is None:
+        pytest.skip('inotify is not available')
+    yield result
+    result.close()
+
+
+def test_inotify(tmp_path):
+    inotify = Inotify()
+    try:
+        descriptor = inotify.add(str(tmp_path), 0x100)
+        assert not inotify.read()
+        (tmp_path / 'created').write_text('')
+        assert inotify.read() == [(descriptor, 0x100, 'created')]
+    finally:
+        inotify.close()
+
+
+def test_dirty(watcher, repository):
+    assert watcher.dirty(repository)
+    assert not watcher.dirty(repository)
+
+
+@pytest.mark.parametrize('name, expected', (
+    ('file', True),
+    ('src/file', True),
+    ('.git/index', True),
+    ('.git/refs/heads/master', True),
+    ('.git/description', False),
+    ('.git/refs/heads/other', False),
+))
+def test_dirty_events(name, expected, watcher, repository):
+    watcher.dirty(repository)
+    with open(os.path.join(repository.worktree, name), 'w', encoding='utf-8') as file:
+        file.write('changed')
+    assert watcher.dirty(repository) == expected
+    assert not watcher.dirty(repository)
+
+
+def test_dirty_new_directory(watcher, repository):
+    watcher.dirty(repository)
+    os.mkdir(os.path.join(repository.worktree, 'new'))
+    assert watcher.dirty(repository)
+    # The new directory is watched as soon as its creation is seen
+    with open(os.path.join(repository.worktree, 'new', 'file'), 'w', encoding='utf-8'):
+        pass
+    assert watcher.dirty(repository)
+
+
+def test_dirty_missing_state(watcher, repository):
+    # The stash log doesn't exist until the first stash so its ancestor is watched
+    watcher.dirty(repository)
+    os.makedirs(os.path.join(repository.git_dir, 'logs', 'refs'))
+    assert watcher.dirty(repository)
+
+
+def git(cwd, *args):
+    subprocess.run(
+        ['git', *args], cwd=cwd, check=True, capture_output=True,
+        env={**os.environ, **bench.GIT_ENV},
+    )
+
+
+def test_dirty_worktrees(watcher, tmp_path):
+    # Sibling worktrees share watches on the common dir, each is told of its events
+    main = bench.build(bench.Scenario(tracked=3), str(tmp_path / 'main'))
+    git(main, 'worktree', 'add', '-q', '-b', 'linked', str(tmp_path / 'linked'))
+    for name, branch in ((main, 'master'), (str(tmp_path / 'linked'), 'linked')):
+        git(name, 'config', f'branch.{branch}.remote', 'origin')
+        git(name, 'config', f'branch.{branch}.merge', f'refs/heads/{branch}')
+    repositories = [Repository.discover(main), Repository.discover(str(tmp_path / 'linked'))]
+    for found in repositories:
+        watcher.dirty(found)
+        assert not watcher.dirty(found)
+    git(str(tmp_path / 'linked'), 'commit', '-q', '--allow-empty', '-m', 'linked')
+    assert [watcher.dirty(found) for found in repositories] == [False, True]
+    git(main, 'update-ref', 'refs/remotes/origin/master', 'linked')
+    assert [watcher.dirty(found) for found in repositories] == [True, False]
+    # Releasing one worktree leaves the watches the other still needs
+    watcher._release(watcher._repos[repositories[1].worktree])
+    git(main, 'update-ref', 'refs/remotes/origin/master', 'master')
+    assert watcher.dirty(repositories[0])
+
+
+def test_ignored(watcher, tmp_path):
+    # Ignored build output isn't walked or watched
+    main = bench.build(bench.Scenario(tracked=3), str(tmp_path / 'main'))
+    with open(os.path.join(main, '.gitignore'), 'w', encoding='utf-8') as file:
+        file.write('build/\n')
+    os.makedirs(os.path.join(main, 'build', 'deep', 'er'))
+    watcher.dirty(Repository.discover(main))
+    paths = [path for path, _ in watcher._watches.values()]
+    assert main in paths
+    assert not [path for path in paths if 'build' in path]
+    os.mkdir(os.path.join(main, 'build', 'new'))
+    os.mkdir(os.path.join(main, 'out'))
+    watcher.dirty(Repository.discover(main))
+    assert os.path.join(main, 'out') in [path for path, _ in watcher._watches.values()]
+
+
+def test_limit(repository):
+    limited = Watcher(limit=2, ttl=60)
+    assert limited.dirty(repository)
+    assert not limited._watches
+    # Over the limit the stat signature of the state files is used instead
+    assert not limited.dirty(repository)
+    with open(os.path.join(repository.git_dir, 'index'), 'w', encoding='utf-8') as file:
+        file.write('DIRC changed')
+    assert limited.dirty(repository)
+    limited.close()
+
+
+@patch('statusline.watch.Inotify', side_effect=OSError(38, 'inotify is not available'))
+def test_no_inotify(mock, repository):
+    fallback = Watcher(ttl=0)
+    assert fallback.dirty(repository)
+    # With no ttl every check is dirty as working tree edits can't be seen
+    assert fallback.dirty(repository)
+
+
+def test_idle(repository):
+    idle = Watcher(idle=0)
+    idle.dirty(repository)
+    other = Repository(repository.worktree + '/src', repository.git_dir)
+    idle.dirty(other)
+    assert list(idle._repos) == [other.worktree]
+    idle.close()
+
+
+@pytest.mark.parametrize('environ, expected', (
+    ({}, 8192),
+    ({'STATUSLINE_WATCH_LIMIT': '100'}, 100),
+    ({'STATUSLINE_WATCH': 'off'}, None),
+))
+def test_from_environ(environ, expected):
+    with patch.dict('statusline.watch.os.environ', environ, clear=True):
+        actual = Watcher.from_environ()
+    assert (actual and actual.limit) == expected
+    if actual:
+        actual.close()